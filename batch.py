@@ -0,0 +1,90 @@
+#
+# batch.py: solves large batches of rat path queries across a pool of
+#   worker processes.
+#
+# The dungeon is written once in the binary dungeon format (see
+# dungeon_file.py), in shared memory (/dev/shm) where the system has it.
+# Each worker maps that one file read-only when it starts, so the map is
+# never pickled and all workers share the same pages.  Queries are sent in
+# chunks of room names and algorithm codes, and answers come back as lists
+# of room names in the order the queries were given, with a message in
+# place of the list for a query naming an unknown room or algorithm.
+#
+
+from dungeon import Dungeon
+from dungeon_file import MappedDungeon, write_dungeon_file
+from typing import *
+import index_search
+import multiprocessing
+import os
+import tempfile
+
+SEARCHES = {'d': index_search.dfs, 'b': index_search.bfs,
+            'i': index_search.iterative_deepening}
+
+_worker_dungeon: Optional[MappedDungeon] = None
+
+
+def solve(mapped: MappedDungeon, queries: List[Tuple[str, str, str]]
+          ) -> List[Union[List[str], str]]:
+    """Answers each (start name, target name, algorithm code) query over a
+    mapped dungeon with the names on the path, as Rat.directions_to,
+    bfs_directions_to or id_directions_to would for codes 'd', 'b' and 'i'.
+    A query naming a room that is not registered with the dungeon, or an
+    unknown algorithm, is answered with a message saying so instead. Rooms
+    in different weak components are answered without searching."""
+    results: List[Union[List[str], str]] = []
+    for start_name, target_name, algorithm in queries:
+        unknown = [name for name in [start_name, target_name]
+                   if not mapped.has(name)]
+        if len(unknown) != 0:
+            results.append("unknown room: " + unknown[0])
+            continue
+        if algorithm not in SEARCHES:
+            results.append("invalid algorithm code: " + str(algorithm))
+            continue
+        start = mapped.id_of(start_name)
+        goal = mapped.id_of(target_name)
+        if mapped.components[start] != mapped.components[goal]:
+            results.append([])
+        else:
+            path = SEARCHES[algorithm](mapped, start, goal)
+            results.append([mapped.names[x] for x in path])
+    return results
+
+
+def _open_worker(path: str) -> None:
+    global _worker_dungeon
+    _worker_dungeon = MappedDungeon(path)
+
+
+def _solve_chunk(queries: List[Tuple[str, str, str]]
+                 ) -> List[Union[List[str], str]]:
+    return solve(_worker_dungeon, queries)
+
+
+def solve_batch(d: Dungeon, queries: List[Tuple[str, str, str]],
+                processes: Optional[int] = None,
+                chunk_size: int = 256) -> List[Union[List[str], str]]:
+    """Answers a batch of (start name, target name, algorithm code) queries
+    on dungeon d using a pool of processes (one per core by default),
+    returning the room names on each path in the order of the queries, or
+    for a query that cannot be answered the message solve gives. With one
+    process the queries are answered in this process."""
+    folder = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    handle, path = tempfile.mkstemp(suffix=".dungeon", dir=folder)
+    os.close(handle)
+    try:
+        write_dungeon_file(d, path)
+        if processes == 1:
+            with MappedDungeon(path) as mapped:
+                return solve(mapped, queries)
+        chunks = [queries[i:i + chunk_size]
+                  for i in range(0, len(queries), chunk_size)]
+        with multiprocessing.Pool(processes, _open_worker, (path,)) as pool:
+            results = []
+            for answers in pool.imap(_solve_chunk, chunks):
+                results.extend(answers)
+            return results
+    finally:
+        os.remove(path)
@@ -0,0 +1,434 @@
+#
+# bench_rat.py: timing runs for the rat search algorithms on dungeons much
+#   larger than the ones built in test_dungeons_two.
+#
+# Run with: python bench_rat.py
+#
+
+from dungeon import Dungeon, Room, Direction, read_dungeon_from_stream
+from hazard_search import HazardCosts
+from dungeon_file import MappedDungeon, write_dungeon_file
+from dungeon_shards import ShardedDungeon, write_sharded_dungeon
+from batch import solve_batch
+import distances
+import dungeon_builders
+from rat import Rat
+from search_observers import SearchMetrics
+from typing import *
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+
+def chain_dungeon(length: int) -> Dungeon:
+    """Return a dungeon of length rooms in a line running east, plus a room
+    named 'unconnected' that cannot be reached from the start."""
+    d = dungeon_builders.chain_dungeon(length)
+    d.add_room(Room("unconnected", 1))
+    return d
+
+
+def grid_dungeon(rows: int, cols: int) -> Dungeon:
+    """Return a fully connected rows by cols grid of rooms named "row,col"
+    starting at "0,0", plus a room named 'unconnected'."""
+    d = dungeon_builders.grid_dungeon(rows, cols)
+    d.add_room(Room("unconnected", 1))
+    return d
+
+
+def rooms_expanded(rat: Rat, search: Callable[[Room], Any],
+                   target: Room) -> int:
+    """Return the number of rooms visited by one of rat's searches."""
+    metrics = SearchMetrics()
+    rat.add_observer(metrics)
+    search(target)
+    rat.remove_observer(metrics)
+    return metrics.rooms_expanded
+
+
+def time_call(f: Callable[[], Any]) -> float:
+    """Return the wall time in seconds taken by calling f."""
+    begin = time.perf_counter()
+    f()
+    return time.perf_counter() - begin
+
+
+def bench_build(n: int) -> None:
+    """Time building an n by n grid a passage at a time with add_neighbor
+    and in bulk with dungeon_builders, and measure the memory the whole
+    bulk-built dungeon takes per room, as built and once a first has_path
+    query has built its reachability index."""
+    def per_passage() -> None:
+        rooms = [Room("%d,%d" % (row, col), 1)
+                 for row in range(n) for col in range(n)]
+        d = Dungeon(rooms[0])
+        for room in rooms[1:]:
+            d.add_room(room)
+        for i, room in enumerate(rooms):
+            if i >= n:
+                room.add_neighbor(rooms[i - n], Direction.NORTH)
+            if i % n != 0:
+                room.add_neighbor(rooms[i - 1], Direction.WEST)
+    tracemalloc.start()
+    d = dungeon_builders.grid_dungeon(n, n)
+    built_bytes = tracemalloc.get_traced_memory()[0] / d.size()
+    d.has_path(d.start, d.room(d.size() - 1))
+    queried_bytes = tracemalloc.get_traced_memory()[0] / d.size()
+    tracemalloc.stop()
+    del d
+    print("grid %-19s per passage=%8.4fs bulk=%8.4fs "
+          "built=%4d B/room queried=%4d B/room"
+          % ("%dx%d" % (n, n), time_call(per_passage),
+             time_call(lambda: dungeon_builders.grid_dungeon(n, n)),
+             built_bytes, queried_bytes))
+
+
+def bench_unreachable(d: Dungeon, label: str) -> None:
+    """Time iterative deepening and breadth-first search for a room that
+    cannot be reached from the start of d. Iterative deepening stops after
+    the first pass that is not cut off, so it costs one pass per step of the
+    start's eccentricity rather than one full search per room in the
+    dungeon. The room is one d does not know, so Dungeon.has_path cannot
+    rule it out and both searches run until they have seen every room."""
+    rat = Rat(d, d.start)
+    goal = Room("outside", 1)
+    id_time = time_call(lambda: rat.id_path_to(goal))
+    bfs_time = time_call(lambda: rat.bfs_path_to(goal))
+    print("%-24s rooms=%-8d id=%8.4fs bfs=%8.4fs id/bfs=%6.1f"
+          % (label, d.size(), id_time, bfs_time, id_time / bfs_time))
+
+
+def bench_bidirectional(d: Dungeon, start: str, goal: str,
+                        label: str) -> None:
+    """Compare the rooms expanded and time taken by breadth-first and
+    bidirectional search between two rooms of d, both over a frozen index."""
+    rat = Rat(d, d.find(start))
+    rat.set_index(d.freeze())
+    target = d.find(goal)
+    assert len(rat.bfs_path_to(target)) == len(rat.bidirectional_path_to(target))
+    bfs_time = time_call(lambda: rat.bfs_path_to(target))
+    bidirectional_time = time_call(lambda: rat.bidirectional_path_to(target))
+    bfs_rooms = rooms_expanded(rat, rat.bfs_path_to, target)
+    bidirectional_rooms = rooms_expanded(rat, rat.bidirectional_path_to,
+                                         target)
+    print("%-24s bfs=%-8d bidirectional=%-8d (%5.1fx fewer) "
+          "bfs=%7.4fs bidirectional=%7.4fs"
+          % (label, bfs_rooms, bidirectional_rooms,
+             bfs_rooms / bidirectional_rooms, bfs_time, bidirectional_time))
+
+
+def bench_load(d: Dungeon, goal: str, label: str) -> None:
+    """Compare the time to load d from JSON and to map it from a binary
+    dungeon file, and the time for a first breadth-first search to the goal
+    room across the mapped file."""
+    with tempfile.TemporaryDirectory() as folder:
+        json_path = os.path.join(folder, "dungeon.json")
+        binary_path = os.path.join(folder, "dungeon.bin")
+        with open(json_path, "w") as out:
+            d.write_json(out)
+        write_dungeon_file(d, binary_path)
+        with open(json_path) as source:
+            json_time = time_call(lambda: read_dungeon_from_stream(source))
+        begin = time.perf_counter()
+        mapped = MappedDungeon(binary_path)
+        map_time = time.perf_counter() - begin
+        rat = Rat(mapped, mapped.start)
+        rat.set_index(mapped)
+        target = mapped.find(goal)
+        search_time = time_call(lambda: rat.bfs_path_to(target))
+        del rat, target
+        mapped.close()
+    print("%-24s json load=%8.4fs map=%8.6fs first search=%8.4fs"
+          % (label, json_time, map_time, search_time))
+
+
+def bench_distances(d: Dungeon, label: str) -> None:
+    """Compare the time for distances from the start to every room of d,
+    computed a layer at a time with NumPy (when installed) and with the
+    plain Python loop."""
+    index = d.freeze()
+    python_time = time_call(
+        lambda: distances._python_distances(index, [0], None))
+    if distances.numpy is None:
+        print("%-24s python=%8.4fs (NumPy not installed)"
+              % (label, python_time))
+        return
+    numpy_time = time_call(lambda: distances.bfs_distances(index, 0))
+    print("%-24s python=%8.4fs numpy=%8.4fs speedup=%6.1fx"
+          % (label, python_time, numpy_time, python_time / numpy_time))
+
+
+def bench_batch(d: Dungeon, count: int, label: str) -> None:
+    """Time solving count random breadth-first queries on d with one process
+    and then with up to one process per core, showing the speedup from
+    each added process."""
+    rng = random.Random(0)
+    names = [r.name for r in d.rooms()]
+    queries = [(rng.choice(names), rng.choice(names), 'b')
+               for i in range(count)]
+    single = time_call(lambda: solve_batch(d, queries, processes=1))
+    print("%-24s processes=1 %8.4fs" % (label, single))
+    processes = 2
+    while processes <= max(2, multiprocessing.cpu_count()):
+        elapsed = time_call(lambda: solve_batch(d, queries, processes))
+        print("%-24s processes=%-1d %8.4fs speedup=%5.2fx"
+              % (label, processes, elapsed, single / elapsed))
+        processes *= 2
+
+
+def bench_dynamic(n: int, edits: int) -> None:
+    """Time answering a breadth-first query to the far corner of an n by n
+    grid after each of a series of cave-ins and reopenings, by repairing a
+    tracked search tree and by searching again."""
+    rng = random.Random(0)
+    changes = []
+    for i in range(edits):
+        room = "%d,%d" % (rng.randrange(1, n - 1), rng.randrange(1, n - 1))
+        changes.append((room, rng.choice([Direction.NORTH, Direction.WEST])))
+    goal = "%d,%d" % (n - 1, n - 1)
+    times = []
+    for tracking in [False, True]:
+        d = grid_dungeon(n, n)
+        rat = Rat(d, d.start)
+        if tracking:
+            rat.track_paths()
+
+        def edit_and_query():
+            for name, direction in changes:
+                room = d.find(name)
+                other = room.neighbor_to(direction)
+                room.remove_neighbor(direction)
+                rat.bfs_path_to(d.find(goal))
+                room.add_neighbor(other, direction)
+                rat.bfs_path_to(d.find(goal))
+
+        times.append(time_call(edit_and_query))
+    print("%-24s edits=%-6d search=%8.4fs repair=%8.4fs speedup=%6.1fx"
+          % ("grid %dx%d" % (n, n), 2 * edits, times[0], times[1],
+             times[0] / times[1]))
+
+
+def bench_resumable(d: Dungeon, goal: str, budget: float,
+                    label: str) -> None:
+    """Compare the time for a blocking breadth-first search to the goal room
+    of d with the total time for the same search run in slices of budget
+    seconds, and show the longest slice."""
+    rat = Rat(d, d.start)
+    target = d.find(goal)
+    d.has_path(d.start, target)  # build the reachability index up front
+    blocking = time_call(lambda: rat.bfs_path_to(target))
+    search = rat.start_search(target, 'b')
+    slices = []
+    path = None
+    while path is None:
+        begin = time.perf_counter()
+        path = search.run(seconds=budget)
+        slices.append(time.perf_counter() - begin)
+    print("%-24s blocking=%8.4fs sliced=%8.4fs slices=%-5d longest=%7.4fs"
+          % (label, blocking, sum(slices), len(slices), max(slices)))
+
+
+def bench_levels(levels: int, side: int, count: int) -> None:
+    """Time count breadth-first and hierarchical queries between rooms at
+    most two levels apart in a stack of side by side grids joined by three
+    stairs, and the time to build the level abstraction."""
+    d = dungeon_builders.stacked_dungeon(
+        levels, side, side, [(0, side - 1), (side - 1, 0),
+                             (side // 2, side // 2)])
+    rng = random.Random(0)
+    queries = []
+    for i in range(count):
+        level = rng.randint(1, levels - 2)
+        queries.append((d.find("%d:%d,%d" % (level, rng.randrange(side),
+                                             rng.randrange(side))),
+                        d.find("%d:%d,%d" % (level + rng.randint(0, 2),
+                                             rng.randrange(side),
+                                             rng.randrange(side)))))
+    build = time_call(d.enable_level_paths)
+    bfs = time_call(lambda: [Rat(d, a).bfs_path_to(b) for a, b in queries])
+    hierarchical = time_call(lambda: [Rat(d, a).hierarchical_path_to(b)
+                                      for a, b in queries])
+    print("%-24s queries=%-4d build=%7.4fs bfs=%8.4fs hierarchical=%8.4fs "
+          "speedup=%5.1fx" % ("levels %dx%dx%d" % (levels, side, side),
+                              count, build, bfs, hierarchical,
+                              bfs / hierarchical))
+
+
+def bench_snapshots(n: int, edits: int) -> None:
+    """Time taking a snapshot of an n by n grid against freezing it, and a
+    breadth-first search across it on the live rooms against one pinned to
+    a snapshot taken before edits passages are moved."""
+    d = grid_dungeon(n, n)
+    goal = d.find("%d,%d" % (n - 1, n - 1))
+    d.snapshot().release()  # start the log
+    snapshot = time_call(lambda: d.snapshot().release())
+    freeze = time_call(d.freeze)
+    pinned = d.snapshot()
+    rng = random.Random(0)
+    rooms = list(d.rooms())
+    for i in range(edits):
+        a, b = rng.sample(rooms, 2)
+        a.remove_neighbor(Direction.EAST)
+        a.add_neighbor(b, Direction.EAST)
+    rat = Rat(d, d.start)
+    rat.bfs_path_to(goal)  # build the reachability index up front
+    live = time_call(lambda: rat.bfs_path_to(goal))
+    rat.pin(pinned)
+    search = time_call(lambda: rat.bfs_path_to(goal))
+    print("%-24s snapshot=%8.6fs freeze=%7.4fs bfs live=%7.4fs "
+          "pinned=%7.4fs edits kept=%d"
+          % ("snapshots %dx%d" % (n, n), snapshot, freeze, live, search,
+             d.snapshot_log.kept()))
+
+
+def bench_shards(levels: int, side: int, max_shards: int) -> None:
+    """Time breadth-first searches up one level at a time through a stack
+    of side by side grids joined by stairs at two corners, stored as one
+    shard per level with at most max_shards in memory, with and without
+    reading ahead, against the same searches in memory."""
+    d = dungeon_builders.stacked_dungeon(
+        levels, side, side, [(0, 0), (side - 1, side - 1)])
+    queries = [("%d:%d,%d" % (level, side // 2, side // 2),
+                "%d:0,0" % (level + 1)) for level in range(1, levels)]
+    with tempfile.TemporaryDirectory() as folder:
+        write = time_call(lambda: write_sharded_dungeon(d, folder))
+        memory = time_call(lambda: [Rat(d, d.find(a)).bfs_path_to(d.find(b))
+                                    for a, b in queries])
+        for prefetch in [False, True]:
+            with ShardedDungeon(folder, max_shards, prefetch) as sharded:
+                seconds = time_call(lambda: [
+                    Rat(sharded, sharded.find(a)).bfs_path_to(
+                        sharded.find(b)) for a, b in queries])
+                print("%-24s write=%6.3fs memory=%7.4fs sharded=%7.4fs "
+                      "prefetch=%-5s hit rate=%5.3f misses=%d read ahead=%d"
+                      % ("shards %dx%dx%d" % (levels, side, side), write,
+                         memory, seconds, prefetch, sharded.hit_rate(),
+                         sharded.misses, sharded.prefetch_hits))
+
+
+def bench_corridors(side: int, length: int, count: int) -> None:
+    """Time count breadth-first queries between random rooms of a side by
+    side grid of junctions joined by corridors of length rooms, searching
+    room by room and then over the corridor overlay, and the time to build
+    the overlay."""
+    d = dungeon_builders.corridor_dungeon(side, side, length)
+    rooms = list(d.rooms())
+    rng = random.Random(0)
+    queries = [(rng.choice(rooms), rng.choice(rooms)) for i in range(count)]
+    bfs = time_call(lambda: [Rat(d, a).bfs_path_to(b) for a, b in queries])
+    build = time_call(d.enable_corridors)
+    overlay = time_call(lambda: [Rat(d, a).bfs_path_to(b)
+                                 for a, b in queries])
+    print("%-24s queries=%-4d build=%7.4fs bfs=%8.4fs overlay=%8.4fs "
+          "speedup=%5.1fx" % ("corridors %dx%d by %d" % (side, side, length),
+                              count, build, bfs, overlay, bfs / overlay))
+
+
+def bench_astar(d: Dungeon, start: str, goal: str, label: str) -> None:
+    """Compare the rooms expanded and time taken by breadth-first and A*
+    search between two rooms of d, and the time to lay out the region
+    A* searches."""
+    rat = Rat(d, d.find(start))
+    target = d.find(goal)
+    layout = time_call(lambda: d.enable_layout().region(d.find(start)))
+    assert len(rat.bfs_path_to(target)) == len(rat.astar_path_to(target))
+    bfs_time = time_call(lambda: rat.bfs_path_to(target))
+    astar_time = time_call(lambda: rat.astar_path_to(target))
+    bfs_rooms = rooms_expanded(rat, rat.bfs_path_to, target)
+    astar_rooms = rooms_expanded(rat, rat.astar_path_to, target)
+    print("%-24s bfs=%-8d astar=%-8d (%5.1fx fewer) layout=%7.4fs "
+          "bfs=%7.4fs astar=%7.4fs"
+          % (label, bfs_rooms, astar_rooms, bfs_rooms / astar_rooms, layout,
+             bfs_time, astar_time))
+
+
+def bench_hazards(n: int) -> None:
+    """Time a breadth-first search across an n by n grid and safest path
+    searches with no hazards, with one room avoided and with a trap or
+    monster in one room in twenty."""
+    d = grid_dungeon(n, n)
+    rat = Rat(d, d.start)
+    goal = d.find("%d,%d" % (n - 1, n - 1))
+    rat.bfs_path_to(goal)  # build the reachability index up front
+    bfs = time_call(lambda: rat.bfs_path_to(goal))
+    clear = time_call(lambda: rat.safest_path_to(goal))
+    avoiding = time_call(lambda: rat.safest_path_to(goal, avoid=[
+        d.find("%d,%d" % (n // 2, n // 2))]))
+    rng = random.Random(0)
+    for room in rng.sample(list(d.rooms()), n * n // 20):
+        if rng.random() < 0.5:
+            room.trap = rng.choice(["spikes", "pit"])
+        else:
+            room.monster = "troll"
+    costs = HazardCosts({"spikes": 3})
+    hazards = time_call(lambda: rat.safest_path_to(goal, costs))
+    print("%-24s bfs=%8.4fs no hazards=%8.4fs avoiding=%8.4fs "
+          "hazards=%8.4fs" % ("grid %dx%d" % (n, n), bfs, clear, avoiding,
+                              hazards))
+
+
+def main() -> int:
+    """Run each benchmark and print the results."""
+    print("Building grids a passage at a time versus in bulk:")
+    for n in [100, 300]:
+        bench_build(n)
+    print("A* versus breadth-first search (rooms expanded):")
+    for n in [100, 300]:
+        bench_astar(grid_dungeon(n, n), "%d,%d" % (n // 10, n // 10),
+                    "%d,%d" % (n - 1, n - 1), "grid %dx%d" % (n, n))
+    bench_astar(dungeon_builders.stacked_dungeon(10, 50, 50, [(0, 0),
+                                                              (49, 49)]),
+                "1:10,10", "10:40,40", "stacked 10x50x50")
+    print("Searches up a stack of levels stored as shards versus memory:")
+    for levels in [10, 30]:
+        bench_shards(levels, 40, 6)
+    print("Snapshots versus freezing, and searches pinned to them:")
+    for n in [100, 300]:
+        bench_snapshots(n, 1000)
+    print("Breadth-first search over corridors versus room by room:")
+    for length in [2, 8]:
+        bench_corridors(30, length, 100)
+    print("Safest paths versus breadth-first search:")
+    for n in [100, 300]:
+        bench_hazards(n)
+    print("Hierarchical versus breadth-first search over levels:")
+    for levels in [10, 50]:
+        bench_levels(levels, 30, 50)
+    print("Breadth-first search in 2ms slices versus blocking:")
+    for n in [100, 300]:
+        bench_resumable(grid_dungeon(n, n), "%d,%d" % (n - 1, n - 1), 0.002,
+                        "grid %dx%d" % (n, n))
+    print("Queries after cave-ins, searching again versus repairing:")
+    for n in [50, 100]:
+        bench_dynamic(n, 100)
+    print("Batch queries across processes (%d cores):"
+          % multiprocessing.cpu_count())
+    bench_batch(grid_dungeon(100, 100), 500, "grid 100x100")
+    print("Distances to every room from the start:")
+    for n in [100, 300, 1000]:
+        bench_distances(grid_dungeon(n, n), "grid %dx%d" % (n, n))
+    print("Loading from JSON versus mapping the binary format:")
+    for n in [100, 300]:
+        bench_load(grid_dungeon(n, n), "%d,%d" % (n - 1, n - 1),
+                   "grid %dx%d" % (n, n))
+    print("Bidirectional versus breadth-first search (rooms expanded):")
+    for n in [100, 300]:
+        bench_bidirectional(grid_dungeon(n, n), "%d,%d" % (n // 4, n // 4),
+                            "%d,%d" % (3 * n // 4, 3 * n // 4),
+                            "grid %dx%d" % (n, n))
+    for n in [10000, 100000]:
+        bench_bidirectional(dungeon_builders.random_dungeon(n, 2 * n),
+                            "0", "1", "random " + str(n))
+    print("Iterative deepening on unreachable targets:")
+    for n in [500, 1000, 2000]:
+        bench_unreachable(chain_dungeon(n), "chain " + str(n))
+    for n in [20, 50, 100]:
+        bench_unreachable(grid_dungeon(n, n), "grid %dx%d" % (n, n))
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
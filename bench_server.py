@@ -0,0 +1,162 @@
+#
+# bench_server.py: load generator for path_server.py, measuring the
+#   throughput and latency of path queries over a socket.
+#
+# Opens a number of connections, each keeping a window of requests in
+# flight, and sends random queries between the dungeon's rooms.  Starting
+# rooms are drawn from a small set so that the server has breadth-first
+# requests to coalesce.  Prints the requests answered per second and the
+# median, 99th percentile and worst latency.
+#
+# Run against a server that is already running with, for example:
+#   python bench_server.py dungeon.json --port 8765
+# or, to build a grid and start a server for it in another process:
+#   python bench_server.py --grid 100
+#
+
+from typing import *
+import argparse
+import asyncio
+import dungeon_builders
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def make_queries(names: List[str], count: int, starts: int, algorithm: str,
+                 seed: int = 0) -> List[Dict[str, Any]]:
+    """Return count requests between random rooms named in names, starting
+    from one of the first few of starts randomly chosen rooms."""
+    rng = random.Random(seed)
+    first = [rng.choice(names) for i in range(starts)]
+    return [{"id": i, "start": rng.choice(first),
+             "target": rng.choice(names), "algorithm": algorithm}
+            for i in range(count)]
+
+
+async def run_connection(open_connection: Callable[[], Awaitable],
+                         queries: List[Dict[str, Any]], window: int,
+                         latencies: List[float]) -> None:
+    """Send queries over one connection with up to window of them waiting
+    for an answer, adding the latency of each to latencies."""
+    reader, writer = await open_connection()
+    sent: Dict[int, float] = {}
+    waiting = iter(queries)
+
+    def send_next() -> None:
+        query = next(waiting, None)
+        if query is not None:
+            sent[query["id"]] = time.perf_counter()
+            writer.write((json.dumps(query) + "\n").encode())
+
+    for i in range(window):
+        send_next()
+    await writer.drain()
+    while len(sent) != 0:
+        response = json.loads(await reader.readline())
+        latencies.append(time.perf_counter() - sent.pop(response["id"]))
+        assert "path" in response, response.get("error")
+        send_next()
+        await writer.drain()
+    writer.close()
+    await writer.wait_closed()
+
+
+async def run_load(open_connection: Callable[[], Awaitable],
+                   queries: List[Dict[str, Any]], connections: int,
+                   window: int) -> Tuple[float, List[float]]:
+    """Send queries spread over the given number of connections and return
+    the seconds taken and the latency of each query."""
+    latencies: List[float] = []
+    begin = time.perf_counter()
+    await asyncio.gather(*[
+        run_connection(open_connection, queries[i::connections], window,
+                       latencies)
+        for i in range(connections)])
+    return time.perf_counter() - begin, latencies
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Return the value below which the given fraction of values fall."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def wait_for_socket(path: str, server: subprocess.Popen) -> None:
+    """Wait for a server started in another process to create its socket."""
+    while not os.path.exists(path):
+        assert server.poll() is None, "the server failed to start"
+        time.sleep(0.05)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run the load described on the command line and print the results."""
+    parser = argparse.ArgumentParser(
+        description="Measure path_server throughput and latency.")
+    parser.add_argument("dungeon", nargs="?",
+                        help="dungeon JSON file the server is serving")
+    parser.add_argument("--grid", type=int,
+                        help="serve an n by n grid from a new server instead")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="connect to this Unix socket instead")
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--connections", type=int, default=16)
+    parser.add_argument("--window", type=int, default=4,
+                        help="requests in flight on each connection")
+    parser.add_argument("--starts", type=int, default=8,
+                        help="number of different start rooms")
+    parser.add_argument("--algorithm", default='b', choices=list("dbi"))
+    args = parser.parse_args(argv)
+    assert (args.dungeon is None) != (args.grid is None), \
+        "Give either a dungeon file or --grid"
+    folder = tempfile.TemporaryDirectory()
+    server = None
+    try:
+        if args.grid is not None:
+            d = dungeon_builders.grid_dungeon(args.grid, args.grid)
+            names = [r.name for r in d.rooms()]
+            dungeon_path = os.path.join(folder.name, "dungeon.json")
+            with open(dungeon_path, "w") as out:
+                d.write_json(out)
+            args.unix = os.path.join(folder.name, "server.sock")
+            server = subprocess.Popen(
+                [sys.executable, os.path.join(os.path.dirname(
+                    os.path.abspath(__file__)), "path_server.py"),
+                 dungeon_path, "--unix", args.unix],
+                stdout=subprocess.DEVNULL)
+            wait_for_socket(args.unix, server)
+        else:
+            with open(args.dungeon) as source:
+                names = [room["name"] for room in json.load(source)["rooms"]]
+        if args.unix is not None:
+            def open_connection():
+                return asyncio.open_unix_connection(args.unix, limit=2 ** 20)
+        else:
+            def open_connection():
+                return asyncio.open_connection(args.host, args.port,
+                                               limit=2 ** 20)
+        queries = make_queries(names, args.requests, args.starts,
+                               args.algorithm)
+        seconds, latencies = asyncio.run(run_load(
+            open_connection, queries, args.connections, args.window))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        folder.cleanup()
+    print("%d requests over %d connections in %.3fs: %.0f requests/s"
+          % (len(latencies), args.connections, seconds,
+             len(latencies) / seconds))
+    print("latency p50=%.2fms p99=%.2fms max=%.2fms"
+          % (1000 * percentile(latencies, 0.5),
+             1000 * percentile(latencies, 0.99), 1000 * max(latencies)))
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,235 @@
+#
+# bench_suite.py: non-interactive benchmark harness for the rat search
+#   algorithms, with machine-readable results and regression checks.
+#
+# Each case builds a dungeon of a given shape and size and asks a rat at its
+# start for the way to a target room with depth-first, breadth-first and
+# iterative deepening search.  For every search the suite records the best
+# wall time over a number of runs (with garbage collection paused), the
+# peak memory allocated during one run (from tracemalloc), the search
+# counters of one run (rooms expanded, neighbors generated, largest
+# frontier and iterative deepening passes, from a SearchMetrics observer)
+# and the length of the path found.
+#
+# Run with, for example:
+#   python bench_suite.py --scale medium --output results.json
+#   python bench_suite.py --scale medium --baseline results.json
+# The second form compares against saved results and exits with status 1 if
+# any search got slower, used more memory or expanded more rooms.
+#
+
+from dungeon import Dungeon, Room
+from rat import Rat
+from search_observers import SearchMetrics
+from typing import *
+import argparse
+import dungeon_builders
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+ALGORITHMS = {'d': "directions_to", 'b': "bfs_directions_to",
+              'i': "id_directions_to"}
+# Roughly how many rooms each case has at each scale.
+SCALES = {"small": 400, "medium": 10000, "large": 100000, "huge": 1000000}
+
+
+class Case(NamedTuple):
+    """A dungeon to benchmark: how to build it and which room to find."""
+    name: str
+    build: Callable[[], Dungeon]
+    target: str
+
+
+def grid_with_unconnected(side: int) -> Dungeon:
+    """Return a side by side grid plus a room that cannot be reached."""
+    d = dungeon_builders.grid_dungeon(side, side)
+    d.add_room(Room("unconnected", 1))
+    return d
+
+
+def cases_for(rooms: int) -> List[Case]:
+    """Return one case of each shape with about the given number of
+    rooms."""
+    side = max(2, int(rooms ** 0.5))
+    depth = max(1, rooms.bit_length() - 1)
+    loops = max(1, rooms // 8)
+    level_side = max(2, int((rooms // 4) ** 0.5))
+    far = "%d,%d" % (side - 1, side - 1)
+    return [
+        Case("grid %dx%d" % (side, side),
+             lambda: dungeon_builders.grid_dungeon(side, side), far),
+        Case("chain %d" % rooms,
+             lambda: dungeon_builders.chain_dungeon(rooms), str(rooms - 1)),
+        Case("tree depth %d" % depth,
+             lambda: dungeon_builders.tree_dungeon(depth),
+             str(2 ** (depth + 1) - 2)),
+        Case("loops %dx8" % loops,
+             lambda: dungeon_builders.looped_dungeon(loops, 8),
+             "%d.4" % (loops - 1)),
+        Case("unconnected %dx%d" % (side, side),
+             lambda: grid_with_unconnected(side), "unconnected"),
+        Case("levels 4x%dx%d" % (level_side, level_side),
+             lambda: dungeon_builders.stacked_dungeon(
+                 4, level_side, level_side,
+                 [(0, level_side - 1), (level_side - 1, 0)]),
+             "4:%d,%d" % (level_side - 1, level_side - 1)),
+    ]
+
+
+def measure(d: Dungeon, target: Room, algorithm: str,
+            repeat: int) -> Dict[str, Any]:
+    """Return the best time over repeat searches by a fresh rat at the start
+    of d, with the peak memory, search counters and path length of one
+    search."""
+    method = ALGORITHMS[algorithm]
+    d.has_path(d.start, target)  # build the reachability index up front
+    best = None
+    path: List[str] = []
+    for i in range(repeat):
+        search = getattr(Rat(d, d.start), method)
+        gc.collect()
+        gc.disable()  # as timeit does, so collections do not add noise
+        try:
+            begin = time.perf_counter()
+            path = search(target)
+            elapsed = time.perf_counter() - begin
+        finally:
+            gc.enable()
+        if best is None or elapsed < best:
+            best = elapsed
+    search = getattr(Rat(d, d.start), method)
+    tracemalloc.start()
+    search(target)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    rat = Rat(d, d.start)
+    metrics = SearchMetrics()
+    rat.add_observer(metrics)
+    getattr(rat, method)(target)
+    return {"seconds": best, "peak_bytes": peak,
+            "expanded": metrics.rooms_expanded,
+            "generated": metrics.neighbors_generated,
+            "max_frontier": metrics.max_frontier,
+            "passes": metrics.depth_passes, "path_length": len(path)}
+
+
+def run(scales: List[str], algorithms: str, repeat: int,
+        id_max_rooms: int, log: TextIO) -> List[Dict[str, Any]]:
+    """Run every case at each scale and return one result per case and
+    algorithm. Iterative deepening is skipped on dungeons with more than
+    id_max_rooms rooms."""
+    results = []
+    for scale in scales:
+        for case in cases_for(SCALES[scale]):
+            begin = time.perf_counter()
+            d = case.build()
+            build_seconds = time.perf_counter() - begin
+            target = d.find(case.target)
+            for algorithm in algorithms:
+                result = {"scale": scale, "case": case.name,
+                          "rooms": d.size(), "algorithm": algorithm,
+                          "build_seconds": build_seconds}
+                if algorithm == 'i' and d.size() > id_max_rooms:
+                    result["skipped"] = True
+                else:
+                    result.update(measure(d, target, algorithm, repeat))
+                results.append(result)
+                log.write(format_result(result) + "\n")
+                log.flush()
+    return results
+
+
+def format_result(result: Dict[str, Any]) -> str:
+    """Return one line describing a result for people to read."""
+    line = "%-7s %-24s %s" % (result["scale"], result["case"],
+                              result["algorithm"])
+    if result.get("skipped"):
+        return line + "  skipped"
+    return line + ("  %10.6fs  peak=%10d B  expanded=%-8d generated=%-8d "
+                   "frontier=%-7d passes=%-5d path=%d") % (
+        result["seconds"], result["peak_bytes"], result["expanded"],
+        result["generated"], result["max_frontier"], result["passes"],
+        result["path_length"])
+
+
+def compare(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]],
+            tolerance: float, min_seconds: float) -> List[str]:
+    """Return a description of each regression from baseline: a search
+    more than tolerance (a fraction) slower, and by more than min_seconds,
+    or using more than tolerance more peak memory, or expanding more rooms
+    or finding a different length of path. Results missing from the
+    baseline are not compared."""
+    before = {(r["scale"], r["case"], r["algorithm"]): r for r in baseline}
+    regressions = []
+    for r in results:
+        old = before.get((r["scale"], r["case"], r["algorithm"]))
+        if old is None or r.get("skipped") or old.get("skipped"):
+            continue
+        label = "%s %s %s" % (r["scale"], r["case"], r["algorithm"])
+        if r["seconds"] > old["seconds"] * (1 + tolerance) \
+                and r["seconds"] - old["seconds"] > min_seconds:
+            regressions.append("%s: %.6fs, was %.6fs (%.2fx)" % (
+                label, r["seconds"], old["seconds"],
+                r["seconds"] / old["seconds"]))
+        if r["peak_bytes"] > old["peak_bytes"] * (1 + tolerance):
+            regressions.append("%s: peak %d B, was %d B" % (
+                label, r["peak_bytes"], old["peak_bytes"]))
+        if r["expanded"] > old["expanded"]:
+            regressions.append("%s: expanded %d rooms, was %d" % (
+                label, r["expanded"], old["expanded"]))
+        if r["path_length"] != old["path_length"]:
+            regressions.append("%s: path of %d rooms, was %d" % (
+                label, r["path_length"], old["path_length"]))
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run the benchmarks named on the command line, write the results and
+    compare them to a baseline if one is given."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark the rat search algorithms.")
+    parser.add_argument("--scale", action="append", choices=list(SCALES),
+                        help="dungeon size to run (repeatable; "
+                             "default small)")
+    parser.add_argument("--algorithms", default="dbi",
+                        help="algorithm codes to run (default dbi)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="timed runs per search; the best is kept")
+    parser.add_argument("--id-max-rooms", type=int, default=5000,
+                        help="skip iterative deepening on larger dungeons")
+    parser.add_argument("--output", help="write the results as JSON here")
+    parser.add_argument("--baseline",
+                        help="JSON results to check for regressions against")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed slowdown or memory growth, as a "
+                             "fraction (default 0.5)")
+    parser.add_argument("--min-seconds", type=float, default=0.001,
+                        help="ignore slowdowns smaller than this")
+    args = parser.parse_args(argv)
+    for algorithm in args.algorithms:
+        assert algorithm in ALGORITHMS, "Invalid algorithm code: " + algorithm
+    results = run(args.scale or ["small"], args.algorithms, args.repeat,
+                  args.id_max_rooms, sys.stderr)
+    document = {"python": platform.python_version(),
+                "platform": platform.platform(), "results": results}
+    if args.output is not None:
+        with open(args.output, "w") as out:
+            json.dump(document, out, indent=1)
+    if args.baseline is not None:
+        with open(args.baseline) as source:
+            baseline = json.load(source)["results"]
+        regressions = compare(results, baseline, args.tolerance,
+                              args.min_seconds)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        print("%d regressions against %s" % (len(regressions), args.baseline))
+        return 1 if len(regressions) != 0 else 0
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
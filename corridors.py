@@ -0,0 +1,297 @@
+#
+# corridors.py: an overlay on a dungeon in which each corridor, a maximal
+#   chain of rooms that can only be passed straight through, is a single
+#   edge with a length, so searches cross it in one step instead of one
+#   room at a time.
+#
+# A room is passed straight through when it has one passage in and one out,
+# to different rooms, or when its only passages lead to and come back from
+# exactly two other rooms.  Every other room is a junction.  A corridor runs
+# from a junction through pass-through rooms to the next junction (possibly
+# with no rooms between); corridors of two-way rooms can be crossed either
+# way.  A ring of pass-through rooms with no junction on it has one of its
+# rooms made a junction.
+#
+# A query searches the overlay back from the target, cheapest first, until
+# it knows the distance to the target from the start, giving the exact
+# distance to the target from every junction that is closer.  The distance
+# from a room inside a corridor follows from the distances of the
+# corridor's ends.  The path is then walked forward from the start, room by
+# room, taking the first neighbor in Room.neighbors() order that is one
+# step closer; among the shortest paths, that is the one breadth-first
+# search finds (see dynamic_paths.py), so Rat.bfs_path_to gives the same
+# answer with or without the overlay.
+#
+
+from dungeon import Dungeon, Room
+from typing import *
+import heapq
+
+
+class _Corridor:
+    """A chain of pass-through rooms between two junctions.
+
+    Attributes:
+        first (Room): junction the corridor leaves from
+        rooms (List[Room]): the rooms inside, in order from first
+        last (Room): junction the corridor reaches
+        two_way (bool): true if the corridor can also be crossed from last
+            to first
+        length (int): steps from first to last
+    """
+
+    def __init__(self, first: Room, rooms: List[Room], last: Room,
+                 two_way: bool):
+        """Create a corridor from first through rooms to last."""
+        self.first = first
+        self.rooms = rooms
+        self.last = last
+        self.two_way = two_way
+        self.length = len(rooms) + 1
+
+
+class CorridorOverlay:
+    """The corridors of a dungeon, kept up to date as passages change; see
+    Dungeon.enable_corridors. Only the corridors at the rooms a change
+    touches are walked again, at the next query.
+
+    Attributes:
+        corridors_walked (int): corridors found so far, counting the first
+            build
+    """
+
+    def __init__(self, dungeon: Dungeon):
+        """Find the corridors of dungeon's rooms and start listening to
+        it."""
+        self.corridors_walked = 0
+        self._dungeon = dungeon
+        self._known: Set[Room] = set()
+        self._into: Dict[Room, List[Room]] = {}
+        self._corridor_of: Dict[Room, Tuple[_Corridor, int]] = {}
+        self._corridors_at: Dict[Room, Set[_Corridor]] = {}
+        self._leading_to: Dict[Room, Dict[_Corridor, Room]] = {}
+        self._forced: Set[Room] = set()
+        # rooms to walk again, kept as a dictionary to None so they are
+        # walked in the order they changed and corridors keep their direction
+        self._changed: Dict[Room, None] = {}
+        self.__discover(dungeon.rooms())
+        self.__refresh()
+        dungeon.add_listener(self)
+
+    def close(self) -> None:
+        """Stop listening to the dungeon."""
+        self._dungeon.remove_listener(self)
+
+    def passage_added(self, a: Room, b: Room, replaced: Optional[Room]) -> None:
+        """Called by the dungeon when a passage from a to b is added in place
+        of the passage to replaced (or None)."""
+        known = a in self._known
+        self.__discover([a, b])
+        if known:
+            self._into.setdefault(b, []).append(a)
+            if replaced is not None:
+                self._into[replaced].remove(a)
+        self._changed[a] = None
+        self._changed[b] = None
+        if replaced is not None:
+            self._changed[replaced] = None
+
+    def passage_removed(self, a: Room, b: Room) -> None:
+        """Called by the dungeon when a passage from a to b is removed."""
+        if a in self._known:
+            self._into[b].remove(a)
+            self._changed[a] = None
+            self._changed[b] = None
+
+    def corridor(self, room: Room) -> Optional[List[Room]]:
+        """Returns the rooms of the corridor room is inside, with the
+        junctions at its ends, or None if room is a junction."""
+        self.__discover([room])
+        self.__refresh()
+        if room not in self._corridor_of:
+            return None
+        c = self._corridor_of[room][0]
+        return [c.first] + c.rooms + [c.last]
+
+    def junctions(self) -> int:
+        """Returns the number of rooms that are not inside a corridor."""
+        self.__refresh()
+        return len(self._known) - len(self._corridor_of)
+
+    def path(self, start: Room, target: Room) -> List[Room]:
+        """Returns the rooms on the path Rat.bfs_path_to would find from
+        start to target, or an empty list if there is none."""
+        if start is target:
+            return [start]
+        self.__discover([start, target])
+        self.__refresh()
+        distances = self.__distances_to(start, target)
+        d = self.__distance(start, target, distances)
+        if d is None:
+            return []
+        path = [start]
+        room = start
+        while room is not target:
+            for x in room.neighbors():
+                if self.__distance(x, target, distances) == d - 1:
+                    break
+            room = x
+            d -= 1
+            path.append(room)
+        return path
+
+    def __distance(self, room: Room, target: Room,
+                   distances: Dict[Room, int]) -> Optional[int]:
+        """Returns the distance from room to target, given the distances of
+        the junctions near enough to matter, or None if it is farther."""
+        if room is target:
+            return 0
+        place = self._corridor_of.get(room)
+        if place is None:
+            return distances.get(room)
+        c, i = place
+        best = None
+        d = distances.get(c.last)
+        if d is not None:
+            best = d + c.length - i - 1
+        d = distances.get(c.first)
+        if c.two_way and d is not None and (best is None or d + i + 1 < best):
+            best = d + i + 1
+        if self._corridor_of.get(target, (None, 0))[0] is c:
+            j = self._corridor_of[target][1]
+            if j > i or c.two_way:
+                if best is None or abs(j - i) < best:
+                    best = abs(j - i)
+        return best
+
+    def __distances_to(self, start: Room, target: Room) -> Dict[Room, int]:
+        """Searches the overlay back from target, cheapest first, until no
+        junction left could be on a shortest path from start; returns the
+        distances to target found."""
+        waiting: List[Tuple[int, int, Room]] = []
+        place = self._corridor_of.get(target)
+        if place is None:
+            waiting.append((0, id(target), target))
+        else:
+            c, j = place
+            waiting.append((j + 1, id(c.first), c.first))
+            if c.two_way:
+                heapq.heappush(waiting, (c.length - j - 1, id(c.last), c.last))
+        place = self._corridor_of.get(start)
+        anchors = {start: 0} if place is None else {
+            place[0].last: place[0].length - place[1] - 1}
+        if place is not None and place[0].two_way:
+            anchors[place[0].first] = min(place[1] + 1,
+                                          anchors.get(place[0].first,
+                                                      place[1] + 1))
+        limit = self.__distance(start, target, {})
+        distances: Dict[Room, int] = {}
+        while len(waiting) != 0:
+            d, key, room = heapq.heappop(waiting)
+            if limit is not None and d > limit:
+                break
+            if room in distances:
+                continue
+            distances[room] = d
+            if room in anchors and (limit is None
+                                    or d + anchors[room] < limit):
+                limit = d + anchors[room]
+            for c, x in self._leading_to.get(room, {}).items():
+                if x not in distances:
+                    heapq.heappush(waiting, (d + c.length, id(x), x))
+        return distances
+
+    def __discover(self, rooms: Iterable[Room]) -> None:
+        """Adds rooms, and the rooms reachable from them, that the overlay
+        has not seen, marking them for their corridors to be found."""
+        pending = [r for r in rooms if r not in self._known]
+        while len(pending) != 0:
+            room = pending.pop()
+            if room in self._known:
+                continue
+            self._known.add(room)
+            self._changed[room] = None
+            for x in room.neighbors():
+                self._into.setdefault(x, []).append(room)
+                self._changed[x] = None
+                if x not in self._known:
+                    pending.append(x)
+
+    def __passes_through(self, room: Room) -> bool:
+        if room in self._forced:
+            return False
+        out = room.neighbors()
+        into = self._into.get(room, ())
+        if len(out) == 1 and len(into) == 1:
+            return out[0] is not into[0]
+        if len(out) == 2 and len(into) == 2:
+            return out[0] is not out[1] and (
+                (into[0] is out[0] and into[1] is out[1])
+                or (into[0] is out[1] and into[1] is out[0]))
+        return False
+
+    def __refresh(self) -> None:
+        """Walks again the corridors at the rooms marked as changed."""
+        if len(self._changed) == 0:
+            return
+        changed = self._changed
+        self._changed = {}
+        ends: Dict[Room, None] = {}
+        loose: Dict[Room, None] = dict(changed)
+        for room in changed:
+            self._forced.discard(room)
+            place = self._corridor_of.get(room)
+            if place is not None:
+                self.__remove(place[0], ends, loose)
+            for c in list(self._corridors_at.get(room, ())):
+                self.__remove(c, ends, loose)
+        for room in {**changed, **ends}:
+            if not self.__passes_through(room):
+                for c in list(self._corridors_at.get(room, ())):
+                    if c.first is room or (c.two_way and c.last is room):
+                        self.__remove(c, {}, loose)
+                self.__walk_from(room)
+        for room in loose:
+            if room not in self._corridor_of and self.__passes_through(room):
+                self._forced.add(room)  # on a ring with no junction
+                self.__walk_from(room)
+
+    def __remove(self, c: _Corridor, ends: Dict[Room, None],
+                 loose: Dict[Room, None]) -> None:
+        """Drops corridor c, adding its junctions to ends and its rooms to
+        loose."""
+        if c not in self._corridors_at.get(c.first, ()):
+            return
+        for room in c.rooms:
+            if self._corridor_of.get(room, (None, 0))[0] is c:
+                del self._corridor_of[room]
+            loose[room] = None
+        for junction in [c.first, c.last]:
+            self._corridors_at[junction].discard(c)
+            self._leading_to.get(junction, {}).pop(c, None)
+            ends[junction] = None
+
+    def __walk_from(self, junction: Room) -> None:
+        """Finds the corridor leaving junction by each of its passages,
+        other than two-way corridors already found from their other end."""
+        for x in junction.neighbors():
+            if x in self._corridor_of:
+                continue
+            rooms = []
+            previous = junction
+            while self.__passes_through(x):
+                rooms.append(x)
+                out = x.neighbors()
+                following = out[0] if len(out) == 1 or out[1] is previous \
+                    else out[1]
+                previous, x = x, following
+            c = _Corridor(junction, rooms, x,
+                          len(rooms) != 0 and len(rooms[0].neighbors()) == 2)
+            for i, room in enumerate(rooms):
+                self._corridor_of[room] = (c, i)
+            self._corridors_at.setdefault(junction, set()).add(c)
+            self._corridors_at.setdefault(x, set()).add(c)
+            self._leading_to.setdefault(x, {})[c] = junction
+            if c.two_way:
+                self._leading_to.setdefault(junction, {})[c] = x
+            self.corridors_walked += 1
@@ -0,0 +1,119 @@
+#
+# distances.py: bulk distance and reachability queries over a DungeonIndex,
+#   computed a whole breadth-first layer at a time.
+#
+# With NumPy installed, each layer is expanded with array operations over
+# the index's CSR buffers, which are shared with NumPy without copying.
+# Without it, the same layer-by-layer search runs as a plain Python loop and
+# returns array('i') buffers; the results are identical either way.
+#
+
+from typing import *
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def bfs_distances(index: Any, sources: Union[int, Iterable[int]],
+                  max_depth: Optional[int] = None) -> Tuple[Any, Any]:
+    """Breadth-first search from one or more source room ids over index (a
+    DungeonIndex or MappedDungeon). Returns (distance, predecessor) arrays
+    indexed by room id: distance is the number of steps from the nearest
+    source, or -1 for rooms that cannot be reached (or are more than
+    max_depth steps away), and predecessor is the room before it on a
+    shortest path, or -1 for sources and unreached rooms. Ties are broken
+    as Rat.bfs_path_to breaks them, so for a single source following the
+    predecessors gives the same path."""
+    if isinstance(sources, int):
+        sources = [sources]
+    sources = list(dict.fromkeys(sources))
+    if numpy is None:
+        return _python_distances(index, sources, max_depth)
+    return _numpy_distances(index, sources, max_depth)
+
+
+def _numpy_distances(index: Any, sources: List[int],
+                     max_depth: Optional[int]) -> Tuple[Any, Any]:
+    offsets = numpy.frombuffer(index.offsets, dtype=numpy.int64)
+    targets = numpy.frombuffer(index.targets, dtype=numpy.int32)
+    distance = numpy.full(index.room_count(), -1, dtype=numpy.int32)
+    predecessor = numpy.full(index.room_count(), -1, dtype=numpy.int32)
+    frontier = numpy.array(sources, dtype=numpy.int64)
+    distance[frontier] = 0
+    depth = 0
+    while len(frontier) != 0 and (max_depth is None or depth < max_depth):
+        depth += 1
+        starts = offsets[frontier]
+        counts = offsets[frontier + 1] - starts
+        total = int(counts.sum())
+        if total == 0:
+            break
+        # position of every passage out of the frontier, in frontier order
+        firsts = numpy.cumsum(counts) - counts
+        passages = numpy.repeat(starts - firsts, counts) + numpy.arange(total)
+        reached = targets[passages]
+        parents = numpy.repeat(frontier, counts)
+        new = distance[reached] == -1
+        reached = reached[new]
+        parents = parents[new]
+        # keep each room's first discovery, in the order it was discovered
+        first = numpy.unique(reached, return_index=True)[1]
+        first.sort()
+        frontier = reached[first].astype(numpy.int64)
+        distance[frontier] = depth
+        predecessor[frontier] = parents[first]
+    return distance, predecessor
+
+
+def _python_distances(index: Any, sources: List[int],
+                      max_depth: Optional[int]) -> Tuple[array, array]:
+    offsets = index.offsets
+    targets = index.targets
+    distance = array('i', [-1]) * index.room_count()
+    predecessor = array('i', [-1]) * index.room_count()
+    for x in sources:
+        distance[x] = 0
+    frontier = sources
+    depth = 0
+    while len(frontier) != 0 and (max_depth is None or depth < max_depth):
+        depth += 1
+        layer = []
+        for room in frontier:
+            for i in range(offsets[room], offsets[room + 1]):
+                x = targets[i]
+                if distance[x] == -1:
+                    distance[x] = depth
+                    predecessor[x] = room
+                    layer.append(x)
+        frontier = layer
+    return distance, predecessor
+
+
+def eccentricity(index: Any, source: int) -> int:
+    """Returns the greatest distance from source to any room it can reach."""
+    distance, predecessor = bfs_distances(index, source)
+    if numpy is not None:
+        return int(distance.max())
+    return max(distance)
+
+
+def farthest_rooms(index: Any, source: int) -> List[int]:
+    """Returns the ids of the reachable rooms farthest from source."""
+    distance, predecessor = bfs_distances(index, source)
+    if numpy is not None:
+        farthest = distance.max()
+        return [int(x) for x in numpy.flatnonzero(distance == farthest)]
+    farthest = max(distance)
+    return [x for x in range(len(distance)) if distance[x] == farthest]
+
+
+def rooms_within(index: Any, source: int, k: int) -> List[int]:
+    """Returns the ids of the rooms at most k steps from source, stopping
+    the search after k layers."""
+    distance, predecessor = bfs_distances(index, source, k)
+    if numpy is not None:
+        return [int(x) for x in numpy.flatnonzero(distance != -1)]
+    return [x for x in range(len(distance)) if distance[x] != -1]
@@ -6,29 +6,49 @@
 
 from enum import Enum
 from typing import *
+from itertools import islice
+from reachability import ReachabilityIndex
+import gc
+import io
 import json
 
 Direction = Enum('Direction', 'EAST WEST NORTH SOUTH UP DOWN')
 
 
+# The opposite of each direction, indexed by the direction's value.
+_OPPOSITES = (None, Direction.WEST, Direction.EAST, Direction.SOUTH,
+              Direction.NORTH, Direction.DOWN, Direction.UP)
+# Directions by value, so a value can be turned back into a direction
+# without calling Direction.
+_DIRECTIONS = (None,) + tuple(Direction)
+# Directions by name, looked up without going through Direction[name].
+_DIRECTIONS_BY_NAME = {d.name: d for d in Direction}
+# _POSITIONS[8 * mask + value] is the number of directions before value that
+# are set in mask: the position of the passage in that direction among a
+# room's passages.
+_POSITIONS = tuple(bin(mask & ((1 << (value - 1)) - 1)).count("1")
+                   if value != 0 else 0
+                   for mask in range(64) for value in range(8))
+# _BITS[mask] is the bits set in mask, in direction order.
+_BITS = tuple(tuple(1 << (value - 1) for value in range(1, 7)
+                    if mask & (1 << (value - 1)))
+              for mask in range(64))
+# The bit of the opposite of each direction, indexed by value.
+_OPPOSITE_BITS = (0, 2, 1, 8, 4, 32, 16)
+
 def opposite(d: Direction) -> Direction:
     """Given a direction, returns the opposite direction; eg: North <-> South.
     Fails if given an invalid direction.
     """
-    if d.value == Direction.EAST.value:
-        return Direction.WEST
-    elif d.value == Direction.WEST.value:
-        return Direction.EAST
-    elif d.value == Direction.NORTH.value:
-        return Direction.SOUTH
-    elif d.value == Direction.SOUTH.value:
-        return Direction.NORTH
-    elif d.value == Direction.UP.value:
-        return Direction.DOWN
-    elif d.value == Direction.DOWN.value:
-        return Direction.UP
-    else:
-        assert False
+    return _OPPOSITES[d._value_]
+
+
+def _exits_by_bit(room: Any) -> Dict[int, Any]:
+    """Returns room's passages as a dictionary from direction bit to
+    neighbor."""
+    if room._mask == 0:
+        return {}
+    return dict(zip(_BITS[room._mask], room._exits))
 
 
 class Room:
@@ -39,19 +59,38 @@ class Room:
     Attributes:
         name (str): identifier for room; should be unique w/in a dungeon
         level (int): level of room, defaulting to 1
+        trap (Optional[str]): name of the trap in the room, if any
+        monster (Optional[str]): name of the monster in the room, if any
     """
 
+    __slots__ = ('_name', '_level', '_id', '_mask', '_exits', '_trap',
+                 '_monster', '_dungeon')
+
     def __init__(self, name: str, level: int = 1):
         """Create a room in a given level; level defaults to 1."""
         self._name = name
         self._level = level
-        self._neighbors: List[Any] = [None for x in Direction]
-        self.trap = None  # or a string giving the trap name
-        self.monster = None  # or a string giving the monster name
+        self._id = -1  # set when the room is registered with a dungeon
+        # Passages are kept compactly: _mask has bit value - 1 set for each
+        # direction with a passage, and _exits holds just those neighbors,
+        # in direction order.
+        self._mask = 0
+        self._exits: Tuple[Any, ...] = ()
+        self._trap: Optional[str] = None
+        self._monster: Optional[str] = None
+        self._dungeon: Any = None  # dungeon tracking passages from this room
 
     def to_json(self) -> str:
-        """Return JSON representation of room that can be reloaded."""
-        return json.dumps(self)
+        """Return JSON representation of room that can be reloaded. Neighbors
+        are given by name; see read_room_from_json."""
+        return json.dumps(self._to_record())
+
+    def _to_record(self) -> Dict[str, Any]:
+        """Returns a dictionary of the room's fields, with neighbors given as
+        a dictionary from direction name to room name."""
+        neighbors = {d.name: n.name for d, n in self.passages()}
+        return {"name": self._name, "level": self._level, "trap": self.trap,
+                "monster": self.monster, "neighbors": neighbors}
 
     @property
     def name(self) -> str:
@@ -63,13 +102,75 @@ class Room:
         """Level of room within dungeon."""
         return self._level
 
+    @property
+    def trap(self) -> Optional[str]:
+        """Name of the trap in the room, or None."""
+        return self._trap
+
+    @trap.setter
+    def trap(self, trap: Optional[str]) -> None:
+        if self._dungeon is not None:
+            self._dungeon._reindex(self._dungeon._traps, self, self._trap,
+                                   trap)
+        self._trap = trap
+
+    @property
+    def monster(self) -> Optional[str]:
+        """Name of the monster in the room, or None."""
+        return self._monster
+
+    @monster.setter
+    def monster(self, monster: Optional[str]) -> None:
+        if self._dungeon is not None:
+            self._dungeon._reindex(self._dungeon._monsters, self,
+                                   self._monster, monster)
+        self._monster = monster
+
+    @property
+    def id(self) -> int:
+        """Position of the room in the dungeon it was first registered with,
+        the start room being 0 (see Dungeon.room), or -1 if it has not been
+        registered."""
+        return self._id
+
     def neighbor_to(self, d: Direction) -> Any:
         """Returns neighbor in given direction, or None if there is none."""
-        return self._neighbors[d.value - 1]
+        value = d._value_
+        if self._mask & (1 << (value - 1)) == 0:
+            return None
+        return self._exits[_POSITIONS[8 * self._mask + value]]
 
     def neighbors(self) -> List[Any]:
         """Returns list of rooms reachable from current room."""
-        return [n for n in self._neighbors if n is not None]
+        return list(self._exits)
+
+    def passages(self) -> List[Tuple[Direction, Any]]:
+        """Returns (direction, neighbor) for each passage out of the room, in
+        direction order."""
+        mask = self._mask
+        return [(_DIRECTIONS[value], self._exits[_POSITIONS[8 * mask + value]])
+                for value in range(1, 7) if mask & (1 << (value - 1))]
+
+    def _set_neighbor(self, r: Any, d: Direction) -> Any:
+        """Puts r (or None, for no passage) in direction d without telling
+        the dungeon, returning the neighbor that was there."""
+        value = d._value_
+        bit = 1 << (value - 1)
+        mask = self._mask
+        exits = self._exits
+        i = _POSITIONS[8 * mask + value]
+        if mask & bit:
+            replaced = exits[i]
+            if r is None:
+                self._exits = exits[:i] + exits[i + 1:]
+                self._mask = mask & ~bit
+            else:
+                self._exits = exits[:i] + (r,) + exits[i + 1:]
+            return replaced
+        if r is not None:
+            self._exits = exits[:i] + (r,) + exits[i:]
+            self._mask = mask | bit
+        return None
 
     def add_single_direction_neighbor(self, r, d: Direction) -> None:
         """Adds one-way passage from the current room (self) to another room r in the
@@ -77,7 +178,10 @@ class Room:
 
         """
         assert r is not self  # no passages from room back to self
-        self._neighbors[d.value - 1] = r
+        replaced = self._set_neighbor(r, d)
+        dungeon = self._dungeon if self._dungeon is not None else r._dungeon
+        if dungeon is not None:
+            dungeon._passage_added(self, r, replaced)
 
     def add_neighbor(self, r, d: Direction) -> None:
         """Adds two-way passage from this room (self) to another room r in the given
@@ -87,6 +191,29 @@ class Room:
         self.add_single_direction_neighbor(r, d)
         r.add_single_direction_neighbor(self, opposite(d))
 
+    def remove_single_direction_neighbor(self, d: Direction) -> None:
+        """Removes the one-way passage from the current room in the given
+        direction, if there is one; the room it led to keeps any passage
+        back.
+        """
+        removed = self._set_neighbor(None, d)
+        if removed is not None:
+            dungeon = self._dungeon if self._dungeon is not None \
+                else removed._dungeon
+            if dungeon is not None:
+                dungeon._passage_removed(self, removed)
+
+    def remove_neighbor(self, d: Direction) -> None:
+        """Removes the two-way passage from this room in the given direction:
+        the passage to the neighbor, and the neighbor's passage in the
+        opposite direction if it leads back here (as after a cave-in).
+        """
+        r = self.neighbor_to(d)
+        if r is not None:
+            self.remove_single_direction_neighbor(d)
+            if r.neighbor_to(opposite(d)) is self:
+                r.remove_single_direction_neighbor(opposite(d))
+
 
 class Dungeon:
     """Represents a dungeon as a collection of (possibly connected) rooms.  Each
@@ -105,11 +232,75 @@ class Dungeon:
         searchable in the dungeon.
         """
         self._rooms = {start.name: start}
+        self._by_id = [start]
         self._start = start
+        if start._id == -1:
+            start._id = 0
+        self._reachability = ReachabilityIndex()
+        self._version = 0
+        self._path_cache: Any = None
+        self._level_paths: Any = None
+        self._corridors: Any = None
+        self._snapshots: Any = None
+        self._layout: Any = None
+        self._frozen: Any = None  # the index made by frozen, and its version
+        self._frozen_version = -1
+        self._listeners: List[Any] = []
+        # rooms by trap and monster name, each kept as a dictionary to None
+        # so rooms stay in the order they were indexed
+        self._traps: Dict[str, Dict[Room, None]] = {}
+        self._monsters: Dict[str, Dict[Room, None]] = {}
+        self._track(start)
 
     def to_json(self) -> str:
-        """Returns a JSON string representation of the dungeon."""
-        return json.dumps(self)
+        """Returns a JSON string representation of the dungeon; see
+        write_json."""
+        out = io.StringIO()
+        self.write_json(out)
+        return out.getvalue()
+
+    def write_json(self, out: TextIO) -> None:
+        """Writes the dungeon to out as a JSON object with one room per line,
+        so that even very large dungeons can be written and read back (see
+        read_dungeon_from_stream) a room at a time. Passages are recorded by
+        room name, so room names must be unique. The start room comes first;
+        rooms that are not registered with the dungeon but can be reached
+        from registered rooms are written after the rest and marked as
+        unregistered.
+        """
+        out.write('{"format": "dungeon", "version": 1, "start": '
+                  + json.dumps(self._start.name) + ', "rooms": [\n')
+        separator = ""
+        for room, registered in self.__rooms_to_write():
+            record = room._to_record()
+            if not registered:
+                record["registered"] = False
+            out.write(separator + json.dumps(record))
+            separator = ",\n"
+        out.write("\n]}\n")
+
+    def __rooms_to_write(self) -> Iterator[Tuple[Room, bool]]:
+        """Yields the start room, the other registered rooms and then the
+        unregistered rooms reachable from them, each with whether it is
+        registered. Only the unregistered rooms are remembered."""
+        extra_names: Set[str] = set()
+        extra: List[Room] = []
+        registered = [self._start] + [r for r in self._rooms.values()
+                                      if r is not self._start]
+        for room in registered:
+            yield room, True
+            self.__note_unregistered(room, extra_names, extra)
+        while len(extra) != 0:
+            room = extra.pop()
+            yield room, False
+            self.__note_unregistered(room, extra_names, extra)
+
+    def __note_unregistered(self, room: Room, extra_names: Set[str],
+                            extra: List[Room]) -> None:
+        for n in room.neighbors():
+            if self._rooms.get(n.name) is not n and n.name not in extra_names:
+                extra_names.add(n.name)
+                extra.append(n)
 
     @property
     def start(self) -> Room:
@@ -122,6 +313,96 @@ class Dungeon:
         """
         assert r.name not in self._rooms
         self._rooms[r.name] = r
+        if r._id == -1:
+            r._id = len(self._by_id)
+        self._by_id.append(r)
+        self._version += 1
+        self._track(r)
+
+    def add_rooms(self, rooms: Iterable[Room]) -> None:
+        """Adds many new rooms at once, as add_room does one at a time. The
+        names are checked in a single pass first, and nothing is added if
+        any of them is repeated or already in the dungeon.
+        """
+        rooms = list(rooms)
+        named = {r._name: r for r in rooms}
+        assert len(named) == len(rooms) \
+            and named.keys().isdisjoint(self._rooms.keys())
+        self._rooms.update(named)
+        first = len(self._by_id)
+        for i, r in enumerate(rooms, first):
+            if r._id == -1:
+                r._id = i
+        self._by_id.extend(rooms)
+        self._version += 1
+        self._track(*rooms)
+
+    def add_passages(self, passages: Iterable[Tuple[Any, ...]]) -> None:
+        """Adds many passages at once. Each passage is (a, b, direction) for
+        a two-way passage, as a.add_neighbor(b, direction) would add, or
+        (a, b, direction, one_way) where a true one_way gives just the
+        passage from a to b. Passages are added in order, so a later one
+        replaces an earlier one in the same direction. They are checked in
+        a single pass first, and none is added if any would join a room to
+        itself or to a room tracked by another dungeon. Unless something is
+        listening for passage changes (see add_listener), the passages are
+        gathered by room and each room's own record of its passages is
+        rebuilt once, and has_path rebuilds its index once, at the next
+        query, instead of updating it for every passage.
+        """
+        passages = list(passages)
+        if len(self._listeners) != 0:
+            for p in passages:
+                assert p[0] is not p[1]  # no passages from room back to self
+                assert p[0]._dungeon in (None, self)
+                assert p[1]._dungeon in (None, self)
+            for p in passages:
+                if len(p) > 3 and p[3]:
+                    p[0].add_single_direction_neighbor(p[1], p[2])
+                else:
+                    p[0].add_neighbor(p[1], p[2])
+            return
+        # each room's passages keyed by direction bit, starting from those
+        # it has, so its _mask (the sum of the keys) and _exits are built
+        # once however many passages it gains
+        links: Dict[Room, Dict[int, Room]] = {}
+        untracked = []
+        # the dictionaries all live until the end, and would otherwise set
+        # off collections that walk the whole dungeon again and again
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            for p in passages:
+                a = p[0]
+                b = p[1]
+                assert a is not b  # no passages from room back to self
+                value = p[2]._value_
+                exits = links.get(a)
+                if exits is None:
+                    assert a._dungeon in (None, self)
+                    exits = links[a] = _exits_by_bit(a)
+                exits[1 << (value - 1)] = b
+                if len(p) == 3 or not p[3]:
+                    exits = links.get(b)
+                    if exits is None:
+                        assert b._dungeon in (None, self)
+                        exits = links[b] = _exits_by_bit(b)
+                    exits[_OPPOSITE_BITS[value]] = a
+                elif b._dungeon is not self and b not in links:
+                    assert b._dungeon is None
+                    untracked.append(b)
+            for room, exits in links.items():
+                mask = sum(exits)
+                room._mask = mask
+                room._exits = tuple(map(exits.__getitem__, _BITS[mask]))
+                if room._dungeon is not self:
+                    untracked.append(room)
+        finally:
+            if collecting:
+                gc.enable()
+        self._version += 1
+        self._reachability.invalidate()
+        self._track(*untracked)
 
     def has(self, room_name: str) -> bool:
         """Returns true if the dungeon has a room with the given name."""
@@ -132,20 +413,311 @@ class Dungeon:
         assert self.has(room_name)
         return self._rooms[room_name]
 
+    def room(self, room_id: int) -> Room:
+        """Returns the room registered with the given id (its position in the
+        order rooms were added, the start room being 0) or fails."""
+        assert 0 <= room_id < len(self._by_id)
+        return self._by_id[room_id]
+
     def size(self) -> int:
         """ Returns the number of rooms in the dungeon."""
         return len(self._rooms)
 
+    @property
+    def version(self) -> int:
+        """Count of changes to the dungeon: rooms added and passages added to
+        tracked rooms. Anything computed from the dungeon's passages is out
+        of date once the version changes."""
+        return self._version
 
-def read_room_from_json(source: str) -> Room:
-    "Read a room from a JSON source string." ""
-    result = json.loads(source)
-    assert isinstance(result, Room)
-    return result
+    @property
+    def path_cache(self) -> Any:
+        """The dungeon's PathCache, or None if enable_path_cache has not been
+        called."""
+        return self._path_cache
+
+    def enable_path_cache(self, max_trees: int = 64,
+                          max_rooms: int = 1000000) -> Any:
+        """Starts caching breadth-first search trees so that rats searching
+        from the same start room reuse them; see PathCache. Returns the
+        cache, whose counters report hits, misses and evictions."""
+        from path_cache import PathCache
+        self._path_cache = PathCache(self, max_trees, max_rooms)
+        return self._path_cache
+
+    @property
+    def level_paths(self) -> Any:
+        """The dungeon's LevelPaths, or None if enable_level_paths has not
+        been called."""
+        return self._level_paths
+
+    def enable_level_paths(self) -> Any:
+        """Builds the per-level abstraction of the dungeon that
+        Rat.hierarchical_path_to searches (see level_paths.py) and keeps it
+        up to date as passages change. Returns the LevelPaths."""
+        from level_paths import LevelPaths
+        if self._level_paths is None:
+            self._level_paths = LevelPaths(self)
+        return self._level_paths
+
+    @property
+    def corridors(self) -> Any:
+        """The dungeon's CorridorOverlay, or None if enable_corridors has not
+        been called."""
+        return self._corridors
+
+    def enable_corridors(self) -> Any:
+        """Builds the overlay in which each corridor of pass-through rooms is
+        a single edge (see corridors.py), which Rat.bfs_path_to then searches,
+        and keeps it up to date as passages change. Returns the
+        CorridorOverlay."""
+        from corridors import CorridorOverlay
+        if self._corridors is None:
+            self._corridors = CorridorOverlay(self)
+        return self._corridors
+
+    @property
+    def layout(self) -> Any:
+        """The dungeon's DungeonLayout, or None if enable_layout has not been
+        called."""
+        return self._layout
+
+    def enable_layout(self) -> Any:
+        """Starts inferring (x, y, level) coordinates for the rooms from the
+        directions of their passages, a region at a time as Rat.astar_path_to
+        asks for them (see layouts.py), and keeps them up to date as passages
+        change. Returns the DungeonLayout."""
+        from layouts import DungeonLayout
+        if self._layout is None:
+            self._layout = DungeonLayout(self)
+        return self._layout
+
+    @property
+    def snapshot_log(self) -> Any:
+        """The dungeon's SnapshotLog, or None if snapshot has not been
+        called."""
+        return self._snapshots
+
+    def snapshot(self) -> Any:
+        """Returns a DungeonSnapshot: the rooms and passages of the dungeon
+        as they are now, unchanged by later edits, for rats on other threads
+        to search (see Rat.pin). Unlike freeze, it shares the passages with
+        the dungeon instead of copying them. The first call starts logging
+        passage edits for the snapshots (see snapshots.py)."""
+        from snapshots import SnapshotLog
+        if self._snapshots is None:
+            self._snapshots = SnapshotLog(self)
+        return self._snapshots.snapshot()
+
+    def add_listener(self, listener: Any) -> None:
+        """Registers listener to be told about every passage added to or
+        removed from the rooms the dungeon tracks, through its
+        passage_added(a, b, replaced) and passage_removed(a, b) methods."""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Any) -> None:
+        """Stops telling listener about changes to passages."""
+        self._listeners.remove(listener)
+
+    def tracks(self, room: Room) -> bool:
+        """Returns true if the dungeon is told about every passage added to
+        room and to the rooms reachable from it, so results computed from
+        room stay valid until the version changes."""
+        return room._dungeon is self and self._reachability.is_exact()
+
+    def has_path(self, a: Room, b: Room) -> bool:
+        """Returns false if there is certainly no path from room a to room b,
+        without searching. Rooms the dungeon does not track (see _track) are
+        assumed to be reachable."""
+        return self._reachability.has_path(a, b)
+
+    def _track(self, *rooms: Room) -> None:
+        """Starts tracking the passages out of the given rooms and every
+        untracked room reachable from them, so that has_path knows about
+        them. Rooms track the passages added to them through their _dungeon
+        link; a room already tracked by another dungeon cannot be followed,
+        so reaching one turns off has_path's short cuts."""
+        reachability = self._reachability
+        tracked = []
+        pending = list(rooms)
+        while len(pending) != 0:
+            room = pending.pop()
+            if room._dungeon is None:
+                room._dungeon = self
+                tracked.append(room)
+                if room._mask != 0:
+                    pending.extend(room._exits)
+                if room._trap is not None:
+                    self._traps.setdefault(room._trap, {})[room] = None
+                if room._monster is not None:
+                    self._monsters.setdefault(room._monster, {})[room] = None
+            elif room._dungeon is not self:
+                reachability.mark_inexact()
+        reachability.add_rooms(tracked)
+        reachability.add_exits(tracked)
+
+    def _passage_added(self, a: Room, b: Room, replaced: Optional[Room]) -> None:
+        """Called by Room when a passage from a to b is added, replacing the
+        passage to room replaced (or None) that was in the same direction."""
+        self._version += 1
+        if replaced is not None and replaced is not b:
+            self._reachability.invalidate()
+        if a._dungeon is not self:
+            self._track(a)
+        if b._dungeon is not self:
+            self._track(b)
+        if a._dungeon is self and b._dungeon is self:
+            self._reachability.add_passage(a, b)
+        else:
+            self._reachability.mark_inexact()
+        for listener in list(self._listeners):
+            listener.passage_added(a, b, replaced)
+
+    def _passage_removed(self, a: Room, b: Room) -> None:
+        """Called by Room when the passage from a to b is removed."""
+        self._version += 1
+        self._reachability.invalidate()
+        for listener in list(self._listeners):
+            listener.passage_removed(a, b)
+
+    def rooms_with_trap(self, trap: str) -> List[Room]:
+        """Returns the rooms tracked by the dungeon that have the named trap,
+        from an index kept as traps are set, without looking at other
+        rooms."""
+        return list(self._traps.get(trap, ()))
+
+    def rooms_with_monster(self, monster: str) -> List[Room]:
+        """Returns the rooms tracked by the dungeon that have the named
+        monster, from an index kept as monsters are set."""
+        return list(self._monsters.get(monster, ()))
+
+    def trap_names(self) -> List[str]:
+        """Returns the names of the traps in the dungeon's rooms."""
+        return list(self._traps)
+
+    def monster_names(self) -> List[str]:
+        """Returns the names of the monsters in the dungeon's rooms."""
+        return list(self._monsters)
+
+    @staticmethod
+    def _reindex(index: Dict[str, Dict[Room, None]], room: Room,
+                 old: Optional[str], new: Optional[str]) -> None:
+        """Moves room from the old name to the new one in a trap or monster
+        index."""
+        if old is not None:
+            del index[old][room]
+            if len(index[old]) == 0:
+                del index[old]
+        if new is not None:
+            index.setdefault(new, {})[room] = None
+
+    def rooms(self) -> Iterable[Room]:
+        """Returns the rooms registered with the dungeon, in the order they
+        were added."""
+        return self._rooms.values()
+
+    def freeze(self) -> Any:
+        """Returns a DungeonIndex: a compact, read-only snapshot of the rooms
+        and passages in the dungeon for fast searching. The snapshot does not
+        see later changes to the dungeon."""
+        from dungeon_index import DungeonIndex
+        return DungeonIndex.from_dungeon(self)
+
+    def frozen(self) -> Any:
+        """Returns a DungeonIndex of the dungeon as it is now, like freeze,
+        but reuses the one made by the last call until the version
+        changes."""
+        if self._frozen is None or self._frozen_version != self._version:
+            self._frozen = self.freeze()
+            self._frozen_version = self._version
+        return self._frozen
+
+
+def read_room_from_json(source: str, d: Optional[Dungeon] = None) -> Room:
+    """Read a room from a JSON source string written by Room.to_json. Its
+    neighbors are linked only when d is given and has rooms with their
+    names."""
+    record = json.loads(source)
+    room = _room_from_record(record)
+    if d is not None:
+        for direction, name in record["neighbors"].items():
+            if d.has(name):
+                room.add_single_direction_neighbor(d.find(name),
+                                                   Direction[direction])
+    return room
 
 
 def read_dungeon_from_json(source: str) -> Dungeon:
-    "Read a full dungeon from a JSON source string." ""
-    result = json.loads(source)
-    assert isinstance(result, Dungeon)
-    return result
\ No newline at end of file
+    """Read a full dungeon from a JSON source string written by
+    Dungeon.to_json."""
+    return read_dungeon_from_stream(io.StringIO(source))
+
+
+def read_dungeon_from_stream(source: TextIO,
+                             chunk_rooms: int = 1024) -> Dungeon:
+    """Read a full dungeon from a text stream written by Dungeon.write_json,
+    one room per line. Rooms are read chunk_rooms at a time and added with
+    add_rooms, and the passages of each chunk whose rooms have both been
+    read are added with add_passages, so only passages to rooms further on
+    in the stream are held back. Also accepts the same JSON object laid out
+    in any other way, by parsing it whole."""
+    header = source.readline()
+    try:
+        start_name = json.loads(header.rstrip().rstrip(",") + "]}")["start"]
+        records: Iterator[Dict[str, Any]] = _records_by_line(source)
+    except ValueError:
+        document = json.loads(header + source.read())
+        start_name = document["start"]
+        records = iter(document["rooms"])
+    rooms: Dict[str, Room] = {}
+    waiting: Dict[str, List[Tuple[Room, Direction]]] = {}
+    result = None
+    while True:
+        chunk = list(islice(records, chunk_rooms))
+        if len(chunk) == 0:
+            break
+        registered = []
+        for record in chunk:
+            room = _room_from_record(record)
+            rooms[room.name] = room
+            if result is None:
+                assert room.name == start_name
+                result = Dungeon(room)
+            elif record.get("registered", True):
+                registered.append(room)
+        passages: List[Tuple[Room, Room, Direction, bool]] = []
+        for record in chunk:
+            room = rooms[record["name"]]
+            for direction, name in record["neighbors"].items():
+                if name in rooms:
+                    passages.append((room, rooms[name],
+                                     _DIRECTIONS_BY_NAME[direction], True))
+                else:
+                    waiting.setdefault(name, []).append(
+                        (room, _DIRECTIONS_BY_NAME[direction]))
+            for other, direction in waiting.pop(room.name, []):
+                passages.append((other, room, direction, True))
+        assert result is not None
+        result.add_rooms(registered)
+        result.add_passages(passages)
+    assert result is not None and len(waiting) == 0
+    return result
+
+
+def _records_by_line(source: TextIO) -> Iterator[Dict[str, Any]]:
+    """Yields the room records from the lines of a stream written by
+    Dungeon.write_json, after its header line."""
+    for line in source:
+        line = line.strip()
+        if line.startswith("]"):
+            return
+        if len(line) != 0:
+            yield json.loads(line.rstrip(","))
+
+
+def _room_from_record(record: Dict[str, Any]) -> Room:
+    """Returns a new room with the fields in record, without neighbors."""
+    room = Room(record["name"], record["level"])
+    room.trap = record.get("trap")
+    room.monster = record.get("monster")
+    return room
@@ -0,0 +1,167 @@
+#
+# dungeon_builders.py: generators for large dungeons of regular shapes -
+#   grids, stacks of grids joined by stairs, and random sparse maps - built
+#   with Dungeon's bulk add_rooms and add_passages.
+#
+# Each generator makes the same rooms and passages as building the dungeon
+# a room and a passage at a time would (for grids, as the tests' fully
+# connected grid does), only much faster.
+#
+
+from dungeon import Dungeon, Room, Direction
+from typing import *
+from itertools import chain, repeat
+import random
+
+
+def _grid_passages(rooms: List[Room], rows: int, cols: int,
+                   first: int = 0) -> Iterator[Tuple[Room, Room, Direction]]:
+    """Returns the two-way passages joining each room of the rows by cols
+    grid starting at rooms[first] to the rooms north and west of it, paired
+    up by slicing rather than a room at a time."""
+    grid = rooms[first:first + rows * cols]
+    north = zip(grid[cols:], grid, repeat(Direction.NORTH))
+    west = [zip(grid[i + 1:i + cols], grid[i:i + cols - 1],
+                repeat(Direction.WEST)) for i in range(0, len(grid), cols)]
+    return chain(north, *west)
+
+
+def grid_dungeon(rows: int, cols: int, level: int = 1) -> Dungeon:
+    """Return a fully connected rows by cols grid of rooms named "row,col"
+    on the given level, starting at "0,0". Each room has two-way passages
+    to the rooms north, south, east and west of it."""
+    rooms = [Room("%d,%d" % (row, col), level)
+             for row in range(rows) for col in range(cols)]
+    d = Dungeon(rooms[0])
+    d.add_rooms(rooms[1:])
+    d.add_passages(_grid_passages(rooms, rows, cols))
+    return d
+
+
+def stacked_dungeon(levels: int, rows: int, cols: int,
+                    stairs: Optional[List[Tuple[int, int]]] = None
+                    ) -> Dungeon:
+    """Return levels fully connected rows by cols grids, one per level from
+    1 up, with rooms named "level:row,col" and starting at "1:0,0". At each
+    (row, col) position in stairs, every level has a two-way passage UP to
+    the same position on the level above; without stairs, every position
+    has them."""
+    if stairs is None:
+        stairs = [(row, col) for row in range(rows) for col in range(cols)]
+    rooms = [Room("%d:%d,%d" % (level, row, col), level)
+             for level in range(1, levels + 1)
+             for row in range(rows) for col in range(cols)]
+    d = Dungeon(rooms[0])
+    d.add_rooms(rooms[1:])
+    passages: List[Tuple[Room, Room, Direction]] = []
+    size = rows * cols
+    for level in range(levels):
+        passages.extend(_grid_passages(rooms, rows, cols, level * size))
+        if level != 0:
+            for row, col in stairs:
+                i = level * size + row * cols + col
+                passages.append((rooms[i - size], rooms[i], Direction.UP))
+    d.add_passages(passages)
+    return d
+
+
+def random_dungeon(size: int, passages: int, seed: int = 0) -> Dungeon:
+    """Return a dungeon of size rooms named by number, starting at "0", with
+    the given number of two-way passages between random pairs of rooms in
+    random directions. A later passage in the same direction as an earlier
+    one replaces it, so some rooms may end up with one-way passages. The
+    same seed always gives the same dungeon."""
+    rng = random.Random(seed)
+    rooms = [Room(str(i), 1) for i in range(size)]
+    d = Dungeon(rooms[0])
+    d.add_rooms(rooms[1:])
+    directions = list(Direction)
+    links = []
+    for i in range(passages):
+        a, b = rng.sample(rooms, 2)
+        links.append((a, b, rng.choice(directions)))
+    d.add_passages(links)
+    return d
+
+
+def chain_dungeon(length: int) -> Dungeon:
+    """Return a dungeon of length rooms named by number in a line running
+    east from "0"."""
+    rooms = [Room(str(i), 1) for i in range(length)]
+    d = Dungeon(rooms[0])
+    d.add_rooms(rooms[1:])
+    d.add_passages((rooms[i - 1], rooms[i], Direction.EAST)
+                   for i in range(1, length))
+    return d
+
+
+def tree_dungeon(depth: int) -> Dungeon:
+    """Return a complete binary tree of rooms depth passages deep, named by
+    number in breadth-first order from the root "0". Room i has two-way
+    passages EAST to room 2i + 1 and DOWN to room 2i + 2, so its level is
+    one more than its number of steps DOWN from the root."""
+    rooms = [Room("0", 1)]
+    for i in range(1, 2 ** (depth + 1) - 1):
+        parent = rooms[(i - 1) // 2]
+        rooms.append(Room(str(i), parent.level + (1 if i % 2 == 0 else 0)))
+    d = Dungeon(rooms[0])
+    d.add_rooms(rooms[1:])
+    d.add_passages((rooms[(i - 1) // 2], rooms[i],
+                    Direction.DOWN if i % 2 == 0 else Direction.EAST)
+                   for i in range(1, len(rooms)))
+    return d
+
+
+def looped_dungeon(loops: int, loop_size: int) -> Dungeon:
+    """Return loops rings of loop_size rooms each, named "loop.room" and
+    starting at "0.0", so there are two ways around every ring. Each ring's
+    rooms are joined EAST and WEST in a circle, and room 0 of each ring
+    has a two-way passage DOWN to room 0 of the next."""
+    assert loop_size >= 3
+    rooms = [Room("%d.%d" % (loop, i), loop + 1)
+             for loop in range(loops) for i in range(loop_size)]
+    d = Dungeon(rooms[0])
+    d.add_rooms(rooms[1:])
+    passages = []
+    for loop in range(loops):
+        first = loop * loop_size
+        for i in range(loop_size):
+            passages.append((rooms[first + i],
+                             rooms[first + (i + 1) % loop_size],
+                             Direction.EAST))
+        if loop != 0:
+            passages.append((rooms[first - loop_size], rooms[first],
+                             Direction.DOWN))
+    d.add_passages(passages)
+    return d
+
+
+def corridor_dungeon(rows: int, cols: int, length: int) -> Dungeon:
+    """Return a rows by cols grid of junction rooms named "row,col",
+    starting at "0,0", where neighboring junctions are joined by a two-way
+    corridor of length rooms rather than directly. The rooms of the corridor
+    east of a junction are named "row,col-e.i" and those south of it
+    "row,col-s.i", for i from 0 nearest the junction."""
+    junctions = [Room("%d,%d" % (row, col), 1)
+                 for row in range(rows) for col in range(cols)]
+    d = Dungeon(junctions[0])
+    d.add_rooms(junctions[1:])
+    passages = []
+    for row in range(rows):
+        for col in range(cols):
+            here = junctions[row * cols + col]
+            for way, direction, far in [
+                    ("e", Direction.EAST, col + 1 < cols),
+                    ("s", Direction.SOUTH, row + 1 < rows)]:
+                if not far:
+                    continue
+                corridor = [Room("%s-%s.%d" % (here.name, way, i), 1)
+                            for i in range(length)]
+                d.add_rooms(corridor)
+                there = junctions[row * cols + col +
+                                  (1 if way == "e" else cols)]
+                chain = [here] + corridor + [there]
+                passages.extend((chain[i], chain[i + 1], direction)
+                                for i in range(len(chain) - 1))
+    d.add_passages(passages)
+    return d
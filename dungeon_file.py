@@ -0,0 +1,381 @@
+#
+# dungeon_file.py: a compact binary file format for dungeons that can be
+#   memory-mapped and searched in place, so that huge dungeons load almost
+#   instantly and worker processes share one copy of the map.
+#
+# The file starts with a fixed header: the magic bytes, then a table giving
+# the byte position and length of each section.  Every section is a packed
+# array in native byte order starting on an 8-byte boundary:
+#
+#   name_offsets   q[rooms + 1]  position of each room name in name_bytes
+#   name_bytes     UTF-8 room names, back to back
+#   sorted_ids     i[rooms]      room ids in order of their encoded names
+#   levels         i[rooms]
+#   traps          i[rooms]      index into the label table, or -1 for none
+#   monsters       i[rooms]      index into the label table, or -1 for none
+#   registered     B[rooms]      1 if the room is registered with the dungeon
+#   components     i[rooms]      weak component of each room
+#   offsets        q[rooms + 1]  passages out of each room, as in DungeonIndex
+#   targets        i[passages]
+#   directions     b[passages]
+#   reverse_offsets, reverse_targets   passages into each room
+#   label_offsets  q[labels + 1], label_bytes   trap and monster names
+#
+# Room ids match Dungeon.freeze, so the start room is always room 0.
+#
+
+from dungeon import Dungeon, Room, Direction
+from dungeon_index import DungeonIndex
+from typing import *
+from array import array
+import mmap
+import struct
+import sys
+
+MAGIC = b"RATDUNG1"
+SECTIONS = ["name_offsets", "name_bytes", "sorted_ids", "levels", "traps",
+            "monsters", "registered", "components", "offsets", "targets",
+            "directions", "reverse_offsets", "reverse_targets",
+            "label_offsets", "label_bytes"]
+TYPECODES = {"name_offsets": "q", "name_bytes": "B", "sorted_ids": "i",
+             "levels": "i", "traps": "i", "monsters": "i", "registered": "B",
+             "components": "i", "offsets": "q", "targets": "i",
+             "directions": "b", "reverse_offsets": "q",
+             "reverse_targets": "i", "label_offsets": "q", "label_bytes": "B"}
+# magic, byte order, registered room count, then (position, length) pairs
+HEADER = struct.Struct("<8s8sq" + "qq" * len(SECTIONS))
+
+
+def _string_table(strings: List[str]) -> Tuple[array, array]:
+    """Returns (offsets, bytes) arrays holding the UTF-8 encoded strings."""
+    offsets = array('q', [0])
+    data = array('B')
+    for s in strings:
+        data.frombytes(s.encode("utf-8"))
+        offsets.append(len(data))
+    return offsets, data
+
+
+def _weak_components(index: DungeonIndex) -> array:
+    """Returns the weak component of each room in index, ignoring the
+    direction of passages, found with union-find."""
+    parents = array('i', range(index.room_count()))
+
+    def find(x: int) -> int:
+        while parents[x] != x:
+            parents[x] = parents[parents[x]]
+            x = parents[x]
+        return x
+
+    offsets = index.offsets
+    targets = index.targets
+    for room in range(index.room_count()):
+        a = find(room)
+        for i in range(offsets[room], offsets[room + 1]):
+            b = find(targets[i])
+            if a != b:
+                parents[b] = a
+    return array('i', [find(x) for x in range(index.room_count())])
+
+
+def write_dungeon_file(d: Dungeon, path: str) -> None:
+    """Writes d to the file at path in the binary dungeon format; rooms that
+    are not registered with d but are reachable from registered rooms are
+    included and marked as unregistered."""
+    index = d.freeze()
+    labels: Dict[str, int] = {}
+
+    def label(name: Optional[str]) -> int:
+        if name is None:
+            return -1
+        return labels.setdefault(name, len(labels))
+
+    name_offsets, name_bytes = _string_table(index.names)
+    encoded = [name.encode("utf-8") for name in index.names]
+    reverse_offsets, reverse_targets = index.reverse_adjacency()
+    registered = array('B', [1 if d.has(r.name) and d.find(r.name) is r else 0
+                             for r in index.rooms])
+    sections = {
+        "name_offsets": name_offsets,
+        "name_bytes": name_bytes,
+        "sorted_ids": array('i', sorted(range(index.room_count()),
+                                        key=encoded.__getitem__)),
+        "levels": array('i', [r.level for r in index.rooms]),
+        "traps": array('i', [label(r.trap) for r in index.rooms]),
+        "monsters": array('i', [label(r.monster) for r in index.rooms]),
+        "registered": registered,
+        "components": _weak_components(index),
+        "offsets": index.offsets,
+        "targets": index.targets,
+        "directions": index.directions,
+        "reverse_offsets": reverse_offsets,
+        "reverse_targets": reverse_targets,
+    }
+    sections["label_offsets"], sections["label_bytes"] = \
+        _string_table(list(labels))
+    table = []
+    position = HEADER.size
+    for name in SECTIONS:
+        position += -position % 8
+        length = len(sections[name]) * sections[name].itemsize
+        table += [position, length]
+        position += length
+    with open(path, "wb") as out:
+        out.write(HEADER.pack(MAGIC, sys.byteorder.encode().ljust(8),
+                              sum(registered), *table))
+        for name, start in zip(SECTIONS, table[::2]):
+            out.write(b"\0" * (start - out.tell()))
+            sections[name].tofile(out)
+
+
+class _StringTable:
+    """Read-only sequence of the strings in a mapped string table, decoded
+    one at a time as they are asked for."""
+
+    def __init__(self, offsets: memoryview, data: memoryview):
+        self._offsets = offsets
+        self._data = data
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return str(self._data[self._offsets[i]:self._offsets[i + 1]], "utf-8")
+
+    def encoded(self, i: int) -> bytes:
+        """Returns the UTF-8 bytes of string i."""
+        return bytes(self._data[self._offsets[i]:self._offsets[i + 1]])
+
+
+class MappedRoom(Room):
+    """A room of a MappedDungeon. Its neighbors are read from the file, and
+    turned into rooms, the first time they are asked for. Mapped dungeons
+    are read-only, so passages cannot be added or removed. The room's id is
+    its id in the file."""
+
+    __slots__ = ('_mapped', '_loaded')
+
+    def __init__(self, dungeon: 'MappedDungeon', room_id: int):
+        """Create the room with the given id in a mapped dungeon."""
+        super().__init__(dungeon.names[room_id], dungeon.levels[room_id])
+        trap = dungeon.traps[room_id]
+        monster = dungeon.monsters[room_id]
+        if trap != -1:
+            self.trap = dungeon.labels[trap]
+        if monster != -1:
+            self.monster = dungeon.labels[monster]
+        self._mapped = dungeon
+        self._id = room_id
+        self._loaded = False
+
+    def __load(self) -> None:
+        if not self._loaded:
+            d = self._mapped
+            for i in range(d.offsets[self._id], d.offsets[self._id + 1]):
+                self._set_neighbor(d.room(d.targets[i]),
+                                   Direction(d.directions[i]))
+            self._loaded = True
+
+    def neighbor_to(self, d: Direction) -> Any:
+        """Returns neighbor in given direction, or None if there is none."""
+        self.__load()
+        return super().neighbor_to(d)
+
+    def neighbors(self) -> List[Any]:
+        """Returns list of rooms reachable from current room."""
+        self.__load()
+        return super().neighbors()
+
+    def passages(self) -> List[Tuple[Direction, Any]]:
+        """Returns (direction, neighbor) for each passage out of the room."""
+        self.__load()
+        return super().passages()
+
+    def add_single_direction_neighbor(self, r, d: Direction) -> None:
+        """Fails: rooms in a mapped dungeon cannot be changed."""
+        assert False, "mapped dungeons are read-only"
+
+    def remove_single_direction_neighbor(self, d: Direction) -> None:
+        """Fails: rooms in a mapped dungeon cannot be changed."""
+        assert False, "mapped dungeons are read-only"
+
+
+class MappedDungeon:
+    """A read-only dungeon memory-mapped from a file written by
+    write_dungeon_file. It offers the lookup and search interface of Dungeon
+    (start, has, find, size, rooms, has_path, freeze and the trap and
+    monster lookups) without reading the
+    file up front: rooms are looked up by binary search over the sorted
+    names and Room objects are only made for rooms that are asked for.
+
+    The dungeon is also its own DungeonIndex: freeze returns it, and its
+    offsets, targets and directions are zero-copy views of the file, so a
+    Rat given it with set_index searches the mapped file directly.
+    """
+
+    def __init__(self, path: str):
+        """Map the dungeon file at path."""
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        fields = HEADER.unpack_from(self._view)
+        assert fields[0] == MAGIC, path + " is not a dungeon file"
+        assert fields[1].strip() == sys.byteorder.encode(), \
+            path + " was written with a different byte order"
+        self._registered_count = fields[2]
+        for i, name in enumerate(SECTIONS):
+            start, length = fields[3 + 2 * i], fields[4 + 2 * i]
+            setattr(self, name,
+                    self._view[start:start + length].cast(TYPECODES[name]))
+        self.names = _StringTable(self.name_offsets, self.name_bytes)
+        self.labels = _StringTable(self.label_offsets, self.label_bytes)
+        self._rooms: Dict[int, MappedRoom] = {}
+
+    def close(self) -> None:
+        """Release the mapping; rooms already made keep working only for
+        neighbors they have already loaded."""
+        for name in SECTIONS:
+            getattr(self, name).release()
+        self._view.release()
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self) -> 'MappedDungeon':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    @property
+    def start(self) -> Room:
+        """Recommended starting point for exploring the dungeon."""
+        return self.room(0)
+
+    @property
+    def version(self) -> int:
+        """Mapped dungeons never change."""
+        return 0
+
+    @property
+    def path_cache(self) -> Any:
+        """Mapped dungeons do not cache paths."""
+        return None
+
+    def size(self) -> int:
+        """Returns the number of rooms registered with the dungeon."""
+        return self._registered_count
+
+    def room_count(self) -> int:
+        """Returns the number of rooms in the file, registered or not."""
+        return len(self.levels)
+
+    def id_of(self, room_name: str) -> int:
+        """Returns the id of the named room, or -1 if there is none, by
+        binary search over the sorted names."""
+        key = room_name.encode("utf-8")
+        low = 0
+        high = len(self.sorted_ids)
+        while low < high:
+            middle = (low + high) // 2
+            if self.names.encoded(self.sorted_ids[middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.sorted_ids) \
+                and self.names.encoded(self.sorted_ids[low]) == key:
+            return self.sorted_ids[low]
+        return -1
+
+    def has(self, room_name: str) -> bool:
+        """Returns true if the dungeon has a room with the given name."""
+        room_id = self.id_of(room_name)
+        return room_id != -1 and self.registered[room_id] == 1
+
+    def find(self, room_name: str) -> Room:
+        """Returns the named room in the dungeon or fails."""
+        assert self.has(room_name)
+        return self.room(self.id_of(room_name))
+
+    def room(self, room_id: int) -> Room:
+        """Returns the room with the given id, making it on first use."""
+        room = self._rooms.get(room_id)
+        if room is None:
+            room = MappedRoom(self, room_id)
+            self._rooms[room_id] = room
+        return room
+
+    def rooms(self) -> Iterable[Room]:
+        """Returns the rooms registered with the dungeon, start first."""
+        return (self.room(i) for i in range(self.room_count())
+                if self.registered[i] == 1)
+
+    def rooms_with_trap(self, trap: str) -> List[Room]:
+        """Returns the registered rooms with the named trap, by a scan of
+        the mapped trap labels."""
+        return self.__rooms_labelled(self.traps, trap)
+
+    def rooms_with_monster(self, monster: str) -> List[Room]:
+        """Returns the registered rooms with the named monster, by a scan
+        of the mapped monster labels."""
+        return self.__rooms_labelled(self.monsters, monster)
+
+    def trap_names(self) -> List[str]:
+        """Returns the names of the traps in the dungeon's rooms."""
+        return self.__labels_used(self.traps)
+
+    def monster_names(self) -> List[str]:
+        """Returns the names of the monsters in the dungeon's rooms."""
+        return self.__labels_used(self.monsters)
+
+    def __rooms_labelled(self, labelled: memoryview, name: str) -> List[Room]:
+        for label in range(len(self.labels)):
+            if self.labels[label] == name:
+                return [self.room(i) for i in range(len(labelled))
+                        if labelled[i] == label and self.registered[i] == 1]
+        return []
+
+    def __labels_used(self, labelled: memoryview) -> List[str]:
+        used = set(labelled[i] for i in range(len(labelled))
+                   if self.registered[i] == 1)
+        return [self.labels[label] for label in sorted(used) if label != -1]
+
+    def has_path(self, a: Room, b: Room) -> bool:
+        """Returns false if rooms a and b are in different weak components
+        of the map, so there is certainly no path between them."""
+        i = self.id_of(a.name)
+        j = self.id_of(b.name)
+        return i == -1 or j == -1 or self.components[i] == self.components[j]
+
+    def freeze(self) -> 'MappedDungeon':
+        """Returns the dungeon itself, which already has the DungeonIndex
+        interface."""
+        return self
+
+    def reverse_adjacency(self) -> Tuple[memoryview, memoryview]:
+        """Returns the mapped (offsets, targets) of passages into each room;
+        see DungeonIndex.reverse_adjacency."""
+        return self.reverse_offsets, self.reverse_targets
+
+
+def read_dungeon_file(path: str) -> Dungeon:
+    """Reads the binary dungeon file at path into an ordinary, editable
+    Dungeon with every room made up front."""
+    with MappedDungeon(path) as mapped:
+        rooms = []
+        for i in range(mapped.room_count()):
+            room = Room(mapped.names[i], mapped.levels[i])
+            if mapped.traps[i] != -1:
+                room.trap = mapped.labels[mapped.traps[i]]
+            if mapped.monsters[i] != -1:
+                room.monster = mapped.labels[mapped.monsters[i]]
+            rooms.append(room)
+        result = Dungeon(rooms[0])
+        result.add_rooms(rooms[i] for i in range(1, len(rooms))
+                         if mapped.registered[i] == 1)
+        directions = list(Direction)
+        result.add_passages(
+            (room, rooms[mapped.targets[e]],
+             directions[mapped.directions[e] - 1], True)
+            for i, room in enumerate(rooms)
+            for e in range(mapped.offsets[i], mapped.offsets[i + 1]))
+        return result
@@ -0,0 +1,112 @@
+#
+# dungeon_index.py: a compact, read-only snapshot of the passages in a
+#   dungeon, used to search large dungeons without walking Room objects.
+#
+
+from dungeon import Dungeon, Room
+from typing import *
+from array import array
+
+
+class DungeonIndex:
+    """Immutable compressed-sparse-row (CSR) snapshot of a dungeon. Rooms are
+    numbered 0..room_count()-1, with the dungeon's start room numbered 0. The
+    neighbors of room i are targets[offsets[i]:offsets[i + 1]], listed in
+    the same order as Room.neighbors(), and directions holds the matching
+    Direction values. Later changes to the dungeon are not reflected in the
+    index; freeze the dungeon again after editing it.
+
+    Attributes:
+        names (List[str]): room names, indexed by room id
+        rooms (List[Room]): room objects, indexed by room id
+        offsets (array): start of each room's neighbors in targets; has
+            room_count() + 1 entries
+        targets (array): room ids of the neighbors of each room
+        directions (array): Direction value of each entry in targets
+    """
+
+    def __init__(self, rooms: List[Room], offsets: array, targets: array,
+                 directions: array):
+        """Initialize the index from already built arrays; use from_dungeon
+        or Dungeon.freeze to build one from a dungeon."""
+        self.rooms = rooms
+        self.names = [r.name for r in rooms]
+        self.offsets = offsets
+        self.targets = targets
+        self.directions = directions
+        self._ids = {name: i for i, name in enumerate(self.names)}
+        self._reverse: Optional[Tuple[array, array]] = None
+
+    @staticmethod
+    def from_dungeon(d: Dungeon) -> 'DungeonIndex':
+        """Build an index of every room registered with d along with any
+        unregistered rooms that can be reached from them."""
+        rooms: List[Room] = []
+        ids: Dict[str, int] = {}
+        for r in [d.start] + [r for r in d.rooms() if r is not d.start]:
+            if r.name not in ids:
+                ids[r.name] = len(rooms)
+                rooms.append(r)
+        offsets = array('q', [0])
+        targets = array('i')
+        directions = array('b')
+        i = 0
+        while i < len(rooms):
+            room = rooms[i]
+            for direction, n in room.passages():
+                if n.name not in ids:
+                    ids[n.name] = len(rooms)
+                    rooms.append(n)
+                targets.append(ids[n.name])
+                directions.append(direction.value)
+            offsets.append(len(targets))
+            i += 1
+        return DungeonIndex(rooms, offsets, targets, directions)
+
+    def room_count(self) -> int:
+        """Returns the number of rooms in the index, registered with the
+        dungeon or not; room ids run from 0 to one less. Searches over an
+        index size their tables by it, since a dungeon's size counts only
+        the registered rooms."""
+        return len(self.names)
+
+    def has(self, room_name: str) -> bool:
+        """Returns true if the index has a room with the given name."""
+        return room_name in self._ids
+
+    def id_of(self, room_name: str) -> int:
+        """Returns the id of the named room or fails."""
+        assert self.has(room_name)
+        return self._ids[room_name]
+
+    def room(self, room_id: int) -> Room:
+        """Returns the room with the given id."""
+        return self.rooms[room_id]
+
+    def neighbor_ids(self, room_id: int) -> array:
+        """Returns the ids of the rooms reachable from the given room."""
+        return self.targets[self.offsets[room_id]:self.offsets[room_id + 1]]
+
+    def reverse_adjacency(self) -> Tuple[array, array]:
+        """Returns (offsets, targets) arrays in the same layout as the index
+        but for passages followed backwards: the rooms with a passage into
+        room i are targets[offsets[i]:offsets[i + 1]]. One-way passages
+        appear only in the direction they can be travelled. The arrays are
+        built on first use and kept."""
+        if self._reverse is None:
+            offsets = self.offsets
+            targets = self.targets
+            reverse_offsets = array('q', [0]) * (self.room_count() + 1)
+            for t in targets:
+                reverse_offsets[t + 1] += 1
+            for i in range(self.room_count()):
+                reverse_offsets[i + 1] += reverse_offsets[i]
+            reverse_targets = array('i', [0]) * len(targets)
+            fill = reverse_offsets[:-1]
+            for room in range(self.room_count()):
+                for i in range(offsets[room], offsets[room + 1]):
+                    t = targets[i]
+                    reverse_targets[fill[t]] = room
+                    fill[t] += 1
+            self._reverse = (reverse_offsets, reverse_targets)
+        return self._reverse
@@ -0,0 +1,463 @@
+#
+# dungeon_shards.py: out-of-core dungeons for worlds too big to hold as Room
+#   objects, stored on disk as one shard per level and read in a level at a
+#   time as rooms are looked up or searched.
+#
+# write_sharded_dungeon turns a dungeon into a folder holding:
+#
+#   dungeon.json      the start room, the number of registered rooms, the
+#                     number of name buckets and, for each level, its shard
+#                     file, room count, the traps and monsters on it and the
+#                     levels its UP and DOWN passages lead to
+#   level-<n>.json    the rooms on level n, a list per field so that it
+#                     decodes quickly: names, traps, monsters, registered
+#                     flags and components, by position; then the passages
+#                     of every room in turn, as lists of direction values,
+#                     levels and positions of the rooms they lead to, with
+#                     offsets giving where each room's passages begin; and
+#                     away, the names of the rooms on other levels, by
+#                     passage (a room on the same level is named in names)
+#   names-<k>.json    the level and position of each room whose name falls
+#                     in bucket k (by CRC-32), so that finding a room by
+#                     name reads one small bucket instead of every shard
+#
+# ShardedDungeon reads the folder.  Its rooms are ShardRooms, which hold only
+# a name, a level and a position, and read their passages, trap and monster
+# from their level's shard, loading it if it is not in memory.  Loaded shards
+# are kept in a bounded least-recently-used cache.  When a shard has to be
+# read, the levels its UP and DOWN passages lead to are read and decoded in
+# a background thread, so that a search climbing the stairs usually finds
+# the next level ready instead of waiting for it.
+# Like MappedDungeon, a ShardedDungeon is read-only and offers the lookup and
+# search interface of Dungeon, so Rat searches work on it unchanged.
+#
+
+from dungeon import Dungeon, Room, Direction
+from dungeon_file import _weak_components
+from typing import *
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import json
+import os
+import weakref
+import zlib
+
+FORMAT = "rat-shards-2"
+_DIRECTIONS = list(Direction)  # by value - 1
+
+
+def _bucket(name: str, buckets: int) -> int:
+    """Returns the name bucket of the named room."""
+    return zlib.crc32(name.encode("utf-8")) % buckets
+
+
+def _shard_record(level: int, rooms: List[List[Any]]) -> Dict[str, Any]:
+    """Returns the contents of the shard file for level, given its rooms
+    as [name, trap, monster, registered, component, passages] lists."""
+    record: Dict[str, Any] = {
+        "level": level, "names": [], "traps": [], "monsters": [],
+        "registered": [], "components": [], "offsets": [0],
+        "directions": [], "levels": [], "positions": [], "away": {}}
+    for name, trap, monster, registered, component, passages in rooms:
+        record["names"].append(name)
+        record["traps"].append(trap)
+        record["monsters"].append(monster)
+        record["registered"].append(registered)
+        record["components"].append(component)
+        for direction, other, position, target in passages:
+            if other != level:
+                record["away"][len(record["directions"])] = target
+            record["directions"].append(direction)
+            record["levels"].append(other)
+            record["positions"].append(position)
+        record["offsets"].append(len(record["directions"]))
+    return record
+
+
+def write_sharded_dungeon(d: Dungeon, folder: str,
+                          bucket_size: int = 4096) -> None:
+    """Writes d to folder, which is created if need be, as one shard per
+    level; rooms that are not registered with d but are reachable from
+    registered rooms are included and marked as unregistered."""
+    index = d.freeze()
+    components = _weak_components(index)
+    places: List[Tuple[int, int]] = []
+    shards: Dict[int, List[Any]] = {}
+    for room in index.rooms:
+        shard = shards.setdefault(room.level, [])
+        places.append((room.level, len(shard)))
+        shard.append(None)
+    levels: Dict[str, Any] = {}
+    registered_count = 0
+    for i, room in enumerate(index.rooms):
+        level, position = places[i]
+        registered = d.has(room.name) and d.find(room.name) is room
+        registered_count += registered
+        passages = []
+        for e in range(index.offsets[i], index.offsets[i + 1]):
+            target = index.targets[e]
+            passages.append([index.directions[e]] + list(places[target]) +
+                            [index.names[target]])
+        shards[level][position] = [room.name, room.trap, room.monster,
+                                   registered, components[i], passages]
+        about = levels.setdefault(str(level), {
+            "file": "level-%d.json" % level, "rooms": 0, "linked": [],
+            "traps": [], "monsters": []})
+        about["rooms"] += 1
+        for label, names in [(room.trap, about["traps"]),
+                             (room.monster, about["monsters"])]:
+            if label is not None and registered and label not in names:
+                names.append(label)
+        for direction, other, position, name in passages:
+            if Direction(direction) in (Direction.UP, Direction.DOWN) \
+                    and other != level and other not in about["linked"]:
+                about["linked"].append(other)
+    buckets = max(1, -(-index.room_count() // bucket_size))
+    names: List[Dict[str, List[Any]]] = [{} for i in range(buckets)]
+    for i, room in enumerate(index.rooms):
+        names[_bucket(room.name, buckets)][room.name] = \
+            list(places[i]) + [shards[places[i][0]][places[i][1]][3]]
+    os.makedirs(folder, exist_ok=True)
+    for level, rooms in shards.items():
+        with open(os.path.join(folder, "level-%d.json" % level), "w") as out:
+            out.write(json.dumps(_shard_record(level, rooms)))
+    for k, bucket in enumerate(names):
+        with open(os.path.join(folder, "names-%d.json" % k), "w") as out:
+            out.write(json.dumps(bucket))
+    with open(os.path.join(folder, "dungeon.json"), "w") as out:
+        json.dump({"format": FORMAT, "start": list(places[0]),
+                   "start_name": index.names[0], "size": registered_count,
+                   "buckets": buckets, "levels": levels}, out)
+
+
+class _Shard:
+    """The rooms of one level as read from its shard file.
+
+    Attributes:
+        level (int): the level
+        names (List[str]): room names, by position
+        traps (List[Optional[str]]): trap in each room, or None
+        monsters (List[Optional[str]]): monster in each room, or None
+        registered (List[bool]): whether each room is registered
+        components (List[int]): weak component of each room
+    """
+
+    def __init__(self, record: Dict[str, Any]):
+        """Create the shard from the contents of its file."""
+        self.level = record["level"]
+        self.names = record["names"]
+        self.traps = record["traps"]
+        self.monsters = record["monsters"]
+        self.registered = record["registered"]
+        self.components = record["components"]
+        self._offsets = record["offsets"]
+        self._directions = record["directions"]
+        self._levels = record["levels"]
+        self._positions = record["positions"]
+        self._away = {int(e): name for e, name in record["away"].items()}
+
+    def passages(self, position: int) -> List[Tuple[int, int, int, str]]:
+        """Returns the passages out of the room at position, in direction
+        order, as the direction value and the level, position and name of
+        the room each leads to."""
+        begin = self._offsets[position]
+        end = self._offsets[position + 1]
+        level = self.level
+        names = self.names
+        away = self._away
+        return [(value, other, at, names[at] if other == level else away[e])
+                for e, value, other, at in zip(
+                    range(begin, end), self._directions[begin:end],
+                    self._levels[begin:end], self._positions[begin:end])]
+
+
+class ShardRoom(Room):
+    """A room of a ShardedDungeon. It holds only its name, level and
+    position in its level's shard, and reads its passages, trap and monster
+    from the shard whenever they are asked for, loading the shard if it has
+    been evicted. Sharded dungeons are read-only, so passages cannot be
+    added or removed."""
+
+    __slots__ = ('_sharded', '_position', '__weakref__')
+
+    def __init__(self, dungeon: 'ShardedDungeon', level: int, position: int,
+                 name: str):
+        """Create the room at position in the shard for level."""
+        super().__init__(name, level)
+        self._sharded = dungeon
+        self._position = position
+
+    @property
+    def trap(self) -> Optional[str]:
+        """Name of the trap in the room, or None."""
+        return self._sharded._shard(self._level).traps[self._position]
+
+    @property
+    def monster(self) -> Optional[str]:
+        """Name of the monster in the room, or None."""
+        return self._sharded._shard(self._level).monsters[self._position]
+
+    def neighbor_to(self, d: Direction) -> Any:
+        """Returns neighbor in given direction, or None if there is none."""
+        for direction, room in self.passages():
+            if direction is d:
+                return room
+        return None
+
+    def neighbors(self) -> List[Any]:
+        """Returns list of rooms reachable from current room."""
+        room = self._sharded._room
+        return [room(level, position, name) for value, level, position,
+                name in self._sharded._shard(self._level).passages(
+                    self._position)]
+
+    def passages(self) -> List[Tuple[Direction, Any]]:
+        """Returns (direction, neighbor) for each passage out of the room, in
+        direction order."""
+        room = self._sharded._room
+        return [(_DIRECTIONS[value - 1], room(level, position, name))
+                for value, level, position, name in
+                self._sharded._shard(self._level).passages(self._position)]
+
+    def add_single_direction_neighbor(self, r, d: Direction) -> None:
+        """Fails: rooms in a sharded dungeon cannot be changed."""
+        assert False, "sharded dungeons are read-only"
+
+    def remove_single_direction_neighbor(self, d: Direction) -> None:
+        """Fails: rooms in a sharded dungeon cannot be changed."""
+        assert False, "sharded dungeons are read-only"
+
+
+class ShardedDungeon:
+    """A read-only dungeon stored on disk by write_sharded_dungeon, holding
+    at most max_shards levels in memory at once. It offers the lookup and
+    search interface of Dungeon (start, has, find, size, rooms, has_path,
+    freeze and the trap and monster lookups). A room asked for twice is the
+    same ShardRoom as long as anything still refers to it.
+
+    Attributes:
+        max_shards (int): most levels kept in memory at once
+        hits (int): shard lookups answered from memory, including shards
+            read ahead that were ready when asked for
+        misses (int): shard lookups that had to wait for a shard to be read
+        evictions (int): shards dropped to stay within max_shards
+        prefetches (int): shards read ahead of being asked for
+        prefetch_hits (int): lookups answered by a shard read ahead, whether
+            or not it was ready
+    """
+
+    def __init__(self, folder: str, max_shards: int = 8,
+                 prefetch: bool = True):
+        """Open the sharded dungeon in folder; with prefetch, the levels the
+        stairs of a newly read shard lead to are read in the background."""
+        with open(os.path.join(folder, "dungeon.json")) as source:
+            self._manifest = json.load(source)
+        assert self._manifest.get("format") == FORMAT, \
+            folder + " is not a sharded dungeon"
+        assert max_shards >= 1
+        self.max_shards = max_shards
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.prefetches = 0
+        self.prefetch_hits = 0
+        self._folder = folder
+        self._levels: Dict[str, Any] = self._manifest["levels"]
+        self._shards: OrderedDict = OrderedDict()
+        self._buckets: OrderedDict = OrderedDict()
+        self._reading: Dict[int, Future] = {}
+        self._live: weakref.WeakValueDictionary = \
+            weakref.WeakValueDictionary()
+        self._executor = ThreadPoolExecutor(1) if prefetch else None
+
+    def close(self) -> None:
+        """Stop reading ahead and drop the cached shards."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._shards.clear()
+        self._reading.clear()
+
+    def __enter__(self) -> 'ShardedDungeon':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def wait_for_reads(self) -> None:
+        """Waits for the shards being read ahead to be ready, for instance
+        while a game shows the stairs to the next level."""
+        for reading in list(self._reading.values()):
+            if not reading.cancelled():
+                reading.result()
+
+    def hit_rate(self) -> float:
+        """Returns the fraction of shard lookups answered from memory."""
+        total = self.hits + self.misses
+        return self.hits / total if total != 0 else 0.0
+
+    def shards_cached(self) -> List[int]:
+        """Returns the levels in memory, least recently used first."""
+        return list(self._shards)
+
+    def levels(self) -> List[int]:
+        """Returns the levels of the dungeon, lowest first."""
+        return sorted(int(level) for level in self._levels)
+
+    @property
+    def start(self) -> Room:
+        """Recommended starting point for exploring the dungeon."""
+        level, position = self._manifest["start"]
+        return self._room(level, position, self._manifest["start_name"])
+
+    @property
+    def version(self) -> int:
+        """Sharded dungeons never change."""
+        return 0
+
+    @property
+    def path_cache(self) -> Any:
+        """Sharded dungeons do not cache paths."""
+        return None
+
+    def size(self) -> int:
+        """Returns the number of rooms registered with the dungeon."""
+        return self._manifest["size"]
+
+    def has(self, room_name: str) -> bool:
+        """Returns true if the dungeon has a room with the given name."""
+        place = self.__place(room_name)
+        return place is not None and place[2]
+
+    def find(self, room_name: str) -> Room:
+        """Returns the named room in the dungeon or fails."""
+        place = self.__place(room_name)
+        assert place is not None and place[2]
+        return self._room(place[0], place[1], room_name)
+
+    def rooms(self) -> Iterable[Room]:
+        """Returns the rooms registered with the dungeon, a level at a
+        time."""
+        for level in self.levels():
+            shard = self._shard(level)
+            for position in range(len(shard.names)):
+                if shard.registered[position]:
+                    yield self._room(level, position, shard.names[position])
+
+    def rooms_with_trap(self, trap: str) -> List[Room]:
+        """Returns the registered rooms with the named trap, reading only
+        the shards of levels that have it."""
+        return self.__rooms_labelled("traps", trap)
+
+    def rooms_with_monster(self, monster: str) -> List[Room]:
+        """Returns the registered rooms with the named monster, reading only
+        the shards of levels that have it."""
+        return self.__rooms_labelled("monsters", monster)
+
+    def trap_names(self) -> List[str]:
+        """Returns the names of the traps in the dungeon's rooms."""
+        return self.__labels_used("traps")
+
+    def monster_names(self) -> List[str]:
+        """Returns the names of the monsters in the dungeon's rooms."""
+        return self.__labels_used("monsters")
+
+    def has_path(self, a: Room, b: Room) -> bool:
+        """Returns false if rooms a and b are in different weak components
+        of the map, so there is certainly no path between them."""
+        if not isinstance(a, ShardRoom) or a._sharded is not self \
+                or not isinstance(b, ShardRoom) or b._sharded is not self:
+            return True
+        return self._shard(a.level).components[a._position] == \
+            self._shard(b.level).components[b._position]
+
+    def freeze(self) -> Any:
+        """Returns a DungeonIndex of the whole dungeon, reading every shard
+        to build it."""
+        from dungeon_index import DungeonIndex
+        return DungeonIndex.from_dungeon(self)
+
+    def _room(self, level: int, position: int, name: str) -> ShardRoom:
+        """Returns the room at position on level, making it if nothing
+        refers to it yet. Does not read the level's shard."""
+        room = self._live.get((level, position))
+        if room is None:
+            room = ShardRoom(self, level, position, name)
+            self._live[(level, position)] = room
+        return room
+
+    def _shard(self, level: int) -> _Shard:
+        """Returns the shard for level, reading it (or waiting for it to be
+        read ahead) if it is not in memory and evicting the least recently
+        used shard if there are too many."""
+        shard = self._shards.get(level)
+        if shard is not None:
+            self._shards.move_to_end(level)
+            self.hits += 1
+            return shard
+        reading = self._reading.pop(level, None)
+        if reading is not None:
+            if reading.done():
+                self.hits += 1
+            else:
+                self.misses += 1
+            shard = reading.result()
+            self.prefetch_hits += 1
+        else:
+            self.misses += 1
+            shard = self.__read(level)
+        self._shards[level] = shard
+        while len(self._shards) > self.max_shards:
+            self._shards.popitem(last=False)
+            self.evictions += 1
+        if self._executor is not None:
+            for linked in self._levels[str(level)]["linked"]:
+                if linked not in self._shards and linked not in self._reading:
+                    self._reading[linked] = self._executor.submit(
+                        self.__read, linked)
+                    self.prefetches += 1
+            while len(self._reading) > self.max_shards:
+                self._reading.pop(next(iter(self._reading))).cancel()
+        return shard
+
+    def __read(self, level: int) -> _Shard:
+        """Reads and decodes the shard for level; reading ahead runs this
+        in the background thread."""
+        path = os.path.join(self._folder, self._levels[str(level)]["file"])
+        with open(path, "rb") as source:
+            return _Shard(json.loads(source.read()))
+
+    def __place(self, room_name: str) -> Optional[List[Any]]:
+        """Returns the level, position and registered flag of the named
+        room, or None if there is none, from its name bucket."""
+        k = _bucket(room_name, self._manifest["buckets"])
+        bucket = self._buckets.get(k)
+        if bucket is None:
+            with open(os.path.join(self._folder, "names-%d.json" % k)) \
+                    as source:
+                bucket = json.load(source)
+            self._buckets[k] = bucket
+            while len(self._buckets) > self.max_shards:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(k)
+        return bucket.get(room_name)
+
+    def __rooms_labelled(self, kind: str, name: str) -> List[Room]:
+        found = []
+        for level in self.levels():
+            if name in self._levels[str(level)][kind]:
+                shard = self._shard(level)
+                labels = shard.traps if kind == "traps" else shard.monsters
+                found.extend(self._room(level, i, shard.names[i])
+                             for i in range(len(labels))
+                             if labels[i] == name and shard.registered[i])
+        return found
+
+    def __labels_used(self, kind: str) -> List[str]:
+        used: List[str] = []
+        for level in self.levels():
+            for label in self._levels[str(level)][kind]:
+                if label not in used:
+                    used.append(label)
+        return used
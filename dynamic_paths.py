@@ -0,0 +1,201 @@
+#
+# dynamic_paths.py: breadth-first paths from one start room that are kept
+#   up to date as passages are added to and removed from the dungeon,
+#   repairing only the part of the search tree that the change affects.
+#
+# Breadth-first search takes the rooms of each layer in the order they were
+# queued and queues a room's neighbors in Room.neighbors() order, so the
+# path it finds to a room is, among all shortest paths, the one whose
+# sequence of neighbor positions is smallest.  Comparing two rooms at the
+# same distance therefore only needs their parent links: walk both back to
+# where the paths join and compare the positions of the two branches.  That
+# is what lets a repaired tree give exactly the paths a fresh
+# Rat.bfs_path_to would.
+#
+
+from dungeon import Dungeon, Room
+from typing import *
+import heapq
+
+
+class DynamicPaths:
+    """Breadth-first search tree from a start room that listens to its
+    dungeon and repairs itself after each change. Adding a passage spreads
+    improvements outward from the room it leads to; removing a passage on
+    the tree detaches the subtree below it and rebuilds just that subtree
+    from the passages leading into it. Either way the work is proportional
+    to the rooms whose distance or path changes.
+
+    Attributes:
+        start (Room): the room paths are found from
+    """
+
+    def __init__(self, dungeon: Dungeon, start: Room):
+        """Build the tree by breadth-first search from start and start
+        listening to dungeon, which must track start (see Dungeon.tracks)."""
+        assert dungeon.tracks(start)
+        self.start = start
+        self._dungeon = dungeon
+        self._distance: Dict[Room, int] = {start: 0}
+        self._parent: Dict[Room, Optional[Room]] = {start: None}
+        self._children: Dict[Room, Set[Room]] = {start: set()}
+        self._into: Dict[Room, Set[Room]] = {start: set()}
+        frontier = [start]
+        while len(frontier) != 0:
+            layer = []
+            for room in frontier:
+                for x in room.neighbors():
+                    if x not in self._distance:
+                        self.__attach(x, room, self._distance[room] + 1)
+                        self._into[x] = set()
+                        layer.append(x)
+                    self._into[x].add(room)
+            frontier = layer
+        dungeon.add_listener(self)
+
+    def close(self) -> None:
+        """Stop listening to the dungeon; the paths are no longer updated."""
+        self._dungeon.remove_listener(self)
+
+    def distance(self, target: Room) -> int:
+        """Returns the number of steps from start to target, or -1 if target
+        cannot be reached."""
+        return self._distance.get(target, -1)
+
+    def path_to(self, target: Room) -> List[Room]:
+        """Returns the rooms on the breadth-first path from start to target,
+        or an empty list if there is none."""
+        if target not in self._distance:
+            return []
+        path = []
+        room: Optional[Room] = target
+        while room is not None:
+            path.append(room)
+            room = self._parent[room]
+        path.reverse()
+        return path
+
+    def passage_added(self, a: Room, b: Room, replaced: Optional[Room]) -> None:
+        """Called by the dungeon when a passage from a to b is added in place
+        of the passage to replaced (or None)."""
+        if replaced is not None and replaced is not b:
+            self.passage_removed(a, replaced)
+        if a not in self._distance:
+            return
+        self._into.setdefault(b, set()).add(a)
+        changed: List[Tuple[int, int, Room]] = []
+        if self._parent.get(b) is a:
+            # a second passage from the parent may move b ahead of siblings
+            changed.append((self._distance[b], id(b), b))
+        else:
+            self.__offer(a, b, changed)
+        self.__spread(changed)
+
+    def passage_removed(self, a: Room, b: Room) -> None:
+        """Called by the dungeon when a passage from a to b is removed."""
+        if a not in self._distance or b not in self._distance:
+            return
+        if b not in a.neighbors():
+            self._into[b].discard(a)
+        if self._parent[b] is a:
+            self.__rebuild(self.__detach(b))
+
+    def __attach(self, room: Room, parent: Room, distance: int) -> None:
+        old = self._parent.get(room)
+        if old is not None:
+            self._children[old].discard(room)
+        self._distance[room] = distance
+        self._parent[room] = parent
+        self._children.setdefault(room, set())
+        self._children[parent].add(room)
+
+    def __precedes(self, x: Room, y: Room) -> bool:
+        """Returns true if breadth-first search reaches room x before room y;
+        both must be the same distance from start."""
+        if x is y:
+            return False
+        while self._parent[x] is not self._parent[y]:
+            x = self._parent[x]
+            y = self._parent[y]
+        neighbors = self._parent[x].neighbors()
+        return neighbors.index(x) < neighbors.index(y)
+
+    def __offer(self, x: Room, y: Room, changed: List) -> None:
+        """Consider the passage from x, whose place in the tree is final, to
+        y as a new way to reach y, queueing y in changed if it is better."""
+        d = self._distance[x] + 1
+        if y not in self._distance or d < self._distance[y] or (
+                d == self._distance[y] and self.__precedes(x, self._parent[y])):
+            self.__attach(y, x, d)
+            heapq.heappush(changed, (d, id(y), y))
+
+    def __spread(self, changed: List[Tuple[int, int, Room]]) -> None:
+        """Propagate improvements outward, a layer at a time, from the rooms
+        in the changed heap. A room whose path improved passes the
+        improvement to its children and may become a better parent for its
+        other neighbors."""
+        done: Set[Room] = set()
+        while len(changed) != 0:
+            d, key, room = heapq.heappop(changed)
+            if room in done or self._distance[room] != d:
+                continue
+            done.add(room)
+            for y in room.neighbors():
+                self._into.setdefault(y, set()).add(room)
+                if self._parent.get(y) is room:
+                    if self._distance[y] != d + 1:
+                        self._distance[y] = d + 1
+                    heapq.heappush(changed, (d + 1, id(y), y))
+                else:
+                    self.__offer(room, y, changed)
+
+    def __detach(self, room: Room) -> Set[Room]:
+        """Remove the subtree below room from the tree, forgetting the
+        passages out of its rooms, and return its rooms."""
+        subtree = {room}
+        pending = [room]
+        while len(pending) != 0:
+            for child in self._children[pending.pop()]:
+                subtree.add(child)
+                pending.append(child)
+        self._children[self._parent[room]].discard(room)
+        for x in subtree:
+            for y in x.neighbors():
+                self._into[y].discard(x)
+            del self._distance[x]
+            del self._parent[x]
+            self._children[x] = set()
+        return subtree
+
+    def __rebuild(self, subtree: Set[Room]) -> None:
+        """Find new places in the tree for the detached rooms, a layer at a
+        time, from the passages into them; rooms that can no longer be
+        reached are dropped."""
+        tentative: Dict[Room, int] = {}
+        waiting: List[Tuple[int, int, Room]] = []
+        for x in subtree:
+            for w in self._into[x]:
+                d = self._distance[w] + 1
+                if d < tentative.get(x, d + 1):
+                    tentative[x] = d
+                    heapq.heappush(waiting, (d, id(x), x))
+        while len(waiting) != 0:
+            d, key, x = heapq.heappop(waiting)
+            if x in self._distance or tentative[x] != d:
+                continue
+            parent = None
+            for w in self._into[x]:
+                if self._distance[w] == d - 1 and (
+                        parent is None or self.__precedes(w, parent)):
+                    parent = w
+            self.__attach(x, parent, d)
+            for y in x.neighbors():
+                self._into[y].add(x)
+                if y in subtree and y not in self._distance \
+                        and d + 1 < tentative.get(y, d + 2):
+                    tentative[y] = d + 1
+                    heapq.heappush(waiting, (d + 1, id(y), y))
+        for x in subtree:
+            if x not in self._distance:
+                del self._children[x]
+                del self._into[x]
@@ -0,0 +1,160 @@
+#
+# hazard_search.py: least-risk paths that weigh the traps and monsters in
+#   the rooms entered, rather than just counting steps.
+#
+# Each move costs a step plus the cost of any trap and monster in the room
+# moved into, and rooms may be avoided outright.  Only the rooms that have
+# hazards get extra costs, and those are found through the dungeon's trap
+# and monster index (Dungeon.rooms_with_trap and rooms_with_monster), so
+# preparing a query costs time in proportion to the hazardous rooms, not the
+# size of the dungeon.  When no room on the map has a cost beyond the step
+# the search is a plain breadth-first search, with no heap.
+#
+
+from dungeon import Room
+from typing import *
+from collections import deque
+import heapq
+
+
+class HazardCosts:
+    """The costs Rat.safest_path_to puts on moving through a dungeon.
+
+    Attributes:
+        step (float): cost of every move
+        traps (Dict[str, float]): cost of entering a room with the named
+            trap
+        monsters (Dict[str, float]): cost of entering a room with the named
+            monster
+        default_trap (float): cost of a trap not named in traps
+        default_monster (float): cost of a monster not named in monsters
+        avoid_traps (Set[str]): traps whose rooms are never entered
+        avoid_monsters (Set[str]): monsters whose rooms are never entered
+    """
+
+    def __init__(self, traps: Optional[Dict[str, float]] = None,
+                 monsters: Optional[Dict[str, float]] = None,
+                 default_trap: float = 5, default_monster: float = 10,
+                 step: float = 1,
+                 avoid_traps: Iterable[str] = (),
+                 avoid_monsters: Iterable[str] = ()):
+        """Create costs; costs must not be negative."""
+        self.step = step
+        self.traps = dict(traps or {})
+        self.monsters = dict(monsters or {})
+        self.default_trap = default_trap
+        self.default_monster = default_monster
+        self.avoid_traps = set(avoid_traps)
+        self.avoid_monsters = set(avoid_monsters)
+        assert step > 0 and default_trap >= 0 and default_monster >= 0
+        assert all(c >= 0 for c in self.traps.values())
+        assert all(c >= 0 for c in self.monsters.values())
+
+    def trap_cost(self, trap: str) -> float:
+        """Returns the cost of entering a room with the named trap."""
+        return self.traps.get(trap, self.default_trap)
+
+    def monster_cost(self, monster: str) -> float:
+        """Returns the cost of entering a room with the named monster."""
+        return self.monsters.get(monster, self.default_monster)
+
+    def room_costs(self, dungeon: Any) -> Tuple[Dict[Room, float], Set[Room]]:
+        """Returns the extra cost of entering each room of dungeon that has
+        one, and the rooms to avoid, from the dungeon's trap and monster
+        index."""
+        extra: Dict[Room, float] = {}
+        avoid: Set[Room] = set()
+        for trap in dungeon.trap_names():
+            rooms = dungeon.rooms_with_trap(trap)
+            if trap in self.avoid_traps:
+                avoid.update(rooms)
+            elif self.trap_cost(trap) != 0:
+                cost = self.trap_cost(trap)
+                for room in rooms:
+                    extra[room] = extra.get(room, 0) + cost
+        for monster in dungeon.monster_names():
+            rooms = dungeon.rooms_with_monster(monster)
+            if monster in self.avoid_monsters:
+                avoid.update(rooms)
+            elif self.monster_cost(monster) != 0:
+                cost = self.monster_cost(monster)
+                for room in rooms:
+                    extra[room] = extra.get(room, 0) + cost
+        return extra, avoid
+
+    def path_cost(self, path: List[Room]) -> float:
+        """Returns the cost of following path from its first room."""
+        total = 0
+        for room in path[1:]:
+            total += self.step
+            if room.trap is not None:
+                total += self.trap_cost(room.trap)
+            if room.monster is not None:
+                total += self.monster_cost(room.monster)
+        return total
+
+
+def _rebuild_path(parents: Dict[Room, Optional[Room]],
+                  room: Room) -> List[Room]:
+    path = []
+    while room is not None:
+        path.append(room)
+        room = parents[room]
+    path.reverse()
+    return path
+
+
+def avoiding_bfs(start: Room, target: Room, avoid: Set[Room],
+                 recorder: Any = None) -> List[Room]:
+    """Breadth-first search from start to target that never enters a room
+    in avoid; returns the path, or an empty list if there is none."""
+    parents: Dict[Room, Optional[Room]] = {start: None}
+    frontier = deque([start])
+    while len(frontier) != 0:
+        room = frontier.popleft()
+        if recorder is not None:
+            recorder.visited(room.name, len(frontier),
+                             0 if room is target else len(room.neighbors()))
+        if room is target:
+            return _rebuild_path(parents, room)
+        for x in room.neighbors():
+            if x not in parents and x not in avoid:
+                parents[x] = room
+                frontier.append(x)
+    return []
+
+
+def dijkstra(start: Room, target: Room, step: float,
+             extra: Dict[Room, float], avoid: Set[Room],
+             recorder: Any = None) -> List[Room]:
+    """Least-cost search from start to target, where moving into a room
+    costs step plus its cost in extra, never entering a room in avoid.
+    Rooms of equal cost are expanded in the order they were reached, so
+    with no extra costs the path is the breadth-first one."""
+    if len(extra) == 0:
+        return avoiding_bfs(start, target, avoid, recorder)
+    costs: Dict[Room, float] = {start: 0}
+    parents: Dict[Room, Optional[Room]] = {start: None}
+    done: Set[Room] = set()
+    waiting: List[Tuple[float, int, Room]] = [(0, 0, start)]
+    count = 1
+    while len(waiting) != 0:
+        cost, key, room = heapq.heappop(waiting)
+        if room in done:
+            continue
+        done.add(room)
+        if recorder is not None:
+            recorder.visited(room.name, len(waiting),
+                             0 if room is target else len(room.neighbors()))
+        if room is target:
+            return _rebuild_path(parents, room)
+        for x in room.neighbors():
+            if x in done or x in avoid:
+                continue
+            new_cost = cost + step + extra.get(x, 0)
+            if new_cost < costs.get(x, new_cost + 1):
+                costs[x] = new_cost
+                parents[x] = room
+                heapq.heappush(waiting, (new_cost, count, x))
+                count += 1
+    return []
@@ -0,0 +1,241 @@
+#
+# index_search.py: the rat's search algorithms run over a DungeonIndex.
+#   Rooms are plain ints, visited sets are bytearrays and parents are int
+#   arrays, so a search allocates almost nothing per room.  Each search
+#   visits rooms in the same order and returns the same path as the
+#   matching Room-based search in rat.py.
+#
+# Each search takes an optional SearchRecorder (see search_observers.py)
+# that is told about every room expanded; without one the search does no
+# bookkeeping beyond the test for it.
+#
+
+from dungeon_index import DungeonIndex
+from typing import *
+from array import array
+from collections import deque
+
+UNSEEN = 2 ** 31 - 1  # depth of a room that has not been expanded
+
+
+def rebuild_path(parents: array, room: int) -> List[int]:
+    """Follows the parent links back from room to the start (whose parent is
+    -1) and returns the room ids in order from the start."""
+    path = []
+    while room != -1:
+        path.append(room)
+        room = parents[room]
+    path.reverse()
+    return path
+
+
+def dfs(index: DungeonIndex, start: int, goal: int,
+        recorder: Any = None) -> List[int]:
+    """Depth-first search from start to goal; returns the room ids on the
+    path, or an empty list if there is none. Each room visited is reported
+    to recorder, if given."""
+    offsets = index.offsets
+    targets = index.targets
+    visited = bytearray(index.room_count())
+    parents = array('i', [-1]) * index.room_count()
+    frontier = [start, -1]  # flattened (room, parent) pairs
+    while len(frontier) != 0:
+        parent = frontier.pop()
+        room = frontier.pop()
+        if not visited[room]:
+            if recorder is not None:
+                recorder.visited(index.names[room], len(frontier) // 2,
+                                 0 if room == goal
+                                 else offsets[room + 1] - offsets[room])
+            visited[room] = 1
+            parents[room] = parent
+            if room == goal:
+                return rebuild_path(parents, room)
+            for i in range(offsets[room + 1] - 1, offsets[room] - 1, -1):
+                frontier.append(targets[i])
+                frontier.append(room)
+    return []
+
+
+def bfs(index: DungeonIndex, start: int, goal: int,
+        recorder: Any = None) -> List[int]:
+    """Breadth-first search from start to goal; returns the room ids on the
+    path, or an empty list if there is none. Each room visited is reported
+    to recorder, if given. With a first-in first-out frontier, the first
+    route to reach a room is the one it is visited by, so rooms are marked
+    when queued and each is queued only once."""
+    offsets = index.offsets
+    targets = index.targets
+    parents = array('i', [-1]) * index.room_count()
+    queued = bytearray(index.room_count())
+    queued[start] = 1
+    frontier = deque([start])
+    while len(frontier) != 0:
+        room = frontier.popleft()
+        if recorder is not None:
+            recorder.visited(index.names[room], len(frontier),
+                             0 if room == goal
+                             else offsets[room + 1] - offsets[room])
+        if room == goal:
+            return rebuild_path(parents, room)
+        for i in range(offsets[room], offsets[room + 1]):
+            x = targets[i]
+            if not queued[x]:
+                queued[x] = 1
+                parents[x] = room
+                frontier.append(x)
+    return []
+
+
+def bfs_many(index: DungeonIndex, start: int, goals: Set[int],
+             recorder: Any = None) -> Dict[int, List[int]]:
+    """Breadth-first search from start that stops once every room in goals
+    has been reached; returns the path to each goal that was reached, the
+    same path bfs would return for it alone. Each room visited is reported
+    to recorder, if given."""
+    offsets = index.offsets
+    targets = index.targets
+    parents = array('i', [-1]) * index.room_count()
+    queued = bytearray(index.room_count())
+    queued[start] = 1
+    reached = [start] if start in goals else []
+    frontier = deque([start])
+    while len(frontier) != 0 and len(reached) < len(goals):
+        room = frontier.popleft()
+        if recorder is not None:
+            recorder.visited(index.names[room], len(frontier),
+                             offsets[room + 1] - offsets[room])
+        for i in range(offsets[room], offsets[room + 1]):
+            x = targets[i]
+            if not queued[x]:
+                queued[x] = 1
+                parents[x] = room
+                frontier.append(x)
+                if x in goals:
+                    reached.append(x)
+    return {x: rebuild_path(parents, x) for x in reached}
+
+
+def depth_limited_search(index: DungeonIndex, start: int, goal: int,
+                         depth: int, known: array, recorder: Any = None
+                         ) -> Tuple[List[int], bool, array]:
+    """One pass of iterative deepening: a depth-first search that expands no
+    room more than depth steps from start, never expands a room deeper than
+    its distance in known, and re-expands rooms reached by a shorter route.
+    Returns the path, whether the bound cut the search off, and the depth
+    each room was expanded at (UNSEEN if it was not)."""
+    offsets = index.offsets
+    targets = index.targets
+    depths = array('i', [UNSEEN]) * index.room_count()
+    parents = array('i', [-1]) * index.room_count()
+    pruned: List[int] = []
+    frontier = [start, -1, 0]  # flattened (room, parent, depth) triples
+    while len(frontier) != 0:
+        room_depth = frontier.pop()
+        parent = frontier.pop()
+        room = frontier.pop()
+        if depths[room] > room_depth:
+            if recorder is not None:
+                recorder.visited(index.names[room], len(frontier) // 3,
+                                 0 if room == goal or room_depth >= depth
+                                 else offsets[room + 1] - offsets[room])
+            depths[room] = room_depth
+            parents[room] = parent
+            if room == goal:
+                return rebuild_path(parents, room), False, depths
+            if room_depth < depth:
+                next_depth = room_depth + 1
+                for i in range(offsets[room + 1] - 1, offsets[room] - 1, -1):
+                    x = targets[i]
+                    if depths[x] > next_depth and known[x] >= next_depth:
+                        frontier.append(x)
+                        frontier.append(room)
+                        frontier.append(next_depth)
+            else:
+                for i in range(offsets[room], offsets[room + 1]):
+                    if depths[targets[i]] == UNSEEN:
+                        pruned.append(targets[i])
+    cutoff = any(depths[x] == UNSEEN for x in pruned)
+    return [], cutoff, depths
+
+
+def iterative_deepening(index: DungeonIndex, start: int, goal: int,
+                        recorder: Any = None) -> List[int]:
+    """Iterative deepening search from start to goal; stops at the first
+    pass that finds the goal or is not cut off by its depth bound."""
+    depth = 0
+    known = array('i', [UNSEEN]) * index.room_count()
+    while True:
+        if recorder is not None:
+            recorder.next_pass()
+        path, cutoff, known = depth_limited_search(index, start, goal, depth,
+                                                   known, recorder)
+        if len(path) != 0 or not cutoff:
+            return path
+        depth += 1
+
+
+def bidirectional_bfs(index: DungeonIndex, start: int, goal: int,
+                      recorder: Any = None) -> List[int]:
+    """Breadth-first search from both start and goal at once, following
+    passages backwards from the goal (see DungeonIndex.reverse_adjacency),
+    until the two searches meet. The side with the smaller frontier expands
+    a whole layer at a time; once a layer reaches rooms seen by the other
+    side, the meeting room giving the shortest route is used, so the result
+    is a shortest path. Each room expanded is reported to recorder, if
+    given."""
+    if start == goal:
+        if recorder is not None:
+            recorder.visited(index.names[start], 0, 0)
+        return [start]
+    reverse_offsets, reverse_targets = index.reverse_adjacency()
+    rooms = index.room_count()
+    forward_distance = array('i', [-1]) * rooms
+    backward_distance = array('i', [-1]) * rooms
+    forward_parents = array('i', [-1]) * rooms
+    backward_parents = array('i', [-1]) * rooms  # next room to goal
+    forward_distance[start] = 0
+    backward_distance[goal] = 0
+    forward = [start]
+    backward = [goal]
+    while len(forward) != 0 and len(backward) != 0:
+        if len(forward) <= len(backward):
+            offsets, targets = index.offsets, index.targets
+            frontier, distance, parents = forward, forward_distance, \
+                forward_parents
+            other_distance = backward_distance
+        else:
+            offsets, targets = reverse_offsets, reverse_targets
+            frontier, distance, parents = backward, backward_distance, \
+                backward_parents
+            other_distance = forward_distance
+        layer = []
+        meeting = -1
+        best = UNSEEN
+        for room in frontier:
+            if recorder is not None:
+                recorder.visited(index.names[room],
+                                 len(forward) + len(backward) + len(layer),
+                                 offsets[room + 1] - offsets[room])
+            for i in range(offsets[room], offsets[room + 1]):
+                x = targets[i]
+                if distance[x] == -1:
+                    distance[x] = distance[room] + 1
+                    parents[x] = room
+                    layer.append(x)
+                    if other_distance[x] != -1 \
+                            and distance[x] + other_distance[x] < best:
+                        best = distance[x] + other_distance[x]
+                        meeting = x
+        if meeting != -1:
+            path = rebuild_path(forward_parents, meeting)
+            room = backward_parents[meeting]
+            while room != -1:
+                path.append(room)
+                room = backward_parents[room]
+            return path
+        if frontier is forward:
+            forward = layer
+        else:
+            backward = layer
+    return []
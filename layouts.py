@@ -0,0 +1,185 @@
+#
+# layouts.py: (x, y, level) coordinates for a dungeon's rooms, inferred from
+#   the directions of their passages, and A* search guided by them.
+#
+# A region is laid out by walking every room reachable from a room, placing
+# each newly reached room one step from the room it was reached from in the
+# direction of the passage: EAST and WEST along x, SOUTH and NORTH along y
+# and UP and DOWN across levels.  The region is consistent when every
+# passage between its rooms then moves at most one step, counting each
+# coordinate; passages that bend the map (a corridor that turns back on
+# itself, a ring whose sides do not match) make it inconsistent.  In a
+# consistent region no path between two rooms is shorter than the
+# difference of their coordinates, summed over x, y and level, so that sum
+# is an admissible and consistent heuristic, and A* search with it finds
+# shortest paths while expanding only the rooms that lie toward the target.
+# Rat.astar_path_to falls back to breadth-first search in an inconsistent
+# region.
+#
+# Every room reachable from a room laid out is in its region, so a region
+# answers any query starting inside it.  Laying out from a room outside
+# every region makes a new region, which takes over the rooms it reaches
+# from older ones.  A passage added to or removed from a room drops the
+# regions holding that room; they are laid out again at the next query
+# from one of their rooms.
+#
+
+from dungeon import Dungeon, Room, Direction
+from typing import *
+from collections import deque
+import heapq
+
+
+# The step taken along (x, y, level) by a passage in each direction.
+_STEPS = {Direction.EAST: (1, 0, 0), Direction.WEST: (-1, 0, 0),
+          Direction.NORTH: (0, -1, 0), Direction.SOUTH: (0, 1, 0),
+          Direction.UP: (0, 0, 1), Direction.DOWN: (0, 0, -1)}
+
+
+class Region:
+    """The rooms reachable from a room, placed on a grid of levels.
+
+    Attributes:
+        places (Dict[Room, Tuple[int, int, int]]): the (x, y, level) of each
+            room, relative to the room laid out from
+        consistent (bool): true if every passage between the rooms moves at
+            most one step, so distances on the grid never overestimate
+    """
+
+    def __init__(self, places: Dict[Room, Tuple[int, int, int]],
+                 consistent: bool):
+        """Create a region with the given places."""
+        self.places = places
+        self.consistent = consistent
+        self._owned = len(places)  # rooms whose region this is
+
+    def distance(self, a: Room, b: Room) -> int:
+        """Returns the number of steps between the places of a and b, which
+        is no more than the length of a path between them if the region is
+        consistent."""
+        ax, ay, az = self.places[a]
+        bx, by, bz = self.places[b]
+        return abs(ax - bx) + abs(ay - by) + abs(az - bz)
+
+
+class DungeonLayout:
+    """The regions of a dungeon laid out so far, kept up to date as passages
+    change; see Dungeon.enable_layout.
+
+    Attributes:
+        regions_laid_out (int): regions laid out so far, counting those laid
+            out again after a change
+    """
+
+    def __init__(self, dungeon: Dungeon):
+        """Create an empty layout of dungeon and start listening to it."""
+        self.regions_laid_out = 0
+        self._dungeon = dungeon
+        self._region_of: Dict[Room, Region] = {}
+        self._regions: Set[Region] = set()
+        dungeon.add_listener(self)
+
+    def close(self) -> None:
+        """Stop listening to the dungeon."""
+        self._dungeon.remove_listener(self)
+
+    def region(self, room: Room) -> Region:
+        """Returns a region holding room and every room reachable from it,
+        laying one out if need be."""
+        region = self._region_of.get(room)
+        if region is None:
+            region = self.__lay_out(room)
+        return region
+
+    def passage_added(self, a: Room, b: Room, replaced: Optional[Room]) -> None:
+        """Called by the dungeon when a passage from a to b is added in place
+        of the passage to replaced (or None)."""
+        self.__drop(a)
+
+    def passage_removed(self, a: Room, b: Room) -> None:
+        """Called by the dungeon when a passage from a to b is removed."""
+        self.__drop(a)
+
+    def __drop(self, room: Room) -> None:
+        """Forgets every region holding room, whose passages have
+        changed."""
+        for region in [r for r in self._regions if room in r.places]:
+            self._regions.discard(region)
+            for x in region.places:
+                if self._region_of.get(x) is region:
+                    del self._region_of[x]
+
+    def __lay_out(self, start: Room) -> Region:
+        """Places start and the rooms reachable from it, checking every
+        passage between them, and makes the result the region of each."""
+        places = {start: (0, 0, 0)}
+        consistent = True
+        pending = deque([start])
+        while len(pending) != 0:
+            room = pending.popleft()
+            x, y, z = places[room]
+            for d, n in room.passages():
+                dx, dy, dz = _STEPS[d]
+                place = places.get(n)
+                if place is None:
+                    places[n] = (x + dx, y + dy, z + dz)
+                    pending.append(n)
+                elif abs(place[0] - x) + abs(place[1] - y) \
+                        + abs(place[2] - z) > 1:
+                    consistent = False
+        region = Region(places, consistent)
+        for room in places:
+            old = self._region_of.get(room)
+            if old is not None:
+                old._owned -= 1
+                if old._owned == 0:
+                    self._regions.discard(old)
+            self._region_of[room] = region
+        self._regions.add(region)
+        self.regions_laid_out += 1
+        return region
+
+
+def astar(start: Room, target: Room, region: Region,
+          recorder: Any = None) -> List[Room]:
+    """A* search from start to target within region, which must hold start
+    and be consistent, guided by the distance between places; returns a
+    shortest path, or an empty list if there is none. Among rooms equally
+    promising, the one farthest from the start is expanded first, so on an
+    open grid the search runs straight at the target."""
+    if target not in region.places:
+        return []
+    tx, ty, tz = region.places[target]
+    places = region.places
+    costs: Dict[Room, int] = {start: 0}
+    parents: Dict[Room, Optional[Room]] = {start: None}
+    done: Set[Room] = set()
+    waiting: List[Tuple[int, int, int, Room]] = [
+        (region.distance(start, target), 0, 0, start)]
+    count = 1
+    while len(waiting) != 0:
+        estimate, behind, key, room = heapq.heappop(waiting)
+        if room in done:
+            continue
+        done.add(room)
+        if recorder is not None:
+            recorder.visited(room.name, len(waiting),
+                             0 if room is target else len(room.neighbors()))
+        if room is target:
+            path = []
+            while room is not None:
+                path.append(room)
+                room = parents[room]
+            path.reverse()
+            return path
+        cost = costs[room] + 1
+        for n in room.neighbors():
+            if n in done or cost >= costs.get(n, cost + 1):
+                continue
+            costs[n] = cost
+            parents[n] = room
+            x, y, z = places[n]
+            heapq.heappush(waiting, (cost + abs(x - tx) + abs(y - ty)
+                                     + abs(z - tz), -cost, count, n))
+            count += 1
+    return []
@@ -0,0 +1,275 @@
+#
+# level_paths.py: shortest paths through layered dungeons, found by
+#   searching a small graph of the stairs between levels first and then
+#   walking only the levels the path passes through.
+#
+# Rooms are grouped by level.  A passage between rooms on different levels
+# (the UP and DOWN stairs, or any other passage that changes level) is a
+# crossing; the room it leads from is an exit of its level and the room it
+# leads to is an entry of its level.  For every level the distance from each
+# entry to each exit, using only passages within the level, is worked out
+# ahead of time and kept until the level changes.
+#
+# A query first finds, over that abstract graph of entries, exits and
+# crossings, the exact distance from every entry to the target, with one
+# search back from the target within its own level.  Then it walks forward
+# from the start, working out distances to the target for the rooms of
+# each level it enters (a search back from the level's exits, each starting
+# at its own distance, and from the target on its level).  At each room it
+# takes the first neighbor, in Room.neighbors() order, that is one step
+# closer to the target.  Among the shortest paths, that picks the one
+# breadth-first search finds (see dynamic_paths.py), so the path is exactly
+# Rat.bfs_path_to's.
+#
+
+from dungeon import Dungeon, Room
+from typing import *
+import heapq
+
+
+class _Level:
+    """The rooms of one level and what is known about its passages.
+
+    Attributes:
+        rooms (Set[Room]): rooms on the level
+        into (Dict[Room, List[Room]]): rooms on the level with passages to
+            each room on the level
+        exits (Dict[Room, List[Room]]): rooms on other levels that each exit
+            of the level leads to
+        between (Dict[Room, List[Tuple[Room, int]]]): for each exit, the
+            entries of the level that can reach it within the level, with
+            their distances
+    """
+
+    def __init__(self):
+        """Create an empty level."""
+        self.rooms: Set[Room] = set()
+        self.into: Dict[Room, List[Room]] = {}
+        self.exits: Dict[Room, List[Room]] = {}
+        self.between: Dict[Room, List[Tuple[Room, int]]] = {}
+
+
+class LevelPaths:
+    """Hierarchical shortest paths for a layered dungeon; see
+    Rat.hierarchical_path_to. It listens to the dungeon and, at the next
+    query after a change, rebuilds only the levels the change touched.
+
+    Attributes:
+        levels_rebuilt (int): levels rebuilt so far, counting the first
+            build
+    """
+
+    def __init__(self, dungeon: Dungeon):
+        """Build the levels of dungeon's rooms and start listening to
+        it."""
+        self.levels_rebuilt = 0
+        self._dungeon = dungeon
+        self._levels: Dict[int, _Level] = {}
+        self._known: Set[Room] = set()
+        self._dirty: Set[int] = set()
+        self._crossings_into: Dict[Room, List[Room]] = {}
+        self._entries: Dict[int, List[Room]] = {}
+        self.__discover(dungeon.rooms())
+        self.__refresh()
+        dungeon.add_listener(self)
+
+    def close(self) -> None:
+        """Stop listening to the dungeon."""
+        self._dungeon.remove_listener(self)
+
+    def passage_added(self, a: Room, b: Room, replaced: Optional[Room]) -> None:
+        """Called by the dungeon when a passage from a to b is added in place
+        of the passage to replaced (or None)."""
+        self.__discover([a, b])
+        self._dirty.add(a.level)
+        self._dirty.add(b.level)
+        if replaced is not None:
+            self._dirty.add(replaced.level)
+
+    def passage_removed(self, a: Room, b: Room) -> None:
+        """Called by the dungeon when a passage from a to b is removed."""
+        self._dirty.add(a.level)
+        self._dirty.add(b.level)
+
+    def distance(self, start: Room, target: Room) -> int:
+        """Returns the number of steps on a shortest path from start to
+        target, or -1 if there is none."""
+        if start is target:
+            return 0
+        entries, exits = self.__distances_to(start, target)
+        d = self.__level_distances(start.level, target, exits).get(start)
+        return -1 if d is None else d
+
+    def path(self, start: Room, target: Room) -> List[Room]:
+        """Returns the rooms on the path Rat.bfs_path_to would find from
+        start to target, or an empty list if there is none."""
+        if start is target:
+            return [start]
+        entries, exits = self.__distances_to(start, target)
+        level = start.level
+        here = self.__level_distances(level, target, exits)
+        d = here.get(start)
+        if d is None:
+            return []
+        path = [start]
+        room = start
+        while room is not target:
+            for x in room.neighbors():
+                if x.level == level:
+                    if here.get(x) == d - 1:
+                        break
+                elif entries.get(x) == d - 1:
+                    level = x.level
+                    here = self.__level_distances(level, target, exits)
+                    break
+            room = x
+            d -= 1
+            path.append(room)
+        return path
+
+    def __distances_to(self, start: Room, target: Room
+                       ) -> Tuple[Dict[Room, int], Dict[Room, int]]:
+        """Returns the distance to target from every entry that can reach it
+        and, for every exit that can, the distance through its crossings.
+        Searches the abstract graph back from target, cheapest first."""
+        self.__discover([start, target])
+        self.__refresh()
+        to_target = self.__level_distances(target.level, target, {})
+        entries: Dict[Room, int] = {}
+        exits: Dict[Room, int] = {}
+        best_entries: Dict[Room, int] = {}
+        best_exits: Dict[Room, int] = {}
+        waiting: List[Tuple[int, int, int, Room]] = []
+        for e in self._entries.get(target.level, []):
+            if e in to_target:
+                best_entries[e] = to_target[e]
+                heapq.heappush(waiting, (to_target[e], 0, id(e), e))
+        while len(waiting) != 0:
+            d, is_exit, key, room = heapq.heappop(waiting)
+            if is_exit:
+                if room in exits:
+                    continue
+                exits[room] = d
+                for e, steps in self._levels[room.level].between[room]:
+                    if d + steps < best_entries.get(e, d + steps + 1):
+                        best_entries[e] = d + steps
+                        heapq.heappush(waiting, (d + steps, 0, id(e), e))
+            else:
+                if room in entries:
+                    continue
+                entries[room] = d
+                for p in self._crossings_into.get(room, []):
+                    if d + 1 < best_exits.get(p, d + 2):
+                        best_exits[p] = d + 1
+                        heapq.heappush(waiting, (d + 1, 1, id(p), p))
+        return entries, exits
+
+    def __level_distances(self, level: int, target: Room,
+                          exits: Dict[Room, int]) -> Dict[Room, int]:
+        """Returns the distance to target from each room on level that can
+        reach it, searching back within the level from target (if it is on
+        the level) and from each of the level's exits, at the distance
+        exits gives it."""
+        rooms = self._levels[level]
+        seeds = sorted((exits[p], id(p), p) for p in rooms.exits
+                       if p in exits)
+        if target.level == level:
+            seeds.insert(0, (0, id(target), target))
+        distances: Dict[Room, int] = {}
+        frontier: List[Room] = []
+        i = 0
+        d = 0
+        while len(frontier) != 0 or i < len(seeds):
+            if len(frontier) == 0:
+                d = seeds[i][0]
+            while i < len(seeds) and seeds[i][0] == d:
+                room = seeds[i][2]
+                if room not in distances:
+                    distances[room] = d
+                    frontier.append(room)
+                i += 1
+            layer = []
+            for room in frontier:
+                for w in rooms.into.get(room, ()):
+                    if w not in distances:
+                        distances[w] = d + 1
+                        layer.append(w)
+            frontier = layer
+            d += 1
+        return distances
+
+    def __discover(self, rooms: Iterable[Room]) -> None:
+        """Adds rooms, and the rooms reachable from them, that are not yet
+        on any level, marking the levels they touch for rebuilding."""
+        pending = [r for r in rooms if r not in self._known]
+        while len(pending) != 0:
+            room = pending.pop()
+            if room in self._known:
+                continue
+            self._known.add(room)
+            level = self._levels.get(room.level)
+            if level is None:
+                level = _Level()
+                self._levels[room.level] = level
+            level.rooms.add(room)
+            self._dirty.add(room.level)
+            for x in room.neighbors():
+                self._dirty.add(x.level)
+                if x not in self._known:
+                    pending.append(x)
+
+    def __refresh(self) -> None:
+        """Rebuilds the levels marked as changed: first their passages and
+        crossings, then, once every level's entries are known, the
+        distances from their entries to their exits."""
+        if len(self._dirty) == 0:
+            return
+        for n in self._dirty:
+            level = self._levels.get(n)
+            if level is None:
+                continue
+            level.into = {}
+            level.exits = {}
+            for room in level.rooms:
+                for x in room.neighbors():
+                    if x.level == n:
+                        level.into.setdefault(x, []).append(room)
+                    else:
+                        level.exits.setdefault(room, []).append(x)
+        self._crossings_into = {}
+        for level in self._levels.values():
+            for p, targets in level.exits.items():
+                for q in targets:
+                    self._crossings_into.setdefault(q, []).append(p)
+        self._entries = {}
+        for q in self._crossings_into:
+            self._entries.setdefault(q.level, []).append(q)
+        for n in self._dirty:
+            level = self._levels.get(n)
+            if level is None:
+                continue
+            level.between = {p: [] for p in level.exits}
+            for e in self._entries.get(n, []):
+                for p, d in self.__within(n, e).items():
+                    if p in level.exits:
+                        level.between[p].append((e, d))
+            self.levels_rebuilt += 1
+        self._dirty.clear()
+
+    @staticmethod
+    def __within(level: int, start: Room) -> Dict[Room, int]:
+        """Returns the distance from start to each room it can reach without
+        leaving level."""
+        distances = {start: 0}
+        frontier = [start]
+        d = 0
+        while len(frontier) != 0:
+            d += 1
+            layer = []
+            for room in frontier:
+                for x in room.neighbors():
+                    if x.level == level and x not in distances:
+                        distances[x] = d
+                        layer.append(x)
+            frontier = layer
+        return distances
@@ -0,0 +1,100 @@
+#
+# path_cache.py: a bounded cache of breadth-first search trees for a dungeon,
+#   so that repeated shortest-path queries from the same start room are
+#   answered by following parent links instead of searching again.
+#
+
+from dungeon import Dungeon, Room
+from typing import *
+from collections import OrderedDict, deque
+
+
+class PathCache:
+    """Least-recently-used cache of single-source breadth-first search trees,
+    keyed by start room name. Each tree maps the name of every room reachable
+    from the start to its parent on the breadth-first path (None for the
+    start), which is the same path Rat.bfs_path_to finds. The cache is
+    emptied whenever the dungeon's version changes, so a tree is never used
+    after a room or passage has been added.
+
+    Attributes:
+        max_trees (int): most trees kept at once
+        max_rooms (int): most rooms kept over all trees; bounds memory use
+        hits (int): queries answered from a cached tree
+        misses (int): queries that needed a new tree
+        evictions (int): trees dropped to stay within the bounds
+        invalidations (int): times the cache was emptied by a dungeon change
+    """
+
+    def __init__(self, dungeon: Dungeon, max_trees: int = 64,
+                 max_rooms: int = 1000000):
+        """Create an empty cache for the given dungeon."""
+        self.max_trees = max_trees
+        self.max_rooms = max_rooms
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._dungeon = dungeon
+        self._version = dungeon.version
+        self._trees: OrderedDict = OrderedDict()
+        self._rooms = 0
+
+    def rooms_cached(self) -> int:
+        """Returns the number of rooms held over all cached trees."""
+        return self._rooms
+
+    def clear(self) -> None:
+        """Drops every cached tree."""
+        self._trees.clear()
+        self._rooms = 0
+
+    def path(self, start: Room, target: Room) -> Optional[List[Room]]:
+        """Returns the breadth-first path from start to target (empty if there
+        is none), or None if start cannot be cached because its passages are
+        not tracked by the dungeon."""
+        if not self._dungeon.tracks(start):
+            return None
+        if self._version != self._dungeon.version:
+            self.invalidations += 1
+            self.clear()
+            self._version = self._dungeon.version
+        tree = self._trees.get(start.name)
+        if tree is not None:
+            self.hits += 1
+            self._trees.move_to_end(start.name)
+        else:
+            self.misses += 1
+            tree = self.__build_tree(start)
+            if len(tree) <= self.max_rooms:
+                self._trees[start.name] = tree
+                self._rooms += len(tree)
+                while len(self._trees) > self.max_trees \
+                        or self._rooms > self.max_rooms:
+                    name, evicted = self._trees.popitem(last=False)
+                    self._rooms -= len(evicted)
+                    self.evictions += 1
+        if target.name not in tree:
+            return []
+        path = []
+        room = target
+        while room is not None:
+            path.append(room)
+            room = tree[room.name]
+        path.reverse()
+        return path
+
+    @staticmethod
+    def __build_tree(start: Room) -> Dict[str, Optional[Room]]:
+        """Breadth-first search from start over every reachable room. With a
+        first-in first-out frontier, the first room to reach another is its
+        parent, so rooms are marked when queued."""
+        parents: Dict[str, Optional[Room]] = {start.name: None}
+        frontier = deque([start])
+        while len(frontier) != 0:
+            room = frontier.popleft()
+            for x in room.neighbors():
+                if x.name not in parents:
+                    parents[x.name] = room
+                    frontier.append(x)
+        return parents
@@ -0,0 +1,308 @@
+#
+# path_server.py: serves rat path queries for one dungeon over a local TCP
+#   or Unix socket, speaking JSON lines.
+#
+# Each request is one line such as
+#   {"id": 7, "start": "0,0", "target": "9,9", "algorithm": "b"}
+# and is answered, in whatever order the answers are ready, with
+#   {"id": 7, "path": ["0,0", ..., "9,9"]}
+# or {"id": 7, "error": "..."}.  The algorithm codes are those of
+# test_dungeons_two: 'd'epth-first, 'b'readth-first and 'i'terative
+# deepening.
+#
+# Breadth-first requests from the same start room that arrive while the
+# event loop is busy are answered together by one search
+# (Rat.directions_to_many): a batch stays open to new requests until a
+# worker is free to search for it.  Identical requests in flight share one
+# search.  Answers are kept in a bounded cache that is emptied when the
+# dungeon's version changes.  Searches and batches are tagged with the
+# version they search, so a request made after an edit never joins a
+# search of the dungeon as it was, and an answer that comes back after an
+# edit is not cached.  The searches run over a frozen index of the
+# dungeon (see Dungeon.freeze), refrozen when the version changes, in an
+# executor, a single worker thread by default, so the event loop keeps
+# reading and answering requests while they run.
+#
+# Run with, for example:
+#   python path_server.py dungeon.json --port 8765
+#
+
+from dungeon import Dungeon, read_dungeon_from_stream
+from dungeon_index import DungeonIndex
+from rat import Rat
+from typing import *
+from collections import OrderedDict
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+
+METHODS = {'d': "directions_to", 'b': "bfs_directions_to",
+           'i': "id_directions_to"}
+
+
+class PathServer:
+    """Answers path queries for a dungeon, on its own or over a socket (see
+    serve_tcp and serve_unix).
+
+    Attributes:
+        max_cached (int): most answers kept in the cache
+        batch_delay (float): seconds a breadth-first request waits for others
+            from the same start room to join its search
+        requests (int): queries received
+        hits (int): queries answered from the cache
+        searches (int): searches run; fewer than the misses when requests
+            are coalesced
+    """
+
+    def __init__(self, dungeon: Dungeon, max_cached: int = 100000,
+                 batch_delay: float = 0.0, workers: int = 1,
+                 executor: Optional[concurrent.futures.Executor] = None):
+        """Create a server for dungeon running up to workers searches at a
+        time, in executor or in worker threads of the server's own when it
+        is None."""
+        self.max_cached = max_cached
+        self.batch_delay = batch_delay
+        self.requests = 0
+        self.hits = 0
+        self.searches = 0
+        self._dungeon = dungeon
+        self._version = dungeon.version
+        self._index = dungeon.freeze()
+        self._cache: OrderedDict = OrderedDict()  # paths as tuples
+        self._batches: Dict[Tuple[int, str], Dict[str, asyncio.Future]] = {}
+        self._running: Dict[Tuple[int, str, str, str], asyncio.Future] = {}
+        self._slots = asyncio.Semaphore(workers)
+        self._own_executor = executor is None
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(workers)
+        self._executor = executor
+
+    def close(self) -> None:
+        """Shuts down the server's own executor."""
+        if self._own_executor:
+            self._executor.shutdown()
+
+    async def query(self, start: str, target: str,
+                    algorithm: str) -> List[str]:
+        """Returns the names of the rooms on the path the algorithm finds
+        from the room named start to the one named target, as
+        Rat.directions_to, bfs_directions_to or id_directions_to would.
+        Each caller gets a list of its own.  Raises ValueError for an
+        unknown room or algorithm."""
+        self.requests += 1
+        if algorithm not in METHODS:
+            raise ValueError("invalid algorithm code: " + str(algorithm))
+        for name in [start, target]:
+            if not isinstance(name, str) or not self._dungeon.has(name):
+                raise ValueError("unknown room: " + str(name))
+        if self._version != self._dungeon.version:
+            self._cache.clear()
+            self._version = self._dungeon.version
+            self._index = self._dungeon.freeze()
+        key = (start, target, algorithm)
+        path = self._cache.get(key)
+        if path is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return list(path)
+        if algorithm == 'b':
+            future = self.__join_batch(start, target)
+        else:
+            running = (self._version,) + key
+            future = self._running.get(running)
+            if future is None:
+                future = asyncio.ensure_future(self.__search(
+                    key, self._version, self._index))
+                self._running[running] = future
+                future.add_done_callback(
+                    lambda f: self._running.pop(running))
+        return list(await asyncio.shield(future))
+
+    def __join_batch(self, start: str, target: str) -> asyncio.Future:
+        """Returns the future for target in the next breadth-first search
+        from start of the dungeon at its current version, scheduling that
+        search if it is the first request."""
+        loop = asyncio.get_running_loop()
+        batch_key = (self._version, start)
+        batch = self._batches.get(batch_key)
+        if batch is None:
+            batch = {}
+            self._batches[batch_key] = batch
+            index = self._index
+            loop.call_later(self.batch_delay, lambda: asyncio.ensure_future(
+                self.__search_batch(batch_key, index)))
+        future = batch.get(target)
+        if future is None:
+            future = loop.create_future()
+            batch[target] = future
+        return future
+
+    async def __search_batch(self, batch_key: Tuple[int, str],
+                             index: DungeonIndex) -> None:
+        """Runs the batch of breadth-first requests from a start room over
+        index, the dungeon at the batch's version, once a worker is free;
+        requests arriving until then join the batch."""
+        version, start = batch_key
+        async with self._slots:
+            batch = self._batches.pop(batch_key)
+            self.searches += 1
+            try:
+                paths = await asyncio.get_running_loop().run_in_executor(
+                    self._executor, self.__paths_from, index, start,
+                    list(batch))
+            except Exception as error:
+                for future in batch.values():
+                    future.set_exception(error)
+                return
+        for target, future in batch.items():
+            path = tuple(paths[target])
+            self.__remember((start, target, 'b'), path, version)
+            future.set_result(path)
+
+    async def __search(self, key: Tuple[str, str, str], version: int,
+                       index: DungeonIndex) -> Tuple[str, ...]:
+        async with self._slots:
+            self.searches += 1
+            path = tuple(await asyncio.get_running_loop().run_in_executor(
+                self._executor, self.__path, index, key))
+        self.__remember(key, path, version)
+        return path
+
+    def __rat(self, index: DungeonIndex, start: str) -> Rat:
+        rat = Rat(self._dungeon, self._dungeon.find(start))
+        rat.set_index(index)
+        return rat
+
+    def __paths_from(self, index: DungeonIndex, start: str,
+                     targets: List[str]) -> Dict[str, List[str]]:
+        rat = self.__rat(index, start)
+        return rat.directions_to_many([self._dungeon.find(t)
+                                       for t in targets])
+
+    def __path(self, index: DungeonIndex,
+               key: Tuple[str, str, str]) -> List[str]:
+        start, target, algorithm = key
+        rat = self.__rat(index, start)
+        return getattr(rat, METHODS[algorithm])(self._dungeon.find(target))
+
+    def __remember(self, key: Tuple[str, str, str], path: Tuple[str, ...],
+                   version: int) -> None:
+        """Caches the path found for key by a search of the dungeon at
+        version, unless the dungeon has changed since."""
+        if version != self._dungeon.version:
+            return
+        self._cache[key] = path
+        if len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+
+    async def answer(self, line: str) -> Dict[str, Any]:
+        """Returns the response to one JSON request line."""
+        try:
+            request = json.loads(line)
+        except ValueError as error:
+            return {"id": None, "error": "bad request: " + str(error)}
+        if not isinstance(request, dict):
+            return {"id": None, "error": "bad request: not an object"}
+        response = {"id": request.get("id")}
+        try:
+            response["path"] = await self.query(
+                request["start"], request["target"],
+                request.get("algorithm", 'd'))
+        except KeyError as error:
+            response["error"] = "bad request: missing " + str(error)
+        except (ValueError, TypeError) as error:
+            response["error"] = str(error)
+        return response
+
+    async def handle(self, reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter) -> None:
+        """Serves one connection until the client closes it. Requests are
+        answered concurrently, so a slow search does not hold up the
+        requests behind it."""
+        pending: Set[asyncio.Task] = set()
+
+        async def respond(line: str) -> None:
+            response = await self.answer(line)
+            writer.write((json.dumps(response) + "\n").encode())
+
+        try:
+            while True:
+                line = await reader.readline()
+                if len(line) == 0:
+                    break
+                if len(line.strip()) != 0:
+                    task = asyncio.ensure_future(respond(line.decode()))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                await writer.drain()
+            if len(pending) != 0:
+                await asyncio.wait(pending)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve_tcp(self, host: str = "127.0.0.1",
+                        port: int = 0) -> asyncio.AbstractServer:
+        """Starts serving on a TCP socket (port 0 picks a free one) and
+        returns the asyncio server."""
+        return await asyncio.start_server(self.handle, host, port,
+                                          limit=2 ** 20)
+
+    async def serve_unix(self, path: str) -> asyncio.AbstractServer:
+        """Starts serving on a Unix socket at path and returns the asyncio
+        server."""
+        return await asyncio.start_unix_server(self.handle, path,
+                                               limit=2 ** 20)
+
+
+async def serve_forever(server: PathServer, host: str, port: int,
+                        unix: Optional[str]) -> None:
+    """Serves until cancelled, on the Unix socket unix if given and
+    otherwise on host and port."""
+    if unix is not None:
+        listener = await server.serve_unix(unix)
+        where = unix
+    else:
+        listener = await server.serve_tcp(host, port)
+        where = "%s:%d" % listener.sockets[0].getsockname()[:2]
+    print("Serving path queries on " + where, flush=True)
+    async with listener:
+        await listener.serve_forever()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Load the dungeon named on the command line and serve queries for it
+    until interrupted."""
+    parser = argparse.ArgumentParser(
+        description="Serve rat path queries as JSON lines.")
+    parser.add_argument("dungeon", help="dungeon JSON file to serve")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="serve on this Unix socket instead")
+    parser.add_argument("--max-cached", type=int, default=100000,
+                        help="most answers kept in the cache")
+    parser.add_argument("--batch-delay", type=float, default=0.0,
+                        help="seconds to wait for requests to join a search")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="searches to run at a time")
+    args = parser.parse_args(argv)
+    with open(args.dungeon) as source:
+        d = read_dungeon_from_stream(source)
+    server = PathServer(d, args.max_cached, args.batch_delay, args.workers)
+    try:
+        asyncio.run(serve_forever(server, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if args.unix is not None and os.path.exists(args.unix):
+            os.remove(args.unix)
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -18,8 +18,15 @@
 #
 
 from dungeon import Dungeon, Room, Direction
+from dungeon_index import DungeonIndex
 from typing import *
-from queue import Queue
+from collections import deque
+from search_observers import EchoObserver, SearchObserver, SearchRecorder, \
+    SearchStats
+from resumable_search import ResumableSearch, finish_steps, \
+    iterative_deepening_steps, neighbors_of, no_steps, rebuild_path, \
+    search_steps
+import index_search
 
 
 class Rat:
@@ -31,13 +38,17 @@ class Rat:
         start_location (Room): identifier for current location of the rat
     """
 
-    _echo_rooms_searched = False
+    _index = None
+    _dynamic_paths = None
+    _snapshot = None
 
     def __init__(self, dungeon: Dungeon, start_location: Room):
         """ This constructor stores the references when the Rat is
         initialized. """
         self._dungeon = dungeon
         self._start_location = start_location
+        self._observers: List[SearchObserver] = []
+        self._queries = 0
 
     @property
     def dungeon(self) -> Dungeon:
@@ -45,32 +56,181 @@ class Rat:
         return self._dungeon
 
     def set_echo_rooms_searched(self) -> None:
-        """ The _echo_rooms_searched variable is used as a flag for whether
-        the rat should display rooms as they are visited. """
-        self._echo_rooms_searched = True
+        """ Makes the rat display rooms as they are visited, by attaching
+        an EchoObserver. """
+        if not any(isinstance(o, EchoObserver) for o in self._observers):
+            self.add_observer(EchoObserver())
+
+    def add_observer(self, observer: SearchObserver) -> None:
+        """ Attaches an observer (see search_observers.py) to be told about
+        the rat's searches.  A query that any observer samples runs a full
+        search, even when the path could be read from a path cache or a
+        tracked search tree, so that there is a search to observe. """
+        self._observers.append(observer)
+
+    def remove_observer(self, observer: SearchObserver) -> None:
+        """ Detaches an observer added with add_observer. """
+        self._observers.remove(observer)
+
+    def __recorder(self, algorithm: str, target_location: Optional[Room]
+                   ) -> Optional[SearchRecorder]:
+        """ Returns a recorder for the query about to be made if any
+        observer samples it, or None to search without one. """
+        if len(self._observers) == 0:
+            return None
+        query = self._queries
+        self._queries += 1
+        sampled = [o for o in self._observers if query % o.sample_every == 0]
+        if len(sampled) == 0:
+            return None
+        target = None if target_location is None else target_location.name
+        return SearchRecorder(sampled, SearchStats(
+            algorithm, self._start_location.name, target))
+
+    @staticmethod
+    def __finish(recorder: Optional[SearchRecorder],
+                 path: List[Room]) -> List[Room]:
+        """ Reports the path to the recorder, if there is one, and returns
+        it. """
+        if recorder is not None:
+            recorder.finish(path)
+        return path
+
+    def set_index(self, index: DungeonIndex) -> None:
+        """ Makes the rat search over a DungeonIndex (see Dungeon.freeze)
+        rather than walking Room objects.  The searches visit rooms in the
+        same order and return the same paths; rooms that are missing from
+        the index are still searched through their Room objects.  When the
+        index has both rooms of a query, the dungeon's has_path is not asked
+        first, as it follows the live rooms and the index may be of the
+        dungeon as it was. """
+        self._index = index
+
+    def __may_reach(self, target_location: Room) -> bool:
+        """ Returns false if there is certainly no path from the start
+        location to target_location: as the dungeon's has_path says, unless
+        the rat's index is a separate copy of the dungeon with both rooms,
+        whose search will tell. """
+        index = self._index
+        if index is not None and index is not self._dungeon \
+                and index.has(self._start_location.name) \
+                and index.has(target_location.name):
+            return True
+        return self._dungeon.has_path(self._start_location, target_location)
+
+    def pin(self, snapshot: Any) -> None:
+        """ Makes the rat search snapshot (see Dungeon.snapshot) rather than
+        the live rooms, so a query sees the dungeon as it was when the
+        snapshot was taken while other threads go on editing it.  path_to,
+        bfs_path_to, id_path_to, bidirectional_path_to and paths_to_many
+        then walk the snapshot's passages, skipping the index, path cache,
+        corridors and tracked search tree, which follow the live dungeon;
+        bidirectional_path_to returns the breadth-first path, which is as
+        short.  hierarchical_path_to falls back to bfs_path_to, and
+        start_search walks the snapshot too. """
+        self._snapshot = snapshot
+
+    def unpin(self) -> None:
+        """ Goes back to searching the live rooms. """
+        self._snapshot = None
+
+    def track_paths(self) -> Any:
+        """ Keeps a breadth-first search tree from the start location that is
+        repaired as passages are added and removed (see dynamic_paths.py),
+        so bfs_path_to answers without searching even while the dungeon
+        changes.  Returns the DynamicPaths. """
+        from dynamic_paths import DynamicPaths
+        if self._dynamic_paths is None:
+            self._dynamic_paths = DynamicPaths(self._dungeon,
+                                               self._start_location)
+        return self._dynamic_paths
+
+    def stop_tracking_paths(self) -> None:
+        """ Stops repairing the tree kept by track_paths and goes back to
+        searching. """
+        if self._dynamic_paths is not None:
+            self._dynamic_paths.close()
+            self._dynamic_paths = None
+
+    def __indexed_path(self, search: Callable, target_location: Room,
+                       recorder: Optional[SearchRecorder],
+                       index: Optional[DungeonIndex] = None
+                       ) -> Optional[List[Room]]:
+        """ Runs one of the index_search algorithms from the start location
+        to target_location over index (by default the rat's), or returns
+        None if there is no index or either room is missing from it. """
+        if index is None:
+            index = self._index
+        if index is None or not index.has(self._start_location.name) \
+                or not index.has(target_location.name):
+            return None
+        path = search(index, index.id_of(self._start_location.name),
+                      index.id_of(target_location.name), recorder)
+        return [index.room(x) for x in path]
+
+    def __search(self, target_location: Room, breadth_first: bool,
+                 recorder: Optional[SearchRecorder]) -> List[Room]:
+        """ Runs the depth-first or breadth-first search of
+        resumable_search.py to the end, walking Room objects (or the pinned
+        snapshot's passages). """
+        return finish_steps(search_steps(self._start_location,
+                                         target_location, breadth_first,
+                                         recorder, self.__expand()))
+
+    def __expand(self) -> Callable[[Room], List[Room]]:
+        """ Returns the function the Room-walking searches list a room's
+        neighbors with: the pinned snapshot's, or Room.neighbors. """
+        if self._snapshot is None:
+            return neighbors_of
+        return self._snapshot.neighbors
 
     def path_to(self, target_location: Room) -> List[Room]:
         """ This function finds and returns a list of rooms from
         start_location to target_location.  The list will include
         both the start and destination, and if there isn't a path
         the list will be empty. This function uses depth first search. """
-        frontier = [[self._start_location]]
-        visited = set()
-        while len(frontier) != 0:
-            path = frontier.pop()
-            room = path[-1]
-            if room.name not in visited:
-                if self._echo_rooms_searched:
-                    print("Visiting: " + room.name)
-                if room.name == target_location.name:
-                    return path
-                visited.add(room.name)
-                neighbors = room.neighbors().__reversed__()
-                for x in neighbors:
-                    new_path = path.copy()
-                    new_path.append(x)
-                    frontier.append(new_path)
-        return []
+        recorder = self.__recorder("dfs", target_location)
+        if self._snapshot is not None:
+            return self.__finish(recorder, self.__search(
+                target_location, False, recorder))
+        if not self.__may_reach(target_location):
+            return self.__finish(recorder, [])
+        path = self.__indexed_path(index_search.dfs, target_location,
+                                   recorder)
+        if path is None:
+            path = self.__search(target_location, False, recorder)
+        return self.__finish(recorder, path)
+
+    def start_search(self, target_location: Room,
+                     algorithm: str = 'd') -> Any:
+        """ Starts a search for target_location that runs only as far as it
+        is asked to (see resumable_search.py), with algorithm 'd', 'b' or
+        'i' for depth-first, breadth-first or iterative deepening search.
+        Returns a ResumableSearch whose run method expands rooms within a
+        budget and returns the path, the same one path_to, bfs_path_to or
+        id_path_to would, once the search is done.  The search walks Room
+        objects even when the rat has an index, and walks the snapshot's
+        passages when the rat is pinned, in which case it is never stale.
+        Observers see it as one query, timed from start to finish including
+        any pauses. """
+        assert algorithm in "dbi" and len(algorithm) == 1, \
+            "Invalid algorithm code: " + algorithm
+        recorder = self.__recorder({'d': "dfs", 'b': "bfs", 'i': "id"}[
+            algorithm], target_location)
+        expand = self.__expand()
+        if self._snapshot is None and not self._dungeon.has_path(
+                self._start_location, target_location):
+            steps = no_steps()
+        elif algorithm == 'i':
+            steps = iterative_deepening_steps(self._start_location,
+                                              target_location, recorder,
+                                              expand)
+        else:
+            steps = search_steps(self._start_location, target_location,
+                                 algorithm == 'b', recorder, expand)
+        searched = self._dungeon if self._snapshot is None else self._snapshot
+        return ResumableSearch(searched, steps,
+                               lambda path: self.__finish(recorder, path))
 
     def directions_to(self, target_location: Room) -> List[str]:
         """ This function returns a list of the names of the rooms from the
@@ -94,45 +254,266 @@ class Rat:
     def bfs_path_to(self, target_location: Room) -> List[Room]:
 
         """Returns the list of rooms from the start location to the
-        target location, using breadth-first search to find the path."""
-        frontier = Queue(maxsize=0)
-        frontier.put([self._start_location])
-        visited = set()
-        while not frontier.empty():
-            path = frontier.get()
-            room = path[-1]
-            if room.name not in visited:
-                if self._echo_rooms_searched:
-                    print("Visiting: " + room.name)
-                if room.name == target_location.name:
-                    return path
-                visited.add(room.name)
-                neighbors = room.neighbors()
-                for x in neighbors:
-                    new_path = path.copy()
-                    new_path.append(x)
-                    frontier.put(new_path)
-        return []
-
-    def __dfs(self, depth: int, target_location: Room):
-        frontier = [[self._start_location]]
-        visited = set()
-        while len(frontier) != 0:
-            path = frontier.pop()
-            room = path[-1]
-            if room.name not in visited:
-                if self._echo_rooms_searched:
-                    print("Visiting: " + room.name)
-                if room.name == target_location.name:
-                    return path
-                visited.add(room.name)
-                neighbors = room.neighbors().__reversed__()
-                for x in neighbors:
-                    new_path = path.copy()
-                    new_path.append(x)
-                    if len(new_path)-1 <= depth:
-                        frontier.append(new_path)
-        return []
+        target location, using breadth-first search to find the path.  When
+        the rat tracks its paths (see track_paths), or the dungeon has a path
+        cache and the rat has no index, the path is read from the search
+        tree for the start location, unless an observer samples the query.
+        Otherwise, if the dungeon has corridors enabled and the rat has no
+        index, the search runs over the corridor overlay (see corridors.py)
+        and gives the same path."""
+        recorder = self.__recorder("bfs", target_location)
+        if self._snapshot is not None:
+            return self.__finish(recorder, self.__search(
+                target_location, True, recorder))
+        tracked = self._dynamic_paths
+        if tracked is not None and recorder is None:
+            return tracked.path_to(target_location)
+        if not self.__may_reach(target_location):
+            return self.__finish(recorder, [])
+        cache = self._dungeon.path_cache
+        if cache is not None and self._index is None and recorder is None:
+            path = cache.path(self._start_location, target_location)
+            if path is not None:
+                return path
+        overlay = getattr(self._dungeon, "corridors", None)
+        if overlay is not None and self._index is None and recorder is None \
+                and self._dungeon.tracks(self._start_location):
+            return overlay.path(self._start_location, target_location)
+        path = self.__indexed_path(index_search.bfs, target_location,
+                                   recorder)
+        if path is None:
+            path = self.__search(target_location, True, recorder)
+        return self.__finish(recorder, path)
+
+    def hierarchical_directions_to(self, target_location: Room) -> List[str]:
+
+        """Return the list of rooms names from the rat's current location to
+        the target location. Uses hierarchical search over the levels."""
+        path = self.hierarchical_path_to(target_location)
+        names = []
+        for x in path:
+            names.append(x.name)
+        return names
+
+    def hierarchical_path_to(self, target_location: Room) -> List[Room]:
+
+        """Returns the list of rooms from the start location to the target
+        location that bfs_path_to would, searching first over the stairs
+        between levels and then only the levels the path passes through
+        (see level_paths.py).  The dungeon's level abstraction is built on
+        the first call and rebuilt a level at a time as passages change.
+        Falls back to bfs_path_to when the dungeon cannot keep the
+        abstraction up to date, the rat is pinned to a snapshot, or the rat
+        has observers so that they see a search."""
+        dungeon = self._dungeon
+        if not hasattr(dungeon, "enable_level_paths") \
+                or self._snapshot is not None \
+                or not dungeon.tracks(self._start_location) \
+                or not dungeon.tracks(target_location) \
+                or len(self._observers) != 0:
+            return self.bfs_path_to(target_location)
+        if not dungeon.has_path(self._start_location, target_location):
+            return []
+        return dungeon.enable_level_paths().path(self._start_location,
+                                                 target_location)
+
+    def safest_directions_to(self, target_location: Room, costs: Any = None,
+                             avoid: Iterable[Room] = ()) -> List[str]:
+
+        """Return the list of rooms names from the rat's current location to
+        the target location on the least-risk path; see safest_path_to."""
+        path = self.safest_path_to(target_location, costs, avoid)
+        names = []
+        for x in path:
+            names.append(x.name)
+        return names
+
+    def safest_path_to(self, target_location: Room, costs: Any = None,
+                       avoid: Iterable[Room] = ()) -> List[Room]:
+
+        """Returns the list of rooms from the start location to the target
+        location with the least cost, where each move costs a step plus the
+        costs of the trap and monster in the room entered, as set by costs
+        (a HazardCosts; see hazard_search.py).  The path never enters a room
+        in avoid or one with a trap or monster that costs avoids.  When no
+        room has a cost beyond the step and nothing is avoided, this is
+        bfs_path_to."""
+        from hazard_search import HazardCosts, dijkstra
+        if costs is None:
+            costs = HazardCosts()
+        extra, avoided = costs.room_costs(self._dungeon)
+        avoided.update(avoid)
+        if len(extra) == 0 and len(avoided) == 0:
+            return self.bfs_path_to(target_location)
+        recorder = self.__recorder("dijkstra", target_location)
+        if (target_location in avoided
+                and target_location is not self._start_location) \
+                or not self._dungeon.has_path(
+                self._start_location, target_location):
+            return self.__finish(recorder, [])
+        return self.__finish(recorder, dijkstra(
+            self._start_location, target_location, costs.step, extra,
+            avoided, recorder))
+
+    def astar_directions_to(self, target_location: Room) -> List[str]:
+
+        """Return the list of rooms names from the rat's current location to
+        the target location. Uses A* search; see astar_path_to."""
+        path = self.astar_path_to(target_location)
+        names = []
+        for x in path:
+            names.append(x.name)
+        return names
+
+    def astar_path_to(self, target_location: Room) -> List[Room]:
+
+        """Returns a shortest list of rooms from the start location to the
+        target location, using A* search guided by the coordinates the
+        dungeon infers for its rooms from the directions of their passages
+        (see layouts.py).  On open grids it expands little more than the
+        rooms along the path.  The path is as short as the one bfs_path_to
+        finds but may take other turns.  Falls back to bfs_path_to where the
+        passages do not fit a consistent layout, when the dungeon cannot
+        keep a layout up to date, or when the rat is pinned to a
+        snapshot."""
+        from layouts import astar
+        dungeon = self._dungeon
+        if not hasattr(dungeon, "enable_layout") \
+                or self._snapshot is not None \
+                or not dungeon.tracks(self._start_location):
+            return self.bfs_path_to(target_location)
+        region = dungeon.enable_layout().region(self._start_location)
+        if not region.consistent:
+            return self.bfs_path_to(target_location)
+        recorder = self.__recorder("astar", target_location)
+        if not dungeon.has_path(self._start_location, target_location):
+            return self.__finish(recorder, [])
+        return self.__finish(recorder, astar(
+            self._start_location, target_location, region, recorder))
+
+    def directions_to_many(self, target_locations: List[Room]
+                           ) -> Dict[str, List[str]]:
+
+        """Return, for the name of each target location, the list of room
+        names on its breadth-first path from the rat's current location."""
+        paths = self.paths_to_many(target_locations)
+        names = {}
+        for target, path in paths.items():
+            names[target.name] = [x.name for x in path]
+        return names
+
+    def paths_to_many(self, target_locations: List[Room]
+                      ) -> Dict[Room, List[Room]]:
+
+        """Returns a dictionary from each target location to the list of
+        rooms on its path from the start location, with an empty list for
+        targets that cannot be reached.  A single breadth-first search
+        serves every target and stops once all reachable targets have been
+        found; each path is the one bfs_path_to returns for that target.
+        Observers see the whole call as one query."""
+        recorder = self.__recorder("bfs_many", None)
+        paths = self.__paths_to_many(target_locations, recorder)
+        if recorder is not None:
+            recorder.finish([x for x in paths.values() if len(x) != 0])
+        return paths
+
+    def __paths_to_many(self, target_locations: List[Room],
+                        recorder: Optional[SearchRecorder]
+                        ) -> Dict[Room, List[Room]]:
+        paths: Dict[Room, List[Room]] = {t: [] for t in target_locations}
+        pinned = self._snapshot is not None
+        wanted = {t.name: t for t in target_locations
+                  if pinned or self.__may_reach(t)}
+        if len(wanted) == 0:
+            return paths
+        index = None if pinned else self._index
+        if index is not None and index.has(self._start_location.name) \
+                and all(index.has(name) for name in wanted):
+            found_ids = index_search.bfs_many(
+                index, index.id_of(self._start_location.name),
+                {index.id_of(name) for name in wanted}, recorder)
+            for t in target_locations:
+                if t.name in wanted and index.id_of(t.name) in found_ids:
+                    paths[t] = [index.room(x)
+                                for x in found_ids[index.id_of(t.name)]]
+            return paths
+        cache = self._dungeon.path_cache
+        if index is None and cache is not None and recorder is None \
+                and not pinned:
+            # targets the cache cannot answer are left to one sweep below
+            missing = {}
+            for t in target_locations:
+                if t.name in wanted:
+                    path = cache.path(self._start_location, t)
+                    if path is None:
+                        missing[t.name] = t
+                    else:
+                        paths[t] = path
+            wanted = missing
+            if len(wanted) == 0:
+                return paths
+        expand = self.__expand()
+        parents: Dict[str, Optional[Room]] = {self._start_location.name: None}
+        found = {}
+        if self._start_location.name in wanted:
+            found[self._start_location.name] = self._start_location
+        frontier = deque([self._start_location])
+        while len(frontier) != 0 and len(found) < len(wanted):
+            room = frontier.popleft()
+            if recorder is not None:
+                recorder.visited(room.name, len(frontier),
+                                 len(expand(room)))
+            for x in expand(room):
+                if x.name not in parents:
+                    parents[x.name] = room
+                    frontier.append(x)
+                    if x.name in wanted:
+                        found[x.name] = x
+        for t in target_locations:
+            if t.name in found:
+                paths[t] = rebuild_path(parents, found[t.name])
+        return paths
+
+    def bidirectional_directions_to(self, target_location: Room) -> List[str]:
+
+        """Return the list of rooms names from the rat's current location to
+        the target location. Uses bidirectional breadth-first search."""
+        path = self.bidirectional_path_to(target_location)
+        names = []
+        for x in path:
+            names.append(x.name)
+        return names
+
+    def bidirectional_path_to(self, target_location: Room) -> List[Room]:
+
+        """Returns a shortest list of rooms from the start location to the
+        target location, searching forward from the start and backward from
+        the target until the two searches meet.  Passages are followed
+        backward through the reverse adjacency of the rat's index; a rat
+        without an index uses the dungeon's (see Dungeon.frozen), which is
+        built again only after the dungeon changes."""
+        recorder = self.__recorder("bidirectional", target_location)
+        if self._snapshot is not None:
+            return self.__finish(recorder, self.__search(
+                target_location, True, recorder))
+        if not self.__may_reach(target_location):
+            return self.__finish(recorder, [])
+        path = self.__indexed_path(index_search.bidirectional_bfs,
+                                   target_location, recorder)
+        if path is None:
+            path = self.__indexed_path(index_search.bidirectional_bfs,
+                                       target_location, recorder,
+                                       self.__frozen())
+        return self.__finish(recorder, path)
+
+    def __frozen(self) -> DungeonIndex:
+        """ Returns an index of the dungeon as it is now: the one the
+        dungeon keeps, when it is told about every change that could make
+        that stale, or else a new one. """
+        if hasattr(self._dungeon, "frozen") \
+                and self._dungeon.tracks(self._start_location):
+            return self._dungeon.frozen()
+        return self._dungeon.freeze()
 
     def id_directions_to(self, target_location: Room) -> List[str]:
 
@@ -147,13 +528,17 @@ class Rat:
     def id_path_to(self, target_location: Room) -> List[Room]:
 
         """Returns the list of rooms from the start location to the
-        target location, using iterative deepening."""
-        size = self._dungeon.size()
-        path = []
-        i = 1
-        while (i <= size) & (len(path) == 0):
-            path = self.__dfs(i, target_location)
-            i += 1
-        return path
-
-
+        target location, using iterative deepening.  The depth bound grows
+        until the target is found or a pass is not cut off by the bound,
+        meaning there is no path (see resumable_search.py)."""
+        recorder = self.__recorder("id", target_location)
+        if self._snapshot is None:
+            if not self.__may_reach(target_location):
+                return self.__finish(recorder, [])
+            path = self.__indexed_path(index_search.iterative_deepening,
+                                       target_location, recorder)
+            if path is not None:
+                return self.__finish(recorder, path)
+        return self.__finish(recorder, finish_steps(
+            iterative_deepening_steps(self._start_location, target_location,
+                                      recorder, self.__expand())))
@@ -0,0 +1,155 @@
+#
+# rat_cli.py: command-line batch mode for rat path queries, for scripts
+#   and bulk work where test_dungeons_two.main (run by lab3_main.py)
+#   prompts for one test at a time.
+#
+# Loads a dungeon from a JSON or binary dungeon file (see dungeon_file.py)
+# or builds one with a generator from dungeon_builders, then reads queries
+# from a file or standard input, one per line, either as JSON
+#   {"start": "0,0", "target": "9,9", "algorithm": "b"}
+# or as tab-separated start, target and (optionally) algorithm code.  Each
+# answer is written as a JSON line as soon as it is found, e.g.
+#   {"start": "0,0", "target": "9,9", "algorithm": "b",
+#    "path": ["0,0", ...], "seconds": 0.0012}
+# with "error" in place of "path" for a query that cannot be answered.
+# Queries are read and answered one at a time, so memory use does not grow
+# with the number of queries.  Modules are imported only when needed, so
+# `--help` and small runs start quickly.
+#
+# Run with, for example:
+#   python rat_cli.py --generate grid:100,100 --queries queries.txt
+#   python rat_cli.py --dungeon dungeon.json --algorithm d < queries.jsonl
+#
+
+from typing import *
+import argparse
+import sys
+
+METHODS = {'d': "directions_to", 'b': "bfs_directions_to",
+           'i': "id_directions_to"}
+GENERATORS = {"grid": "grid_dungeon", "stacked": "stacked_dungeon",
+              "random": "random_dungeon", "chain": "chain_dungeon",
+              "tree": "tree_dungeon", "loops": "looped_dungeon",
+              "corridors": "corridor_dungeon"}
+
+
+def load_dungeon(path: str) -> Any:
+    """Return the dungeon in the file at path: mapped if it is a binary
+    dungeon file and read in full if it is JSON."""
+    import dungeon_file
+    with open(path, "rb") as source:
+        magic = source.read(len(dungeon_file.MAGIC))
+    if magic == dungeon_file.MAGIC:
+        return dungeon_file.MappedDungeon(path)
+    from dungeon import read_dungeon_from_stream
+    with open(path) as source:
+        return read_dungeon_from_stream(source)
+
+
+def generate_dungeon(spec: str) -> Any:
+    """Return the dungeon described by spec, a generator name and its whole
+    number arguments, as in "grid:100,100" or "tree:10"."""
+    name, _, arguments = spec.partition(":")
+    assert name in GENERATORS, "Unknown generator: " + name
+    import dungeon_builders
+    build = getattr(dungeon_builders, GENERATORS[name])
+    return build(*[int(x) for x in arguments.split(",") if x != ""])
+
+
+def parse_query(line: str, algorithm: str) -> Tuple[str, str, str]:
+    """Return the start, target and algorithm code of a query line, using
+    algorithm when the line does not give one. A line that is not a query
+    raises ValueError, KeyError or AssertionError."""
+    if line.lstrip().startswith("{"):
+        import json
+        query = json.loads(line)
+        fields = (query["start"], query["target"],
+                  query.get("algorithm", algorithm))
+        if not all(isinstance(x, str) for x in fields):
+            raise ValueError("start, target and algorithm must be strings")
+        return fields
+    fields = line.rstrip("\r\n").split("\t")
+    assert 2 <= len(fields) <= 3, "Expected start, target and algorithm"
+    return fields[0], fields[1], fields[2] if len(fields) == 3 else algorithm
+
+
+def answer_queries(d: Any, lines: Iterable[str], algorithm: str,
+                   out: TextIO) -> Tuple[int, int]:
+    """Answer the query on each of lines over dungeon d, writing one JSON
+    line per query to out; returns the number of queries answered and the
+    number that failed. A query that is malformed, names a room d does not
+    have or gives an unknown algorithm is answered with an error; any other
+    exception is a fault in the search and is raised."""
+    import json
+    import time
+    from rat import Rat
+    index = d.freeze()
+    answered = 0
+    failed = 0
+    for line in lines:
+        if line.strip() == "":
+            continue
+        result: Dict[str, Any] = {}
+        begin = time.perf_counter()
+        try:
+            start, target, code = parse_query(line, algorithm)
+            result.update(start=start, target=target, algorithm=code)
+            if code not in METHODS:
+                raise ValueError("invalid algorithm code: " + str(code))
+            for name in [start, target]:
+                if not d.has(name):
+                    raise ValueError("unknown room: " + name)
+        except (ValueError, KeyError, AssertionError) as error:
+            result["error"] = str(error) or type(error).__name__
+            failed += 1
+        else:
+            rat = Rat(d, d.find(start))
+            rat.set_index(index)
+            result["path"] = getattr(rat, METHODS[code])(d.find(target))
+            answered += 1
+        result["seconds"] = round(time.perf_counter() - begin, 9)
+        out.write(json.dumps(result) + "\n")
+    return answered, failed
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Answer the queries described on the command line; the exit status is
+    1 if any query failed."""
+    parser = argparse.ArgumentParser(
+        description="Answer rat path queries in bulk, writing JSON lines.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--dungeon",
+                        help="JSON or binary dungeon file to search")
+    source.add_argument("--generate", metavar="NAME:ARGS",
+                        help="build a dungeon instead: one of %s with its "
+                             "arguments, e.g. grid:100,100"
+                             % ", ".join(GENERATORS))
+    parser.add_argument("--queries", default="-",
+                        help="file of queries, one per line (default stdin)")
+    parser.add_argument("--output", default="-",
+                        help="file for the results (default stdout)")
+    parser.add_argument("--algorithm", default="d", choices=list(METHODS),
+                        help="algorithm for queries that do not give one")
+    args = parser.parse_args(argv)
+    if args.dungeon is not None:
+        d = load_dungeon(args.dungeon)
+    else:
+        d = generate_dungeon(args.generate)
+    queries = sys.stdin if args.queries == "-" else open(args.queries)
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        answered, failed = answer_queries(d, queries, args.algorithm, out)
+    finally:
+        if queries is not sys.stdin:
+            queries.close()
+        if out is not sys.stdout:
+            out.close()
+        if hasattr(d, "close"):
+            d.close()  # unmap a binary dungeon file
+    print("%d queries answered, %d failed" % (answered, failed),
+          file=sys.stderr)
+    return 1 if failed != 0 else 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,321 @@
+#
+# reachability.py: tracks which rooms of a dungeon can possibly reach which
+#   others, so that a search for an unreachable room can be skipped.
+#
+# Rooms are grouped two ways.  Weak components ignore the direction of
+# passages and are kept with union-find over the strongly connected
+# components described next, whose rooms are always weakly connected; rooms
+# in different weak components can never reach each other.  Strongly
+# connected components (SCCs) group rooms that can all reach one another;
+# they are also kept with union-find, and the one-way passages between them
+# form a small acyclic graph (the condensation) that answers the remaining
+# queries.  A passage that cannot close a cycle, because nothing leads into
+# the SCC it leaves or nothing leads out of the one it enters, is added to
+# the condensation as it is, so building a dungeon does not search per
+# passage.  Any other passage between SCCs is checked with a search of the
+# condensation, forward from the SCC it enters and backward from the one it
+# leaves a room at a time, and the SCCs on the cycle it closes are merged.
+# The second half of a two-way passage closes a cycle of just its two rooms,
+# so it is merged at once.  Only a search that grows past search_limit SCCs,
+# or a passage replaced or removed, marks the index stale, to be rebuilt at
+# the next query.  The index starts out stale too: until the first query it
+# holds nothing but the list of rooms, so a dungeon that is built and never
+# asked about pays for no more than that.
+#
+
+from typing import *
+
+
+class ReachabilityIndex:
+    """Incremental reachability over the rooms of a dungeon. Rooms and
+    passages are added as the dungeon changes; replacing or removing a
+    passage, or adding one whose cycle search passes search_limit SCCs,
+    marks the index stale and it is rebuilt from the rooms' current
+    neighbors at the next query. A new index is stale until its first
+    query. Rooms are keyed by identity.
+
+    Attributes:
+        search_limit (int): most SCCs a cycle search may visit before it
+            gives up and leaves the index to be rebuilt
+    """
+
+    search_limit = 1000
+
+    def __init__(self):
+        """Create an empty index."""
+        self._rooms: List[Any] = []
+        self._weak: Dict[Any, Any] = {}
+        self._weak_size: Dict[Any, int] = {}
+        self._scc: Dict[Any, Any] = {}
+        # condensation edges; SCCs without any have no entry
+        self._out: Dict[Any, Set[Any]] = {}
+        self._in: Dict[Any, Set[Any]] = {}
+        self._stale = True
+        self._exact = True
+
+    def add_room(self, room: Any) -> None:
+        """Start tracking room, initially with no passages."""
+        self._rooms.append(room)
+        if not self._stale:
+            self._weak[room] = room
+            self._weak_size[room] = 1
+            self._scc[room] = room
+
+    def add_rooms(self, rooms: List[Any]) -> None:
+        """Start tracking each of rooms, as add_room does."""
+        self._rooms.extend(rooms)
+        if not self._stale:
+            self._weak.update(zip(rooms, rooms))
+            self._weak_size.update(dict.fromkeys(rooms, 1))
+            self._scc.update(zip(rooms, rooms))
+
+    def knows(self, room: Any) -> bool:
+        """Returns true if room is tracked by the index."""
+        if self._stale:
+            self.__rebuild()
+        return room in self._scc
+
+    def is_exact(self) -> bool:
+        """Returns false once mark_inexact has been called."""
+        return self._exact
+
+    def invalidate(self) -> None:
+        """Note that a passage was replaced or removed; the index is rebuilt
+        at the next query, and until then holds only the rooms."""
+        self.__drop()
+
+    def mark_inexact(self) -> None:
+        """Note that tracked rooms lead to rooms the index cannot follow (for
+        instance, rooms belonging to another dungeon). From then on every
+        query answers that a path may exist."""
+        self._exact = False
+
+    def add_passage(self, a: Any, b: Any) -> None:
+        """Record a one-way passage from room a to room b."""
+        if self._stale:
+            return
+        sa = self.__find_scc(a)
+        sb = self.__find_scc(b)
+        if sa is sb or sb in self._out.get(sa, ()):
+            return
+        self.__union_weak(sa, sb)
+        if sa in self._in and sb in self._out:
+            cycle = self.__cycle(sa, sb)
+            if cycle is None:
+                self.__drop()
+                return
+            elif len(cycle) != 0:
+                self.__merge(cycle)
+                return
+        self._out.setdefault(sa, set()).add(sb)
+        self._in.setdefault(sb, set()).add(sa)
+
+    def add_exits(self, rooms: List[Any]) -> None:
+        """Record the passages out of each of rooms to rooms the index
+        tracks, as add_passage does; nothing is recorded while the index is
+        stale, since the rebuild will find them."""
+        if self._stale:
+            return
+        known = self._scc
+        for room in rooms:
+            for n in room.neighbors():
+                if n in known:
+                    self.add_passage(room, n)
+
+    def has_path(self, a: Any, b: Any) -> bool:
+        """Returns false if there is certainly no path from room a to room b.
+        Rooms that are not tracked are assumed to be reachable."""
+        if not self._exact:
+            return True
+        if self._stale:
+            self.__rebuild()
+        if a not in self._scc or b not in self._scc:
+            return True
+        sa = self.__find_scc(a)
+        sb = self.__find_scc(b)
+        if self.__find_weak(sa) is not self.__find_weak(sb):
+            return False
+        return sb is sa or sb in self.__reachable_from(sa, sb)
+
+    def __find_weak(self, room: Any) -> Any:
+        parents = self._weak
+        while parents[room] is not room:
+            parents[room] = parents[parents[room]]
+            room = parents[room]
+        return room
+
+    def __union_weak(self, a: Any, b: Any) -> None:
+        a = self.__find_weak(a)
+        b = self.__find_weak(b)
+        if a is not b:
+            if self._weak_size[a] < self._weak_size[b]:
+                a, b = b, a
+            self._weak[b] = a
+            self._weak_size[a] += self._weak_size.pop(b)
+
+    def __find_scc(self, room: Any) -> Any:
+        parents = self._scc
+        while parents[room] is not room:
+            parents[room] = parents[parents[room]]
+            room = parents[room]
+        return room
+
+    def __reachable_from(self, scc: Any, stop: Any = None) -> Set[Any]:
+        """Returns the SCCs reachable from scc in the condensation, ending
+        early once stop is reached."""
+        reached = {scc}
+        pending = [scc]
+        while len(pending) != 0:
+            for x in self._out.get(pending.pop(), ()):
+                if x not in reached:
+                    reached.add(x)
+                    if x is stop:
+                        return reached
+                    pending.append(x)
+        return reached
+
+    def __cycle(self, sa: Any, sb: Any) -> Optional[Set[Any]]:
+        """Returns the SCCs on the paths from sb to sa in the condensation,
+        which a passage from sa to sb joins into one, or an empty set if
+        there are none. The searches forward from sb and backward from sa
+        take turns until one of them runs out, then that one's SCCs are
+        narrowed to those the other end can also reach. Returns None if the
+        searches visit more than search_limit SCCs."""
+        out = self._out.get(sb, ())
+        if sa in out and (len(out) == 1 or len(self._in[sa]) == 1):
+            # the other half of a two-way passage, with no other way back
+            return {sa, sb}
+        forward = {sb}
+        backward = {sa}
+        ahead = [sb]
+        behind = [sa]
+        while len(ahead) != 0 and len(behind) != 0:
+            if len(forward) + len(backward) > self.search_limit:
+                return None
+            if len(forward) <= len(backward):
+                for x in self._out.get(ahead.pop(), ()):
+                    if x not in forward:
+                        forward.add(x)
+                        ahead.append(x)
+            else:
+                for x in self._in.get(behind.pop(), ()):
+                    if x not in backward:
+                        backward.add(x)
+                        behind.append(x)
+        if len(ahead) == 0:
+            return self.__within(forward, sa, self._in)
+        return self.__within(backward, sb, self._out)
+
+    def __within(self, found: Set[Any], start: Any,
+                 edges: Dict[Any, Set[Any]]) -> Set[Any]:
+        """Returns the SCCs of found reached from start along edges without
+        leaving found, or an empty set if start is not in found."""
+        if start not in found:
+            return set()
+        reached = {start}
+        pending = [start]
+        while len(pending) != 0:
+            for x in edges.get(pending.pop(), ()):
+                if x in found and x not in reached:
+                    reached.add(x)
+                    pending.append(x)
+        return reached
+
+    def __merge(self, cycle: Set[Any]) -> None:
+        """Joins the SCCs of cycle into one, moving their condensation
+        edges to it."""
+        rep = next(iter(cycle))
+        out: Set[Any] = set()
+        into: Set[Any] = set()
+        for x in cycle:
+            self._scc[x] = rep
+            out |= self._out.pop(x, set())
+            into |= self._in.pop(x, set())
+        out -= cycle
+        into -= cycle
+        for x in out:
+            self._in[x] -= cycle
+            self._in[x].add(rep)
+        for x in into:
+            self._out[x] -= cycle
+            self._out[x].add(rep)
+        if len(out) != 0:
+            self._out[rep] = out
+        if len(into) != 0:
+            self._in[rep] = into
+
+    def __drop(self) -> None:
+        """Marks the index stale and lets go of its components until the
+        rebuild."""
+        self._stale = True
+        self._weak = {}
+        self._weak_size = {}
+        self._scc = {}
+        self._out = {}
+        self._in = {}
+
+    def __rebuild(self) -> None:
+        """Recompute the components from the current neighbors of every
+        tracked room, using Tarjan's algorithm for the SCCs. Rooms in one SCC
+        are weakly connected already, so the weak components only need the
+        passages between SCCs."""
+        rooms = self._rooms
+        known = set(rooms)
+        adjacent = {room: [n for n in room.neighbors() if n in known]
+                    for room in rooms}
+        scc: Dict[Any, Any] = {}
+        number: Dict[Any, int] = {}
+        low: Dict[Any, int] = {}
+        on_stack: Set[Any] = set()
+        stack: List[Any] = []
+        for root in rooms:
+            if root in number:
+                continue
+            number[root] = low[root] = len(number)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(adjacent[root]))]
+            while len(work) != 0:
+                room, neighbors = work[-1]
+                advanced = False
+                for n in neighbors:
+                    if n not in number:
+                        number[n] = low[n] = len(number)
+                        stack.append(n)
+                        on_stack.add(n)
+                        work.append((n, iter(adjacent[n])))
+                        advanced = True
+                        break
+                    elif n in on_stack and number[n] < low[room]:
+                        low[room] = number[n]
+                if advanced:
+                    continue
+                work.pop()
+                if len(work) != 0:
+                    parent = work[-1][0]
+                    if low[room] < low[parent]:
+                        low[parent] = low[room]
+                if low[room] == number[room]:
+                    while True:
+                        x = stack.pop()
+                        on_stack.discard(x)
+                        scc[x] = room
+                        if x is room:
+                            break
+        self._scc = scc
+        self._weak_size = {}
+        self._out = {}
+        self._in = {}
+        for room in rooms:
+            rep = scc[room]
+            self._weak_size[rep] = self._weak_size.get(rep, 0) + 1
+        self._weak = {rep: rep for rep in self._weak_size}
+        for room in rooms:
+            a = scc[room]
+            for n in adjacent[room]:
+                b = scc[n]
+                if a is not b:
+                    self._out.setdefault(a, set()).add(b)
+                    self._in.setdefault(b, set()).add(a)
+                    self.__union_weak(a, b)
+        self._stale = False
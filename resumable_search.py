@@ -0,0 +1,234 @@
+#
+# resumable_search.py: the rat's searches written as generators, so a search
+#   can be run a few rooms at a time (for example within a game loop's
+#   budget for each tick) and picked up again later.
+#
+# Each generator yields every room as it is expanded and returns the path
+# when it finishes; Rat's blocking Room-walking searches are these same
+# generators run to the end with finish_steps.  All of the search's state
+# (frontier, parent links, depths) lives in the suspended generator, so
+# pausing costs nothing and resuming carries on from the very next room.  A ResumableSearch wraps a generator
+# with budgets on the rooms expanded and on the time taken per call.
+#
+
+from dungeon import Dungeon, Room
+from typing import *
+from collections import deque
+import time
+
+Steps = Generator[Room, None, List[Room]]
+
+
+def rebuild_path(parents: Dict[str, Optional[Room]],
+                 room: Room) -> List[Room]:
+    """Follows the parent links back from room to the start of a search and
+    returns the rooms in order from the start."""
+    path = []
+    while room is not None:
+        path.append(room)
+        room = parents[room.name]
+    path.reverse()
+    return path
+
+
+def neighbors_of(room: Room) -> List[Room]:
+    """Lists the passages out of room the generators follow by default,
+    through Room.neighbors (which MappedRoom overrides)."""
+    return room.neighbors()
+
+
+def finish_steps(steps: Steps) -> List[Room]:
+    """Runs steps to the end without pausing and returns the path."""
+    try:
+        while True:
+            next(steps)
+    except StopIteration as finished:
+        return finished.value
+
+
+def no_steps() -> Steps:
+    """Yields no rooms and returns an empty path, for a target known to be
+    out of reach."""
+    return []
+    yield  # never reached; makes this a generator
+
+
+def search_steps(start: Room, target: Room, breadth_first: bool,
+                 recorder: Any = None,
+                 expand: Callable[[Room], List[Room]] = neighbors_of
+                 ) -> Steps:
+    """Depth-first or breadth-first search from start to target, yielding
+    each room as it is expanded and returning the path (empty if there is
+    none), for Rat.path_to and Rat.bfs_path_to.  expand lists the rooms a
+    room has passages to.  The frontier holds (room, parent) entries rather
+    than whole paths; the parent of each room is recorded when the room is
+    expanded, so the path is rebuilt only once, when the target is
+    reached."""
+    frontier = deque([(start, None)])
+    parents: Dict[str, Optional[Room]] = {}
+    while len(frontier) != 0:
+        if breadth_first:
+            room, parent = frontier.popleft()
+        else:
+            room, parent = frontier.pop()
+        if room.name not in parents:
+            if recorder is not None:
+                recorder.visited(room.name, len(frontier),
+                                 0 if room.name == target.name
+                                 else len(expand(room)))
+            parents[room.name] = parent
+            yield room
+            if room.name == target.name:
+                return rebuild_path(parents, room)
+            neighbors = expand(room)
+            if not breadth_first:
+                neighbors.reverse()
+            for x in neighbors:
+                frontier.append((x, room))
+    return []
+
+
+def iterative_deepening_steps(start: Room, target: Room,
+                              recorder: Any = None,
+                              expand: Callable[[Room], List[Room]] =
+                              neighbors_of) -> Steps:
+    """Iterative deepening search from start to target, yielding each room
+    as it is expanded (rooms are yielded again on each pass that expands
+    them) and returning the path, for Rat.id_path_to.  Each pass is a
+    depth-first search that expands no room more than depth steps from the
+    start.  Rooms are tracked by the shallowest depth they were expanded
+    at, so a room reached again by a shorter route is expanded again, and
+    no room is expanded deeper than its distance as found by the previous,
+    shallower pass.  The bound grows until the target is found or a pass
+    is not cut off by it, meaning there is no path."""
+    depth = 0
+    known: Dict[str, int] = {}
+    while True:
+        if recorder is not None:
+            recorder.next_pass()
+        frontier = [(start, None, 0)]
+        depths: Dict[str, int] = {}
+        parents: Dict[str, Optional[Room]] = {}
+        pruned: List[Room] = []
+        while len(frontier) != 0:
+            room, parent, room_depth = frontier.pop()
+            if depths.get(room.name, room_depth + 1) > room_depth:
+                if recorder is not None:
+                    recorder.visited(room.name, len(frontier),
+                                     0 if room.name == target.name
+                                     or room_depth >= depth
+                                     else len(expand(room)))
+                depths[room.name] = room_depth
+                parents[room.name] = parent
+                yield room
+                if room.name == target.name:
+                    return rebuild_path(parents, room)
+                neighbors = expand(room)
+                if room_depth < depth:
+                    next_depth = room_depth + 1
+                    neighbors.reverse()
+                    for x in neighbors:
+                        if depths.get(x.name, next_depth + 1) > next_depth \
+                                and known.get(x.name, next_depth) \
+                                >= next_depth:
+                            frontier.append((x, room, next_depth))
+                else:
+                    for x in neighbors:
+                        if x.name not in depths:
+                            pruned.append(x)
+        if not any(x.name not in depths for x in pruned):
+            return []
+        known = depths
+        depth += 1
+
+
+class ResumableSearch:
+    """A search that can be paused after a number of rooms or a length of
+    time and resumed later; see Rat.start_search.  Iterating over it expands
+    the remaining rooms one at a time.
+
+    Attributes:
+        done (bool): true once the search has finished or been cancelled
+        path (List[Room]): the path found, empty until the search is done
+            (and if there is no path)
+        expanded (int): rooms expanded so far, over every call
+        stale (bool): true if the dungeon has changed since the search
+            started, so the path may differ from a fresh search's or use a
+            passage that is gone
+    """
+
+    def __init__(self, dungeon: Dungeon, steps: Steps,
+                 on_finish: Optional[Callable[[List[Room]], Any]] = None):
+        """Wrap the generator steps, which searches dungeon (or a
+        DungeonSnapshot, which never goes stale); on_finish is called with
+        the path when the search finishes."""
+        self.done = False
+        self.path: List[Room] = []
+        self.expanded = 0
+        self._dungeon = dungeon
+        self._version = dungeon.version
+        self._steps = steps
+        self._on_finish = on_finish
+
+    @property
+    def stale(self) -> bool:
+        """Returns true if the dungeon has changed since the search
+        started."""
+        return self._version != self._dungeon.version
+
+    def step(self) -> Optional[Room]:
+        """Expands one room and returns it, or returns None once the search
+        is done."""
+        if self.done:
+            return None
+        try:
+            room = next(self._steps)
+        except StopIteration as finished:
+            self.__finish(finished.value)
+            return None
+        self.expanded += 1
+        return room
+
+    def run(self, max_rooms: Optional[int] = None,
+            seconds: Optional[float] = None) -> Optional[List[Room]]:
+        """Expands rooms until the search finishes, max_rooms rooms have been
+        expanded by this call or seconds have passed, whichever is first.
+        Returns the path once the search is done (empty if there is no
+        path), or None if it was paused and should be run again."""
+        steps = self._steps
+        count = 0
+        deadline = None if seconds is None else time.perf_counter() + seconds
+        try:
+            while not self.done:
+                if max_rooms is not None and count >= max_rooms:
+                    return None
+                if deadline is not None and count != 0 \
+                        and time.perf_counter() >= deadline:
+                    return None
+                next(steps)
+                count += 1
+        except StopIteration as finished:
+            self.__finish(finished.value)
+        finally:
+            self.expanded += count
+        return self.path
+
+    def cancel(self) -> None:
+        """Abandons the search, freeing its frontier; it is then done, with an
+        empty path."""
+        if not self.done:
+            self._steps.close()
+            self.__finish([])
+
+    def __iter__(self) -> Iterator[Room]:
+        while True:
+            room = self.step()
+            if room is None:
+                return
+            yield room
+
+    def __finish(self, path: List[Room]) -> None:
+        self.done = True
+        self.path = path
+        if self._on_finish is not None:
+            self._on_finish(path)
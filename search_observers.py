@@ -0,0 +1,164 @@
+#
+# search_observers.py: watching the rat's searches.
+#
+# A Rat with observers attached (see Rat.add_observer) hands each search a
+# SearchRecorder, which counts rooms expanded, neighbors generated, the
+# largest frontier and iterative deepening passes, times the query and
+# passes each visited room on to the observers that ask for visits.  The
+# searches only touch the recorder behind an "is not None" test, so a rat
+# with no observers, or a query left out by sampling, runs exactly the
+# uninstrumented search.
+#
+
+from typing import *
+import time
+
+
+class SearchStats:
+    """Counters for one search by a rat.
+
+    Attributes:
+        algorithm (str): "dfs", "bfs", "id", "bidirectional", "bfs_many",
+            "dijkstra" or "astar"
+        start (str): name of the room the search started from
+        target (Optional[str]): name of the room searched for, or None when
+            searching for many rooms at once
+        rooms_expanded (int): rooms visited, counting each time iterative
+            deepening visits a room again
+        neighbors_generated (int): passages followed out of expanded rooms
+        max_frontier (int): most rooms waiting on the frontier at a visit
+        depth_passes (int): depth-limited passes made by iterative deepening
+        seconds (float): wall time for the query, including the visits
+            reported to observers
+        path_length (int): rooms on the path found, 0 if there was none
+    """
+
+    def __init__(self, algorithm: str, start: str, target: Optional[str]):
+        """Create zeroed counters for a query."""
+        self.algorithm = algorithm
+        self.start = start
+        self.target = target
+        self.rooms_expanded = 0
+        self.neighbors_generated = 0
+        self.max_frontier = 0
+        self.depth_passes = 0
+        self.seconds = 0.0
+        self.path_length = 0
+
+
+class SearchObserver:
+    """Base class for objects watching a rat's searches; subclasses override
+    the methods they need.
+
+    Attributes:
+        visits (bool): true if room_visited should be called for each room
+            a search expands; visits are what make observing expensive
+        sample_every (int): observe only every nth query the rat makes
+    """
+
+    visits = False
+    sample_every = 1
+
+    def query_started(self, stats: SearchStats) -> None:
+        """Called before an observed search starts, with zeroed stats."""
+        pass
+
+    def room_visited(self, name: str, stats: SearchStats) -> None:
+        """Called, when visits is true, as a search expands the named room;
+        stats holds the counts so far."""
+        pass
+
+    def query_finished(self, stats: SearchStats) -> None:
+        """Called with the final stats once an observed search returns."""
+        pass
+
+
+class EchoObserver(SearchObserver):
+    """Prints each room as it is visited, as set_echo_rooms_searched always
+    has."""
+
+    visits = True
+
+    def room_visited(self, name: str, stats: SearchStats) -> None:
+        """Prints the name of the room being visited."""
+        print("Visiting: " + name)
+
+
+class SearchMetrics(SearchObserver):
+    """Totals the stats of every query it observes.
+
+    Attributes:
+        queries (int): queries observed
+        rooms_expanded, neighbors_generated, depth_passes (int), seconds
+            (float): totals over the observed queries
+        max_frontier (int): largest frontier in any observed query
+        last (Optional[SearchStats]): stats of the latest observed query
+    """
+
+    def __init__(self, sample_every: int = 1,
+                 on_visit: Optional[Callable[[str, SearchStats], None]]
+                 = None):
+        """Observe every sample_every-th query; on_visit, if given, is
+        called with the name of each room visited and the stats so far."""
+        assert sample_every >= 1
+        self.sample_every = sample_every
+        self.visits = on_visit is not None
+        self._on_visit = on_visit
+        self.queries = 0
+        self.rooms_expanded = 0
+        self.neighbors_generated = 0
+        self.max_frontier = 0
+        self.depth_passes = 0
+        self.seconds = 0.0
+        self.last: Optional[SearchStats] = None
+
+    def room_visited(self, name: str, stats: SearchStats) -> None:
+        """Passes the visit on to on_visit."""
+        self._on_visit(name, stats)
+
+    def query_finished(self, stats: SearchStats) -> None:
+        """Adds the query's stats to the totals."""
+        self.queries += 1
+        self.rooms_expanded += stats.rooms_expanded
+        self.neighbors_generated += stats.neighbors_generated
+        self.max_frontier = max(self.max_frontier, stats.max_frontier)
+        self.depth_passes += stats.depth_passes
+        self.seconds += stats.seconds
+        self.last = stats
+
+
+class SearchRecorder:
+    """Collects the stats of one observed query for the searches to update,
+    passing visits on to the observers that want them."""
+
+    def __init__(self, observers: List[SearchObserver], stats: SearchStats):
+        """Start recording a query for observers, telling them it started."""
+        self.stats = stats
+        self._observers = observers
+        self._visiting = [o for o in observers if o.visits]
+        for o in observers:
+            o.query_started(stats)
+        self._begin = time.perf_counter()
+
+    def visited(self, name: str, frontier: int, generated: int) -> None:
+        """Record the expansion of the named room with frontier rooms still
+        waiting, generated of its neighbors about to be followed."""
+        stats = self.stats
+        stats.rooms_expanded += 1
+        stats.neighbors_generated += generated
+        if frontier > stats.max_frontier:
+            stats.max_frontier = frontier
+        for o in self._visiting:
+            o.room_visited(name, stats)
+
+    def next_pass(self) -> None:
+        """Record the start of another depth-limited pass."""
+        self.stats.depth_passes += 1
+
+    def finish(self, path: List[Any]) -> None:
+        """Record the path found and the time taken, and tell the
+        observers."""
+        self.stats.seconds = time.perf_counter() - self._begin
+        self.stats.path_length = len(path)
+        for o in self._observers:
+            o.query_finished(self.stats)
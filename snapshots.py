@@ -0,0 +1,241 @@
+#
+# snapshots.py: read-only snapshots of a dungeon's passages that stay as
+#   they were while the dungeon goes on changing, so rats on other threads
+#   can search a consistent map during live edits (see Dungeon.snapshot and
+#   Rat.pin).
+#
+# A room keeps its passages in a tuple that an edit replaces rather than
+# changes (Room._set_neighbor), so a snapshot never copies passages: it
+# shares the tuples.  The log behind the snapshots keeps, for every room,
+# the tuple it had when the log started or when the oldest live snapshot
+# was taken, and for the rooms changed since then each later tuple, tagged
+# with the edit that made it.  A snapshot finds a room's passages as the
+# newest tuple no newer than itself.  Taking a snapshot costs nothing more
+# than a counter, and the log holds one entry per passage edit made since
+# the oldest live snapshot; as snapshots are released those entries are
+# folded back.  Edits are recorded as the dungeon reports them, one passage
+# at a time, so a snapshot taken between the two halves of add_neighbor
+# sees the passage one way only.
+#
+# Searching a snapshot takes no lock.  Recording an edit and taking or
+# releasing a snapshot hold the log's lock for a moment, and never replace
+# a tuple a live snapshot could still read before the one that follows it
+# is in place.
+#
+
+from dungeon import Dungeon, Room
+from typing import *
+import threading
+import weakref
+
+
+class DungeonSnapshot:
+    """The rooms and passages of a dungeon as they were when the snapshot
+    was taken; see Dungeon.snapshot. It answers the questions a Rat pinned to
+    it (see Rat.pin) asks, however the dungeon changes afterwards. Rooms the
+    dungeon did not know about when the snapshot was taken have no passages
+    in it. Use it as a context manager, or call release, so the log can
+    drop the edits only it needs.
+
+    Attributes:
+        version (int): number of passage edits recorded before the snapshot
+            was taken
+    """
+
+    def __init__(self, log: 'SnapshotLog', version: int, size: int):
+        """Create a snapshot of log at version with the dungeon's first size
+        rooms; use Dungeon.snapshot to take one."""
+        self.version = version
+        self._log = log
+        self._size = size
+        self._release = weakref.finalize(self, log._released.append,
+                                         version)
+
+    def __enter__(self) -> 'DungeonSnapshot':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.release()
+
+    def release(self) -> None:
+        """Lets the log forget the edits only this snapshot needed; the
+        snapshot must not be searched afterwards. Releasing twice does
+        nothing."""
+        self._release()
+        self._log._collect()
+
+    @property
+    def start(self) -> Room:
+        """The dungeon's start room."""
+        return self._log._dungeon.start
+
+    def neighbors(self, room: Room) -> List[Room]:
+        """Returns the rooms reachable from room, in Room.neighbors() order,
+        as they were when the snapshot was taken."""
+        log = self._log
+        history = log._history.get(room)
+        if history is not None:
+            for i in range(len(history) - 1, -1, -1):
+                if history[i][0] <= self.version:
+                    return list(history[i][1])
+        return list(log._base.get(room, ()))
+
+    def has(self, room_name: str) -> bool:
+        """Returns true if the named room was in the dungeon when the
+        snapshot was taken."""
+        dungeon = self._log._dungeon
+        if not dungeon.has(room_name):
+            return False
+        room = dungeon.find(room_name)
+        return any(dungeon.room(i) is room for i in self.__positions(room))
+
+    def find(self, room_name: str) -> Room:
+        """Returns the named room or fails if it was not in the dungeon when
+        the snapshot was taken."""
+        assert self.has(room_name)
+        return self._log._dungeon.find(room_name)
+
+    def rooms(self) -> Iterable[Room]:
+        """Returns the rooms that were in the dungeon when the snapshot was
+        taken, in the order they were added."""
+        dungeon = self._log._dungeon
+        return [dungeon.room(i) for i in range(self._size)]
+
+    def size(self) -> int:
+        """Returns the number of rooms in the snapshot."""
+        return self._size
+
+    def __positions(self, room: Room) -> Iterable[int]:
+        """Returns the positions within the snapshot's rooms where room may
+        be: its id, unless it was first registered with another dungeon."""
+        if 0 <= room.id < self._size \
+                and self._log._dungeon.room(room.id) is room:
+            return [room.id]
+        return range(self._size)
+
+
+class SnapshotLog:
+    """The passage edits a dungeon's live snapshots need; see
+    Dungeon.snapshot.
+    """
+
+    def __init__(self, dungeon: Dungeon):
+        """Record the passages of dungeon's rooms and start listening to
+        it."""
+        self._dungeon = dungeon
+        self._lock = threading.Lock()
+        self._version = 0
+        self._registered = 0
+        self._base: Dict[Room, Tuple[Room, ...]] = {}
+        self._history: Dict[Room, Tuple[Tuple[int, Tuple[Room, ...]], ...]] \
+            = {}
+        self._live: Dict[int, int] = {}
+        self._released: List[int] = []  # versions of snapshots let go
+        with self._lock:
+            self.__register()
+        dungeon.add_listener(self)
+
+    def close(self) -> None:
+        """Stop listening to the dungeon."""
+        self._dungeon.remove_listener(self)
+
+    def snapshot(self) -> DungeonSnapshot:
+        """Returns a snapshot of the dungeon as it is now."""
+        with self._lock:
+            self.__drain()
+            self.__register()
+            self._live[self._version] = self._live.get(self._version, 0) + 1
+            return DungeonSnapshot(self, self._version, self._registered)
+
+    def kept(self) -> int:
+        """Returns the number of edits held for live snapshots."""
+        with self._lock:
+            self.__drain()
+            return sum(len(h) for h in self._history.values())
+
+    def passage_added(self, a: Room, b: Room, replaced: Optional[Room]) -> None:
+        """Called by the dungeon when a passage from a to b is added in place
+        of the passage to replaced (or None)."""
+        with self._lock:
+            self.__drain()
+            known = a in self._base or a in self._history
+            self.__discover([a, b], self._version + 1)
+            if known:
+                self.__record(a, self._version + 1)
+            self._version += 1
+
+    def passage_removed(self, a: Room, b: Room) -> None:
+        """Called by the dungeon when a passage from a to b is removed."""
+        with self._lock:
+            self.__drain()
+            self.__record(a, self._version + 1)
+            self._version += 1
+
+    def _collect(self) -> None:
+        """Forgets the edits that only released snapshots needed."""
+        with self._lock:
+            self.__drain()
+
+    def __drain(self) -> None:
+        """Counts off the snapshots released or collected since the last
+        call, compacting the history if the oldest live one has gone. A
+        collected snapshot only adds its version to _released, as that may
+        happen while the lock is held."""
+        if len(self._released) == 0:
+            return
+        oldest = min(self._live)
+        while len(self._released) != 0:
+            version = self._released.pop()
+            self._live[version] -= 1
+            if self._live[version] == 0:
+                del self._live[version]
+        if len(self._live) == 0 or min(self._live) != oldest:
+            self.__compact()
+
+    def __register(self) -> None:
+        """Records the rooms registered with the dungeon since the last
+        call, which add_room does not report, and those reachable from
+        them."""
+        size = self._dungeon.size()
+        self.__discover([self._dungeon.room(i)
+                         for i in range(self._registered, size)],
+                        self._version)
+        self._registered = size
+
+    def __discover(self, rooms: Iterable[Room], version: int) -> None:
+        """Records the passages of rooms, and of the rooms reachable from
+        them, that the log has not seen, as of version."""
+        pending = [r for r in rooms
+                   if r not in self._base and r not in self._history]
+        while len(pending) != 0:
+            room = pending.pop()
+            if room in self._base or room in self._history:
+                continue
+            self.__record(room, version)
+            pending.extend(room.neighbors())
+
+    def __record(self, room: Room, version: int) -> None:
+        """Records room's passages as of version: as its base when no
+        snapshot is live, and otherwise in its history."""
+        if len(self._live) == 0:
+            self._base[room] = room._exits
+        else:
+            self._history[room] = self._history.get(room, ()) + (
+                (version, room._exits),)
+
+    def __compact(self) -> None:
+        """Folds into the base the history older than every live snapshot
+        needs: each room's base becomes its newest passages no newer than
+        the oldest live snapshot, and only later ones are kept."""
+        oldest = min(self._live) if len(self._live) != 0 else self._version
+        for room, history in list(self._history.items()):
+            i = 0
+            while i < len(history) and history[i][0] <= oldest:
+                i += 1
+            if i == 0:
+                continue
+            self._base[room] = history[i - 1][1]
+            if i == len(history):
+                del self._history[room]
+            else:
+                self._history[room] = history[i:]
@@ -1,14 +1,34 @@
 #
 # test_dungeons_two.py: creates various dungeon configurations and provides
 #   tests that allow a rat to explore those dungeons. Also provides a
-#   main that runs all or some subset of tests.
+#   main that runs all or some subset of test_rat_1 to 7; pytest runs
+#   every test (python -m pytest).
 #
 # Author: Robert W. Hasker, 2020
 #
 
-from dungeon import Dungeon, Room, Direction
+from dungeon import Dungeon, Room, Direction, opposite, \
+    read_dungeon_from_json, read_dungeon_from_stream
+from batch import solve_batch
+from distances import bfs_distances, rooms_within, eccentricity
+from hazard_search import HazardCosts
+from dungeon_file import MappedDungeon, read_dungeon_file, write_dungeon_file
+from dungeon_shards import ShardedDungeon, write_sharded_dungeon
+from dungeon_builders import grid_dungeon, stacked_dungeon, random_dungeon, \
+    corridor_dungeon
+from path_server import PathServer
 from rat import Rat
+import rat_cli
+from search_observers import SearchMetrics
 from typing import *
+import asyncio
+import contextlib
+import io
+import json
+import os
+import pytest
+import random
+import tempfile
 
 
 def directions_for_rat(r: Rat, algorithm: str, target: Room) -> List[str]:
@@ -278,6 +298,949 @@ def test_rat_7(algorithm, debug: bool = False) -> str:
     return str(path)
 
 
+def rat_after_cave_in() -> Rat:
+    """Return the rat of test_rat_6: in dungeon x after the cave-in in stair1,
+    which leaves south2 going up to a hidden stairway instead."""
+    rat = rat_in_dungeon_x()
+    new_stairs = Room("hidden stairway", 3)
+    rat.dungeon.add_room(new_stairs)
+    rat.dungeon.find('south2').add_neighbor(new_stairs, Direction.UP)
+    return rat
+
+
+# The tests from here on are run by pytest (python -m pytest), which gives
+# those taking dungeon_rat a rat in each of the dungeons built above.
+@pytest.fixture(params=[rat_in_three_room_dungeon, rat_in_square_dungeon,
+                        rat_in_looped_dungeon, rat_in_dungeon_x,
+                        rat_after_cave_in, rat_in_fully_connected_grid],
+                ids=lambda builder: builder.__name__[4:])
+def dungeon_rat(request) -> Rat:
+    """A new rat at the start of each of the dungeons built above."""
+    return request.param()
+
+
+def some_rooms(dungeon: Any) -> List[Room]:
+    """Return every room of a small dungeon, or a spread of rooms from a
+    large one, to start and end searches at."""
+    rooms = list(dungeon.rooms())
+    return rooms if len(rooms) < 100 else rooms[::37] + rooms[-1:]
+
+
+def assert_same_paths(rat: Rat, other: Rat, names: Iterable[str]) -> None:
+    """Assert that rat and other find the same path to each named room of
+    their dungeons with every algorithm."""
+    for name in names:
+        for algorithm in ['d', 'b', 'i']:
+            assert directions_for_rat(
+                rat, algorithm, rat.dungeon.find(name)) == directions_for_rat(
+                other, algorithm, other.dungeon.find(name))
+
+
+def test_frozen_dungeons(dungeon_rat: Rat) -> None:
+    """Test that searching a frozen dungeon gives the same paths as searching
+    its rooms."""
+    d = dungeon_rat.dungeon
+    indexed_rat = Rat(d, d.start)
+    indexed_rat.set_index(d.freeze())
+    assert_same_paths(indexed_rat, dungeon_rat,
+                      [r.name for r in some_rooms(d)])
+
+
+def assert_is_path(dungeon: Dungeon, path: List[str]) -> None:
+    """Assert that each room in the named path has a passage to the next."""
+    for here, there in zip(path, path[1:]):
+        assert dungeon.find(there) in dungeon.find(here).neighbors()
+
+
+def test_bidirectional_paths(dungeon_rat: Rat) -> None:
+    """Test that bidirectional search finds a valid path of the same length as
+    breadth-first search between rooms of each dungeon, including the
+    one-way passages in rat_in_looped_dungeon, with and without an index.
+    """
+    d = dungeon_rat.dungeon
+    index = d.freeze()
+    for start in some_rooms(d):
+        for indexed in [False, True]:
+            start_rat = Rat(d, start)
+            if indexed:
+                start_rat.set_index(index)
+            for target in some_rooms(d):
+                path = start_rat.bidirectional_directions_to(target)
+                assert len(path) == len(start_rat.bfs_directions_to(target))
+                if len(path) != 0:
+                    assert path[0] == start.name and path[-1] == target.name
+                    assert_is_path(d, path)
+
+
+def test_bidirectional_after_changes() -> None:
+    """Test that a rat without an index reuses the dungeon's index between
+    bidirectional searches, and that the index is made again after the
+    cave-in of test_rat_6."""
+    rat = rat_in_dungeon_x()
+    d = rat.dungeon
+    assert len(rat.bidirectional_path_to(d.find("food"))) == 6
+    index = d.frozen()
+    rat.bidirectional_path_to(d.find("north2"))
+    assert d.frozen() is index
+    new_stairs = Room("hidden stairway", 3)
+    d.add_room(new_stairs)
+    d.find('south2').add_neighbor(new_stairs, Direction.UP)
+    assert rat.bidirectional_directions_to(d.find("food")) == \
+        ['center', 'downstairs', 'west1', 'sw2', 'sw3', 'food']
+    assert d.frozen() is not index
+
+
+def rooms_reachable_from(room: Room) -> List[str]:
+    """Return the names of the rooms that can be reached from room, found by
+    walking the passages directly rather than through a Rat."""
+    reached = [room.name]
+    pending = [room]
+    while len(pending) != 0:
+        for n in pending.pop().neighbors():
+            if n.name not in reached:
+                reached.append(n.name)
+                pending.append(n)
+    return reached
+
+
+def test_reachability(dungeon_rat: Rat) -> None:
+    """Test that Dungeon.has_path agrees with walking the passages for pairs
+    of rooms in each dungeon, including after the cave-in of test_rat_6
+    replaces a passage.
+    """
+    d = dungeon_rat.dungeon
+    for start in some_rooms(d):
+        reachable = rooms_reachable_from(start)
+        for target in d.rooms():
+            assert d.has_path(start, target) == (target.name in reachable)
+    if d.has('unconnected'):
+        assert not d.has_path(d.start, d.find('unconnected'))
+
+
+def test_reachability_while_building() -> None:
+    """Test that has_path stays right while a one-way ring of rooms is
+    built a passage at a time, in reverse, and then closed."""
+    rooms = [Room(str(i)) for i in range(50)]
+    d = Dungeon(rooms[0])
+    d.add_rooms(rooms[1:])
+    for i in range(48, -1, -1):
+        rooms[i].add_single_direction_neighbor(rooms[i + 1], Direction.EAST)
+        assert d.has_path(rooms[i], rooms[49])
+        assert not d.has_path(rooms[49], rooms[i])
+    rooms[49].add_single_direction_neighbor(rooms[0], Direction.EAST)
+    assert d.has_path(rooms[49], rooms[10])
+    rooms[20].remove_single_direction_neighbor(Direction.EAST)
+    assert not d.has_path(rooms[20], rooms[21])
+
+
+def test_reachability_as_cycles_close() -> None:
+    """Test that has_path agrees with walking the passages after each of a
+    run of random one-way and two-way passages, as they join rooms into
+    ever larger cycles."""
+    rooms = [Room(str(i)) for i in range(30)]
+    d = Dungeon(rooms[0])
+    d.add_rooms(rooms[1:])
+    choose = random.Random(7)
+    for i in range(80):
+        a, b = choose.sample(rooms, 2)
+        direction = choose.choice(list(Direction))
+        if choose.random() < 0.5:
+            a.add_single_direction_neighbor(b, direction)
+        else:
+            a.add_neighbor(b, direction)
+        for start in rooms[::3]:
+            reachable = rooms_reachable_from(start)
+            for target in rooms:
+                assert d.has_path(start, target) == \
+                    (target.name in reachable)
+
+
+def test_path_cache() -> None:
+    """Test that breadth-first paths read from a dungeon's path cache match
+    uncached searches, and that the cave-in of test_rat_6 is not answered
+    from a stale tree.
+    """
+    rat = rat_in_dungeon_x()
+    uncached = [rat.bfs_directions_to(r) for r in rat.dungeon.rooms()]
+    cache = rat.dungeon.enable_path_cache(max_trees=2)
+    cached = [rat.bfs_directions_to(r) for r in rat.dungeon.rooms()]
+    assert cached == uncached
+    assert cache.misses == 1 and cache.hits == rat.dungeon.size() - 1
+    for start in ['north2', 'food', 'center']:
+        Rat(rat.dungeon, rat.dungeon.find(start)).bfs_path_to(rat.dungeon.start)
+    assert cache.evictions == 2
+    south2 = rat.dungeon.find('south2')
+    new_stairs = Room("hidden stairway", 3)
+    rat.dungeon.add_room(new_stairs)
+    south2.add_neighbor(new_stairs, Direction.UP)
+    assert rat.bfs_directions_to(rat.dungeon.find("food")) == \
+        ['center', 'downstairs', 'west1', 'sw2', 'sw3', 'food']
+    assert cache.invalidations == 1
+
+
+def test_paths_to_many(dungeon_rat: Rat) -> None:
+    """Test that paths_to_many agrees with bfs_directions_to for every room of
+    each dungeon, searching the rooms, the dungeon's path cache (also once
+    a passage into another dungeon leaves it unable to cache the start) and
+    a frozen index.
+    """
+    d = dungeon_rat.dungeon
+    targets = list(d.rooms())
+    for mode in ["rooms", "cached", "untracked", "indexed"]:
+        if mode == "cached":
+            d.enable_path_cache()
+        elif mode == "untracked":
+            elsewhere = Dungeon(Room("elsewhere"))
+            d.start.add_single_direction_neighbor(elsewhere.start,
+                                                  Direction.DOWN)
+            assert not d.tracks(d.start)
+            misses = d.path_cache.misses
+        elif mode == "indexed":
+            assert d.path_cache.misses == misses
+            dungeon_rat.set_index(d.freeze())
+        paths = dungeon_rat.directions_to_many(targets)
+        assert len(paths) == len(targets)
+        for target in targets:
+            assert paths[target.name] == dungeon_rat.bfs_directions_to(target)
+
+
+def assert_dungeons_match(original: Dungeon, copy: Dungeon) -> None:
+    """Assert that copy has the same start, rooms, room fields and passages
+    as original."""
+    assert copy.start.name == original.start.name
+    assert copy.size() == original.size()
+    for room in original.rooms():
+        other = copy.find(room.name)
+        assert (other.level, other.trap, other.monster) == \
+               (room.level, room.trap, room.monster)
+        for d in Direction:
+            n = room.neighbor_to(d)
+            m = other.neighbor_to(d)
+            assert (n is None and m is None) or n.name == m.name
+
+
+def test_json_round_trip(dungeon_rat: Rat) -> None:
+    """Test that each dungeon, with traps and monsters in some rooms,
+    survives being written to JSON and read back, also a couple of rooms
+    at a time, and that rats find the same paths in the copy.
+    """
+    d = dungeon_rat.dungeon
+    rooms = list(d.rooms())
+    rooms[-1].trap = "spikes"
+    rooms[len(rooms) // 2].monster = "troll"
+    source = d.to_json()
+    copy = read_dungeon_from_json(source)
+    assert_dungeons_match(d, copy)
+    assert copy.to_json() == source
+    assert read_dungeon_from_stream(io.StringIO(source), 2).to_json() \
+        == source
+    assert_same_paths(Rat(copy, copy.start), dungeon_rat,
+                      [r.name for r in some_rooms(d)])
+
+
+def test_dungeon_file_round_trip(dungeon_rat: Rat) -> None:
+    """Test that each dungeon written in the binary format can be both
+    mapped and read back whole, and that a rat searching the mapped file
+    directly finds the same paths as one searching the original rooms.
+    """
+    d = dungeon_rat.dungeon
+    d.start.trap = "pit"
+    names = [r.name for r in some_rooms(d)]
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "dungeon.bin")
+        write_dungeon_file(d, path)
+        assert_dungeons_match(d, read_dungeon_file(path))
+        with MappedDungeon(path) as mapped:
+            walking_rat = Rat(mapped, mapped.start)  # reads MappedRooms
+            assert_same_paths(walking_rat, dungeon_rat, names)
+            del walking_rat
+        with MappedDungeon(path) as mapped:
+            assert_dungeons_match(d, mapped)
+            mapped_rat = Rat(mapped, mapped.start)
+            mapped_rat.set_index(mapped.freeze())
+            assert_same_paths(mapped_rat, dungeon_rat, names)
+            del mapped_rat
+
+
+def test_unregistered_rooms_in_files() -> None:
+    """Test that a mapped file used as an index can be searched through a
+    room that is reachable but not registered with the dungeon."""
+    a = Room("a")
+    hidden = Room("hidden")
+    goal = Room("goal")
+    d = Dungeon(a)
+    d.add_room(goal)
+    a.add_neighbor(hidden, Direction.EAST)
+    hidden.add_neighbor(goal, Direction.EAST)
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "dungeon.bin")
+        write_dungeon_file(d, path)
+        with MappedDungeon(path) as mapped:
+            assert mapped.size() == 2 and mapped.room_count() == 3
+            assert not mapped.has("hidden")
+            rat = Rat(mapped, mapped.start)
+            rat.set_index(mapped)
+            for algorithm in ['d', 'b', 'i']:
+                assert directions_for_rat(rat, algorithm, mapped.find(
+                    "goal")) == ["a", "hidden", "goal"]
+            assert rat.bidirectional_directions_to(mapped.find("goal")) == \
+                ["a", "hidden", "goal"]
+            distance, predecessor = bfs_distances(mapped, 0)
+            assert distance[mapped.id_of("hidden")] == 1
+            assert distance[mapped.id_of("goal")] == 2
+            del rat
+
+
+def test_bfs_distances(dungeon_rat: Rat) -> None:
+    """Test that layer-at-a-time distances and predecessors agree with the
+    paths breadth-first search finds from rooms of each dungeon.
+    """
+    d = dungeon_rat.dungeon
+    index = d.freeze()
+    for start in some_rooms(d):
+        distance, predecessor = bfs_distances(index, index.id_of(start.name))
+        start_rat = Rat(d, start)
+        for target in d.rooms():
+            path = start_rat.bfs_directions_to(target)
+            room = index.id_of(target.name)
+            assert distance[room] == len(path) - 1
+            if len(path) > 1:
+                assert index.names[predecessor[room]] == path[-2]
+
+
+def test_grid_distances() -> None:
+    """Test eccentricity, rooms_within and distances from several sources
+    on the grid of test_rat_7."""
+    grid = rat_in_fully_connected_grid().dungeon.freeze()
+    assert eccentricity(grid, 0) == 38
+    assert len(rooms_within(grid, 0, 2)) == 6
+    distance, predecessor = bfs_distances(grid, [0, grid.id_of('19,19')])
+    assert max(distance) == 19
+
+
+def test_batch_solver() -> None:
+    """Test that solving a batch of queries in worker processes gives the
+    same paths, in the same order, as a rat answering them one at a time,
+    including paths through a room that is not registered, and that queries
+    naming unknown or unregistered rooms or algorithms get messages without
+    stopping the batch.
+    """
+    rat = rat_in_dungeon_x()
+    hidden = Room("hidden", 1)
+    rat.dungeon.find("north2").add_neighbor(hidden, Direction.EAST)
+    hidden.add_neighbor(rat.dungeon.find("east1"), Direction.SOUTH)
+    names = [r.name for r in rat.dungeon.rooms()]
+    queries = [(a, b, algorithm) for a in names for b in names
+               for algorithm in ['d', 'b', 'i']]
+    expected = [directions_for_rat(Rat(rat.dungeon, rat.dungeon.find(a)),
+                                   algorithm, rat.dungeon.find(b))
+                for a, b, algorithm in queries]
+    assert ["north2", "hidden", "east1"] in expected
+    queries[5:5] = [("center", "nowhere", 'b'), ("hidden", "food", 'd'),
+                    ("center", "food", 'x')]
+    expected[5:5] = ["unknown room: nowhere", "unknown room: hidden",
+                     "invalid algorithm code: x"]
+    assert solve_batch(rat.dungeon, queries, processes=1) == expected
+    assert solve_batch(rat.dungeon, queries, processes=2,
+                       chunk_size=50) == expected
+
+
+def assert_tracked_paths_match(tracked: Rat) -> None:
+    """Assert that tracked gives the same breadth-first paths as a new rat
+    at the same start searching the dungeon as it is now."""
+    fresh = Rat(tracked.dungeon, tracked.track_paths().start)
+    for target in tracked.dungeon.rooms():
+        assert tracked.bfs_directions_to(target) == \
+            fresh.bfs_directions_to(target)
+
+
+def test_dynamic_paths() -> None:
+    """Test that a rat tracking its paths repairs them after the cave-in of
+    test_rat_6, after passages are removed and after they are reopened,
+    giving the paths a fresh search would.
+    """
+    rat = rat_in_dungeon_x()
+    rat.track_paths()
+    assert_tracked_paths_match(rat)
+    south2 = rat.dungeon.find('south2')
+    new_stairs = Room("hidden stairway", 3)
+    rat.dungeon.add_room(new_stairs)
+    south2.add_neighbor(new_stairs, Direction.UP)
+    assert rat.bfs_directions_to(rat.dungeon.find("food")) == \
+        ['center', 'downstairs', 'west1', 'sw2', 'sw3', 'food']
+    assert_tracked_paths_match(rat)
+    grid = rat_in_fully_connected_grid()
+    grid.track_paths()
+    cave_ins = [("1,0", Direction.NORTH), ("0,1", Direction.WEST),
+                ("5,5", Direction.NORTH), ("5,5", Direction.WEST),
+                ("1,1", Direction.NORTH)]
+    for name, direction in cave_ins:
+        grid.dungeon.find(name).remove_neighbor(direction)
+        assert_tracked_paths_match(grid)
+    for name, direction in reversed(cave_ins):
+        room = grid.dungeon.find(name)
+        row, col = [int(x) for x in name.split(",")]
+        other = "%d,%d" % ((row - 1, col) if direction == Direction.NORTH
+                           else (row, col - 1))
+        room.add_neighbor(grid.dungeon.find(other), direction)
+        assert_tracked_paths_match(grid)
+    grid.dungeon.find("0,1").remove_single_direction_neighbor(Direction.WEST)
+    assert_tracked_paths_match(grid)
+    grid.stop_tracking_paths()
+
+
+def test_compact_rooms() -> None:
+    """Test that rooms keep their passages in direction order through
+    replacements and removals, that opposite() pairs up every direction,
+    and that rooms are numbered in the order they are registered.
+    """
+    pairs = [(Direction.EAST, Direction.WEST), (Direction.NORTH,
+             Direction.SOUTH), (Direction.UP, Direction.DOWN)]
+    for a, b in pairs:
+        assert opposite(a) == b and opposite(b) == a
+    hub = Room("hub")
+    spokes = [Room("spoke" + str(d.value)) for d in Direction]
+    for d in reversed(list(Direction)):
+        hub.add_single_direction_neighbor(spokes[d.value - 1], d)
+    assert hub.neighbors() == spokes
+    hub.add_single_direction_neighbor(spokes[0], Direction.NORTH)
+    hub.remove_single_direction_neighbor(Direction.WEST)
+    hub.remove_single_direction_neighbor(Direction.WEST)
+    assert hub.neighbor_to(Direction.WEST) is None
+    assert hub.neighbor_to(Direction.NORTH) is spokes[0]
+    assert hub.passages() == [(Direction.EAST, spokes[0]),
+                              (Direction.NORTH, spokes[0]),
+                              (Direction.SOUTH, spokes[3]),
+                              (Direction.UP, spokes[4]),
+                              (Direction.DOWN, spokes[5])]
+    assert not hasattr(hub, "__dict__")
+    rat = rat_in_dungeon_x()
+    assert rat.dungeon.start.id == 0
+    for room in rat.dungeon.rooms():
+        assert rat.dungeon.room(room.id) is room
+    assert [r.id for r in rat.dungeon.rooms()] == \
+        list(range(rat.dungeon.size()))
+
+
+def test_dungeon_builders() -> None:
+    """Test that the bulk-built grid matches the grid of test_rat_7, that a
+    stack of grids is joined by its stairs, and that a bad batch of
+    passages is rejected before any passage is added.
+    """
+    assert_dungeons_match(rat_in_fully_connected_grid().dungeon,
+                         grid_dungeon(20, 20))
+    d = stacked_dungeon(3, 4, 5, [(2, 3)])
+    assert d.size() == 60 and d.find("3:3,4").level == 3
+    assert d.find("1:2,3").neighbor_to(Direction.UP) is d.find("2:2,3")
+    assert d.find("2:2,3").neighbor_to(Direction.DOWN) is d.find("1:2,3")
+    assert d.find("2:2,2").neighbor_to(Direction.UP) is None
+    path = Rat(d, d.start).bfs_directions_to(d.find("3:0,0"))
+    assert len(path) == 13 and path[5:8] == ["1:2,3", "2:2,3", "3:2,3"]
+    a = d.find("1:0,0")
+    b = d.find("1:3,4")
+    rejected = False
+    try:
+        d.add_passages([(a, b, Direction.DOWN), (b, b, Direction.UP)])
+    except AssertionError:
+        rejected = True
+    assert rejected and a.neighbor_to(Direction.DOWN) is None
+    d.add_passages([(a, b, Direction.DOWN, True)])
+    assert a.neighbor_to(Direction.DOWN) is b
+    assert b.neighbor_to(Direction.UP) is None
+    assert d.has_path(b, a)
+    assert random_dungeon(100, 150, 7).size() == 100
+
+
+def test_search_observers() -> None:
+    """Test that search metrics agree between Room and index searches (but
+    for the frontier, which the index searches keep smaller), that visits
+    are reported in the order the echo prints them, and that a
+    sampling observer only sees some queries.
+    """
+    rat = rat_in_dungeon_x()
+    indexed = rat_in_dungeon_x()
+    indexed.set_index(indexed.dungeon.freeze())
+    for algorithm, method in [('d', "path_to"), ('b', "bfs_path_to"),
+                              ('i', "id_path_to")]:
+        stats = []
+        for r in [rat, indexed]:
+            visits: List[str] = []
+            metrics = SearchMetrics(
+                on_visit=lambda name, s: visits.append(name))
+            r.add_observer(metrics)
+            path = getattr(r, method)(r.dungeon.find("food"))
+            r.remove_observer(metrics)
+            last = metrics.last
+            assert last.algorithm in ["dfs", "bfs", "id"]
+            assert last.path_length == len(path) and last.target == "food"
+            assert last.rooms_expanded == len(visits)
+            assert last.max_frontier > 0
+            stats.append((visits, last.neighbors_generated,
+                          last.depth_passes))
+        assert stats[0] == stats[1]
+        assert (stats[0][2] != 0) == (algorithm == 'i')
+        echo = io.StringIO()
+        with contextlib.redirect_stdout(echo):
+            directions_for_rat(Rat(rat.dungeon, rat.dungeon.start), algorithm,
+                               rat.dungeon.find("food"))
+            echoing = Rat(rat.dungeon, rat.dungeon.start)
+            echoing.set_echo_rooms_searched()
+            echoing.set_echo_rooms_searched()
+            directions_for_rat(echoing, algorithm, rat.dungeon.find("food"))
+        assert echo.getvalue() == "".join("Visiting: " + name + "\n"
+                                          for name in stats[0][0])
+    sampled = SearchMetrics(sample_every=3)
+    rat.add_observer(sampled)
+    for target in rat.dungeon.rooms():
+        rat.bfs_path_to(target)
+    assert sampled.queries == (rat.dungeon.size() + 2) // 3
+
+
+def test_resumable_search() -> None:
+    """Test that searches run a few rooms at a time find the same paths as
+    the blocking searches, that a search left unfinished can be resumed or
+    cancelled, and that changing the dungeon marks a search stale.
+    """
+    rat = rat_in_dungeon_x()
+    for target in rat.dungeon.rooms():
+        for algorithm in "dbi":
+            search = rat.start_search(target, algorithm)
+            path = search.run(max_rooms=2)
+            while path is None:
+                path = search.run(max_rooms=2)
+            assert path == search.path
+            assert [x.name for x in path] == \
+                directions_for_rat(rat, algorithm, target)
+    food = rat.dungeon.find("food")
+    search = rat.start_search(food, 'b')
+    first = search.step()
+    assert first is rat.dungeon.start and search.run(max_rooms=0) is None
+    rooms = [first] + list(search)
+    assert search.done and search.expanded == len(rooms)
+    assert search.run() == rat.bfs_path_to(food)
+    search = rat.start_search(food, 'i')
+    search.run(max_rooms=3)
+    search.cancel()
+    assert search.done and search.path == [] and search.step() is None
+    annex = Room("annex")
+    rat.dungeon.add_room(annex)
+    search = rat.start_search(annex, 'd')
+    assert search.run() == [] and search.expanded == 0
+    search = rat.start_search(food, 'd')
+    search.run(seconds=0)
+    assert search.expanded == 1 and not search.stale
+    rat.dungeon.add_room(Room("cellar"))
+    assert search.stale
+
+
+def test_path_server() -> None:
+    """Test that the path server answers as a rat would, that breadth-first
+    requests from one start room share a search and repeats come from the
+    cache, and that requests over a socket get answers or errors.
+    """
+    rat = rat_in_dungeon_x()
+    d = rat.dungeon
+    names = [r.name for r in d.rooms()]
+
+    async def run() -> List[Dict[str, Any]]:
+        server = PathServer(d)
+        try:
+            paths = await asyncio.gather(*[
+                server.query(d.start.name, name, 'b') for name in names])
+            assert paths == [rat.bfs_directions_to(d.find(name))
+                             for name in names]
+            assert server.searches == 1
+            for algorithm in "di":
+                paths = await asyncio.gather(*[
+                    server.query(d.start.name, "food", algorithm)
+                    for i in range(3)])
+                assert paths == [directions_for_rat(rat, algorithm,
+                                                    d.find("food"))] * 3
+            assert server.searches == 3
+            await server.query(d.start.name, "food", 'b')
+            assert server.hits == 1
+            listener = await server.serve_tcp()
+            async with listener:
+                reader, writer = await asyncio.open_connection(
+                    *listener.sockets[0].getsockname()[:2])
+                lines = [{"id": 1, "start": "food", "target": d.start.name,
+                          "algorithm": 'b'},
+                         {"id": 2, "start": "nowhere", "target": "food"},
+                         {"id": 3, "start": "food"}]
+                writer.write("".join(json.dumps(x) + "\n"
+                                     for x in lines).encode() + b"[\n")
+                writer.write_eof()
+                responses = [json.loads(line) for line in
+                             (await reader.read()).splitlines()]
+                writer.close()
+            return sorted(responses, key=lambda x: str(x["id"]))
+        finally:
+            server.close()
+
+    responses = asyncio.run(run())
+    assert responses[0]["path"] == Rat(d, d.find("food")).bfs_directions_to(
+        d.start)
+    assert responses[1]["error"] == "unknown room: nowhere"
+    assert "error" in responses[2] and responses[3]["id"] is None
+
+
+def test_path_server_edits() -> None:
+    """Test that requests made to the path server after the cave-in of
+    test_rat_6 do not join searches of the dungeon as it was, that answers
+    to those searches are not cached, and that callers get their own copy
+    of a cached path.
+    """
+    d = rat_in_dungeon_x().dungeon
+    before = {algorithm: directions_for_rat(rat_in_dungeon_x(), algorithm,
+                                            d.find("food"))
+              for algorithm in "bi"}
+    after = {algorithm: directions_for_rat(rat_after_cave_in(), algorithm,
+                                           d.find("food"))
+             for algorithm in "bi"}
+    assert before['b'] != after['b']
+
+    async def run() -> None:
+        server = PathServer(d, batch_delay=0.05)
+        try:
+            first = [asyncio.ensure_future(server.query(d.start.name, "food",
+                                                        algorithm))
+                     for algorithm in "bi"]
+            await asyncio.sleep(0)
+            new_stairs = Room("hidden stairway", 3)
+            d.add_room(new_stairs)
+            d.find('south2').add_neighbor(new_stairs, Direction.UP)
+            for algorithm in "bi":
+                path = await server.query(d.start.name, "food", algorithm)
+                assert path == after[algorithm]
+            assert [await x for x in first] == [before['b'], before['i']]
+            assert server.searches == 4
+            for algorithm in "bi":
+                path = await server.query(d.start.name, "food", algorithm)
+                assert path == after[algorithm]
+                path.append("elsewhere")
+            assert server.hits == 2 and server.searches == 4
+            assert await server.query(d.start.name, "food", 'b') == after['b']
+        finally:
+            server.close()
+
+    async def cave_in() -> None:
+        rat = rat_in_three_room_dungeon()
+        three = rat.dungeon
+        server = PathServer(three, batch_delay=0.05)
+        try:
+            queued = [asyncio.ensure_future(server.query("start here", "two",
+                                                         algorithm))
+                      for algorithm in "dbi"]
+            await asyncio.sleep(0)
+            three.find("one").remove_neighbor(Direction.NORTH)
+            for path in [await x for x in queued]:
+                assert path == ["start here", "one", "two"]
+            assert await server.query("start here", "two", 'b') == []
+        finally:
+            server.close()
+
+    asyncio.run(run())
+    asyncio.run(cave_in())
+
+
+def test_cli_batch() -> None:
+    """Test that the batch command line answers JSON and tab-separated
+    queries over JSON and binary dungeon files and generated dungeons as a
+    rat would, reporting bad queries without stopping.
+    """
+    rat = rat_in_dungeon_x()
+    d = rat.dungeon
+    queries = [json.dumps({"start": d.start.name, "target": "food",
+                           "algorithm": "i"}),
+               d.start.name + "\tfood", "food\t" + d.start.name + "\tb", "",
+               json.dumps({"start": "nowhere", "target": "food"}),
+               "food\tfood\tx"]
+    with tempfile.TemporaryDirectory() as folder:
+        paths = [os.path.join(folder, "dungeon.json"),
+                 os.path.join(folder, "dungeon.bin")]
+        with open(paths[0], "w") as out:
+            d.write_json(out)
+        write_dungeon_file(d, paths[1])
+        with open(os.path.join(folder, "queries"), "w") as out:
+            out.write("\n".join(queries) + "\n")
+        for path in paths:
+            results_path = os.path.join(folder, "results")
+            status = rat_cli.main(["--dungeon", path, "--queries",
+                                   os.path.join(folder, "queries"),
+                                   "--output", results_path])
+            with open(results_path) as source:
+                results = [json.loads(line) for line in source]
+            assert status == 1 and len(results) == 5
+            assert results[0]["path"] == rat.id_directions_to(d.find("food"))
+            assert results[1]["path"] == rat.directions_to(d.find("food"))
+            assert results[1]["algorithm"] == 'd'
+            assert results[2]["path"] == Rat(d, d.find(
+                "food")).bfs_directions_to(d.start)
+            assert results[3]["error"] == "unknown room: nowhere"
+            assert "error" in results[4] and results[4]["seconds"] >= 0
+    out = io.StringIO()
+    answered, failed = rat_cli.answer_queries(
+        rat_cli.generate_dungeon("grid:20,20"), ["0,0\t19,19"], 'b', out)
+    grid = rat_in_fully_connected_grid()
+    assert (answered, failed) == (1, 0)
+    assert json.loads(out.getvalue())["path"] == grid.bfs_directions_to(
+        grid.dungeon.find("19,19"))
+    out = io.StringIO()
+    assert rat_cli.answer_queries(grid.dungeon, ['{"start": 0, "target": 1}'],
+                                  'b', out) == (0, 1)
+    assert "strings" in json.loads(out.getvalue())["error"]
+
+
+def test_hierarchical_paths() -> None:
+    """Test that hierarchical search over the levels of dungeon x and of a
+    stack of grids finds the breadth-first paths, including after stairs
+    are removed and added, and that a change rebuilds only the levels it
+    touches.
+    """
+    rat = rat_in_dungeon_x()
+    d = rat.dungeon
+    for start in d.rooms():
+        r = Rat(d, start)
+        for target in d.rooms():
+            assert r.hierarchical_path_to(target) == r.bfs_path_to(target)
+    d = stacked_dungeon(4, 5, 5, [(0, 4), (4, 0)])
+    levels = d.enable_level_paths()
+    assert levels.levels_rebuilt == 4
+    rat = Rat(d, d.find("1:2,2"))
+    corner = d.find("4:2,2")
+    assert rat.hierarchical_directions_to(corner) == \
+        rat.bfs_directions_to(corner)
+    d.find("2:0,4").remove_neighbor(Direction.UP)
+    assert rat.hierarchical_path_to(corner) == rat.bfs_path_to(corner)
+    assert levels.levels_rebuilt == 6
+    d.find("4:1,1").remove_neighbor(Direction.EAST)
+    d.find("3:2,2").add_neighbor(d.find("4:2,2"), Direction.UP)
+    assert rat.hierarchical_path_to(corner) == rat.bfs_path_to(corner)
+    assert levels.levels_rebuilt == 8
+    assert levels.distance(d.find("1:2,2"), corner) == \
+        len(rat.bfs_path_to(corner)) - 1
+    attic = Room("attic", 5)
+    d.add_room(attic)
+    assert rat.hierarchical_path_to(attic) == []
+    corner.add_single_direction_neighbor(attic, Direction.UP)
+    assert rat.hierarchical_directions_to(attic)[-2:] == ["4:2,2", "attic"]
+    assert Rat(d, attic).hierarchical_path_to(corner) == []
+
+
+def test_corridor_paths() -> None:
+    """Test that breadth-first search over the corridor overlay finds the
+    same paths as searching room by room, in dungeon x and in a grid of
+    corridors, and that a passage added inside a corridor splits it without
+    walking the rest of the dungeon again.
+    """
+    rat = rat_in_dungeon_x()
+    d = rat.dungeon
+    expected = {(a, b): Rat(d, a).bfs_path_to(b)
+                for a in d.rooms() for b in d.rooms()}
+    d.enable_corridors()
+    for (a, b), path in expected.items():
+        assert Rat(d, a).bfs_path_to(b) == path
+    d = corridor_dungeon(4, 4, 5)
+    rooms = list(d.rooms())
+    pairs = [(rooms[i], rooms[(i * 7 + 3) % len(rooms)])
+             for i in range(0, len(rooms), 5)]
+    expected = {pair: Rat(d, pair[0]).bfs_directions_to(pair[1])
+                for pair in pairs}
+    corridors = d.enable_corridors()
+    assert corridors.junctions() == 12  # the corners pass straight through
+    assert corridors.corridor(d.find("1,1-e.2")) == \
+        [d.find("1,1")] + [d.find("1,1-e.%d" % i) for i in range(5)] + \
+        [d.find("1,2")]
+    for (a, b), names in expected.items():
+        assert Rat(d, a).bfs_directions_to(b) == names
+    walked = corridors.corridors_walked
+    d.find("1,1-e.2").add_neighbor(d.find("2,1-e.2"), Direction.UP)
+    rat = Rat(d, d.find("1,1-e.0"))
+    assert rat.bfs_directions_to(d.find("2,1-e.4")) == \
+        ["1,1-e.0", "1,1-e.1", "1,1-e.2", "2,1-e.2", "2,1-e.3", "2,1-e.4"]
+    assert corridors.junctions() == 14
+    split = corridors.corridor(d.find("1,1-e.1"))
+    assert split[0] is d.find("1,1") and split[-1] is d.find("1,1-e.2")
+    assert corridors.corridors_walked - walked < 30
+    d.find("1,1-e.2").remove_neighbor(Direction.UP)
+    for (a, b), names in expected.items():
+        assert Rat(d, a).bfs_directions_to(b) == names
+
+
+def test_snapshots() -> None:
+    """Test that a rat pinned to a snapshot finds the paths the dungeon had
+    when the snapshot was taken while the dungeon is edited, that the
+    snapshot does not see rooms added later, and that the edits kept for
+    snapshots are dropped once the snapshots are released.
+    """
+    rat = rat_in_fully_connected_grid()
+    d = rat.dungeon
+    corner = d.find("19,19")
+    before = rat.bfs_directions_to(corner)
+    far = rat.id_directions_to(d.find("3,3"))
+    snapshot = d.snapshot()
+    assert d.snapshot_log.kept() == 0
+    for row in range(20):
+        d.find("%d,9" % row).remove_neighbor(Direction.EAST)
+    cellar = Room("cellar")
+    d.add_room(cellar)
+    d.find("0,0").add_neighbor(cellar, Direction.DOWN)
+    cellar.add_neighbor(corner, Direction.EAST)
+    assert rat.bfs_directions_to(corner) == ["0,0", "cellar", "19,19"]
+    assert d.snapshot_log.kept() == 45  # the cellar is recorded when found
+    rat.pin(snapshot)
+    assert rat.bfs_directions_to(corner) == before
+    search = rat.start_search(corner, 'b')
+    assert [x.name for x in search.run()] == before and not search.stale
+    assert rat.id_directions_to(d.find("3,3")) == far
+    assert rat.paths_to_many([cellar])[cellar] == []
+    assert snapshot.neighbors(cellar) == []
+    assert not snapshot.has("cellar") and snapshot.size() == 400
+    assert d.snapshot().has("cellar")
+    with d.snapshot() as later:
+        rat.pin(later)
+        assert rat.bfs_directions_to(corner) == ["0,0", "cellar", "19,19"]
+        snapshot.release()
+        assert d.snapshot_log.kept() == 0
+        d.find("0,0").remove_neighbor(Direction.DOWN)
+        assert rat.bfs_directions_to(corner) == ["0,0", "cellar", "19,19"]
+    rat.unpin()
+    assert rat.bfs_directions_to(corner) == []
+    assert d.snapshot_log.kept() == 0
+
+
+def test_sharded_dungeon() -> None:
+    """Test that a dungeon written as one shard per level is read back a
+    level at a time, that rats find the same paths in it as in the original
+    rooms, that the least recently used shard is evicted when too many are
+    loaded, and that the levels up and down the stairs are read ahead and
+    found ready.
+    """
+    d = stacked_dungeon(5, 4, 4, [(0, 0), (3, 3)])
+    d.find("2:1,1").trap = "pit"
+    d.find("4:2,2").monster = "orc"
+    with tempfile.TemporaryDirectory() as folder:
+        write_sharded_dungeon(d, folder, bucket_size=16)
+        with ShardedDungeon(folder, max_shards=2, prefetch=False) as sharded:
+            assert sharded.size() == 80 and sharded.has("3:2,1")
+            assert not sharded.has("6:0,0")
+            room = sharded.find("3:2,1")
+            assert sharded.shards_cached() == []
+            assert room is sharded.find("3:2,1")
+            assert [x.name for x in room.neighbors()] == \
+                [x.name for x in d.find("3:2,1").neighbors()]
+            assert sharded.shards_cached() == [3]
+            assert [x.name for x in sharded.rooms_with_trap("pit")] == \
+                ["2:1,1"]
+            assert sharded.monster_names() == ["orc"]
+            assert sharded.find("4:2,2").monster == "orc"
+            assert sharded.shards_cached() == [2, 4]
+            assert sharded.evictions == 1
+            for start, target in [("1:1,1", "5:2,2"), ("5:3,0", "1:0,3"),
+                                  ("3:0,0", "3:3,3")]:
+                assert_same_paths(Rat(sharded, sharded.find(start)),
+                                  Rat(d, d.find(start)), [target])
+            assert len(sharded.shards_cached()) == 2
+            assert 0 < sharded.hit_rate() < 1
+        with ShardedDungeon(folder, max_shards=5) as sharded:
+            Rat(sharded, sharded.find("1:0,0")).bfs_path_to(
+                sharded.find("5:0,0"))
+            assert sharded.prefetches == 3 and sharded.prefetch_hits == 3
+            assert sharded.hits + sharded.misses > 5
+        with ShardedDungeon(folder, max_shards=5) as sharded:
+            sharded.find("1:0,0").neighbors()
+            sharded.wait_for_reads()
+            assert sharded.find("2:0,0").trap is None
+            assert sharded.misses == 1 and sharded.hits == 1
+            assert sharded.prefetch_hits == 1
+
+
+def test_hazard_paths() -> None:
+    """Test that the trap and monster index follows rooms as hazards are
+    set, that the safest path steers around costly rooms and avoided ones,
+    and that with no hazards it is the breadth-first path.
+    """
+    rat = rat_in_fully_connected_grid()
+    d = rat.dungeon
+    corner = d.find("19,19")
+    assert rat.safest_path_to(corner) == rat.bfs_path_to(corner)
+    assert rat.safest_path_to(corner, avoid=[d.find("5,5")]) == \
+        rat.bfs_path_to(corner)
+    for row in range(1, 20):
+        d.find("%d,0" % row).trap = "spikes"
+    for row in range(0, 19):
+        d.find("%d,1" % row).monster = "troll"
+    d.find("19,19").monster = "rat"
+    assert len(d.rooms_with_trap("spikes")) == 19
+    assert d.rooms_with_monster("troll")[0] is d.find("0,1")
+    d.find("19,19").monster = None
+    d.find("3,0").trap = "pit"
+    assert sorted(d.trap_names()) == ["pit", "spikes"]
+    assert d.monster_names() == ["troll"]
+    assert len(d.rooms_with_trap("spikes")) == 18
+    costs = HazardCosts({"spikes": 2}, {"troll": 50})
+    path = rat.safest_path_to(corner, costs)
+    assert len(path) == 39 and path[19].name == "19,0"
+    assert costs.path_cost(path) == 38 + 2 * 18 + 5
+    costs.traps["spikes"] = 100
+    path = rat.safest_path_to(corner, costs)
+    assert len(path) == 39 and costs.path_cost(path) == 38 + 50
+    costs.avoid_traps.add("spikes")
+    assert rat.safest_path_to(d.find("5,0"), costs) == []
+    path = rat.safest_directions_to(d.find("3,0"), costs)
+    assert path[-2:] == ["3,1", "3,0"] and "1,0" not in path
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "grid.bin")
+        write_dungeon_file(d, path)
+        with MappedDungeon(path) as mapped:
+            assert [r.name for r in mapped.rooms_with_trap("pit")] == ["3,0"]
+            assert sorted(mapped.trap_names()) == ["pit", "spikes"]
+            assert len(mapped.rooms_with_monster("troll")) == 19
+
+
+def test_astar_paths() -> None:
+    """Test that A* search finds paths as short as breadth-first search over
+    a grid and a stack of levels while expanding far fewer rooms, that it
+    falls back to breadth-first search once a passage bends the layout, and
+    that it follows passages removed later.
+    """
+    rat = rat_in_fully_connected_grid()
+    d = rat.dungeon
+    corner = d.find("19,19")
+    bfs, astar = SearchMetrics(), SearchMetrics()
+    rat.add_observer(bfs)
+    path = rat.bfs_path_to(corner)
+    rat.remove_observer(bfs)
+    rat.add_observer(astar)
+    assert len(rat.astar_path_to(corner)) == len(path) == 39
+    rat.remove_observer(astar)
+    assert bfs.rooms_expanded == 400 and astar.rooms_expanded == 39
+    assert astar.last.algorithm == "astar"
+    region = d.layout.region(d.find("0,0"))
+    assert region.consistent and region.places[corner] == (19, 19, 0)
+    for start, target in [("0,0", "7,12"), ("13,2", "0,18"), ("5,5", "5,5")]:
+        other = Rat(d, d.find(start))
+        path = other.astar_directions_to(d.find(target))
+        assert len(path) == len(other.bfs_path_to(d.find(target)))
+        assert path[0] == start and path[-1] == target
+    d.find("0,0").add_neighbor(d.find("19,18"), Direction.UP)
+    assert not d.layout.region(d.find("0,0")).consistent
+    assert rat.astar_path_to(corner) == rat.bfs_path_to(corner)
+    d.find("0,0").remove_neighbor(Direction.UP)
+    d.find("0,0").remove_neighbor(Direction.SOUTH)
+    assert d.layout.region(d.find("0,0")).consistent
+    assert rat.astar_directions_to(d.find("1,0")) == ["0,0", "0,1", "1,1",
+                                                       "1,0"]
+    d = stacked_dungeon(4, 8, 8, [(0, 0), (7, 7)])
+    rat = Rat(d, d.find("1:3,3"))
+    for target in ["4:4,4", "2:0,7", "1:3,3"]:
+        assert len(rat.astar_path_to(d.find(target))) == \
+            len(rat.bfs_path_to(d.find(target)))
+    lonely = Room("lonely")
+    d.add_room(lonely)
+    assert rat.astar_path_to(lonely) == []
+
+
 def run_first_six(algorithm, debug: bool = False) -> None:
     """Runs test cases 1-6, the ones that work for all algorithms.
     When debug is true, makes the rat echo rooms as they are searched.